@@ -0,0 +1,376 @@
+# FILE: Access control lists
+
+
+# DEPENDENCIES
+import bisect
+import re
+import time
+from collections import OrderedDict
+from typing import AbstractSet, Iterable
+
+
+# CONSTANTS
+ADMIN = "admin"  # Permission decisions
+ADMIN_ONLY = "admin_only"
+ALLOWED = "allowed"
+DISALLOWED = "disallowed"
+
+SNOWFLAKE_SEPARATORS = re.compile(r"[\s,;]+")  # Between ids in an imported file
+SNOWFLAKE_WRAPPERS = "<@!&#>\"'"  # Stripped from ids, so mentions and quoted CSV fields work
+
+
+# CLASSES
+class ACLIndex:
+
+    # CLASS: The whitelist, blacklist and admin lists in data, held as sets of ints (see snowflakes.unpack_data).
+    # The sets are shared with data rather than copied, so state.apply changes both and each id is held once.
+
+    def __init__(self,
+                 data: dict) -> None:
+
+        # PARAMS:
+        #   * data: dict: Bot data to index, in the in-memory layout
+
+        self.whitelist = None
+        self.blacklist = None
+        self.admins = None
+        self.streams = {}
+        self.sorted_lists = {}  # Sorted copies of the global lists, dropped on change
+        self.version = 0  # Bumped on every change, so cached decisions can be told apart
+        self.build(data=data)
+
+    def build(self,
+              data: dict) -> None:
+
+        # FUNCTION: (Re)build the index from data
+
+        # PARAMS:
+        #   * data: dict: Bot data to index
+
+        self.whitelist = data["whitelist"]
+        self.blacklist = data["blacklist"]
+        self.admins = data["admins"]
+        self.streams = data["streams"]
+        self.sorted_lists.clear()
+        self.version += 1
+
+    def lists(self,
+              stream: str = None) -> (set[int], set[int]):
+
+        # FUNCTION: Get the whitelist and blacklist for a scope
+
+        # PARAMS:
+        #   * stream: str: Stream name, or None for the global lists
+
+        # RETURNS:
+        #   * whitelist: set[int]: Allowed ids
+        #   * blacklist: set[int]: Disallowed ids
+
+        if stream is None:
+            return self.whitelist, self.blacklist
+        stream_lists = self.streams[stream]
+        return stream_lists["whitelist"], stream_lists["blacklist"]
+
+    def sorted_list(self,
+                    list_name: str) -> list[str]:
+
+        # FUNCTION: Get a global list as sorted strings, for display and prefix search. Sorted once per change.
+
+        # PARAMS:
+        #   * list_name: str: "whitelist" or "blacklist"
+
+        # RETURNS:
+        #   * entries: list[str]: Sorted ids
+
+        entries = self.sorted_lists.get(list_name)
+        if entries is None:
+            entries = sorted(map(str, self.whitelist if list_name == "whitelist" else self.blacklist))
+            self.sorted_lists[list_name] = entries
+        return entries
+
+    def apply(self,
+              record: dict) -> None:
+
+        # FUNCTION: Note a change record already applied to data (see state.apply)
+
+        # PARAMS:
+        #   * record: dict: Change record
+
+        if "list" in record:
+            self.sorted_lists.pop(record["list"], None)
+        self.version += 1
+
+
+class DecisionCache:
+
+    # CLASS: Bounded LRU cache of permission decisions, with entries expiring after a TTL.
+    # Keys include the ACL version, so any list change leaves older entries unreachable.
+
+    def __init__(self,
+                 max_entries: int = 10000,
+                 ttl: float = 60.0) -> None:
+
+        # PARAMS:
+        #   * max_entries: int: Maximum number of cached decisions
+        #   * ttl: float: Seconds a decision stays valid
+
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # Key -> (expiry, decision)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self,
+            key: tuple) -> str:
+
+        # FUNCTION: Look up a decision
+
+        # PARAMS:
+        #   * key: tuple: Decision key
+
+        # RETURNS:
+        #   * decision: str: Cached decision, or None if missing or expired
+
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self,
+            key: tuple,
+            decision: str) -> None:
+
+        # FUNCTION: Cache a decision, evicting the least recently used if full
+
+        # PARAMS:
+        #   * key: tuple: Decision key
+        #   * decision: str: Decision to cache
+
+        self.entries[key] = (time.monotonic() + self.ttl, decision)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+
+# FUNCTIONS
+def decide(index: ACLIndex,
+           user_id: int,
+           channel_id: int,
+           role_ids: list[int],
+           server_id: int,
+           stream: str = None,
+           admin_only: bool = False) -> str:
+
+    # FUNCTION: Decide whether a command may run in a context
+
+    # PARAMS:
+    #   * index: ACLIndex: Lists to check against
+    #   * user_id: int: ID of user
+    #   * channel_id: int: ID of channel
+    #   * role_ids: list[int]: Role IDs of user
+    #   * server_id: int: ID of server
+    #   * stream: str: Stream whose lists to check against, or None for the global lists
+    #   * admin_only: bool: Whether the command is admin only
+
+    # RETURNS:
+    #   * decision: str: ADMIN, ADMIN_ONLY, ALLOWED or DISALLOWED
+
+    # Check if admin
+    if check_admin(user_id=user_id,
+                   admins=index.admins):
+        return ADMIN
+
+    # Reject if command is for admins only
+    if admin_only:
+        return ADMIN_ONLY
+
+    # Check lists
+    whitelist, blacklist = index.lists(stream=stream)
+    allowed = check_ids(snowflakes=role_ids + [user_id, channel_id, server_id],
+                        whitelist=whitelist,
+                        blacklist=blacklist)
+    return ALLOWED if allowed else DISALLOWED
+
+
+def get_info(ctx: "discord.ApplicationContext") -> (int, int, list[int], int):
+
+    # FUNCTION: Get various ids, as the ints Discord gives them
+
+    # PARAMS:
+    #   * ctx: discord.ApplicationContext: Command context
+
+    # RETURNS:
+    #   * user_id: int: ID of user
+    #   * channel_id: int: ID of channel
+    #   * role_ids: list[int]: list of role IDs for that user
+    #   * server_id: int: ID of server
+
+    # Get info
+    user_id = ctx.user.id
+    channel_id = ctx.channel_id
+    role_ids = [role.id for role in ctx.user.roles]
+    server_id = ctx.guild_id
+
+    # Return results
+    return user_id, channel_id, role_ids, server_id
+
+
+def check_ids(snowflakes: Iterable[int],
+              whitelist: AbstractSet[int],
+              blacklist: AbstractSet[int]) -> bool:
+
+    # FUNCTION: Check if id is blacklisted or whitelisted. Blacklist overrides whitelist.
+
+    # PARAMS:
+    #   * snowflakes: Iterable[int]: Snowflake ids
+    #   * whitelist: AbstractSet[int]: Allowed ids
+    #   * blacklist: AbstractSet[int]: Disallowed ids
+
+    # RETURNS:
+    #   * allowed: bool: Whether any id is whitelisted and none are blacklisted
+
+    # Check if id is blacklisted
+    if not blacklist.isdisjoint(snowflakes):
+        return False
+
+    # Check if id is allowed
+    return not whitelist.isdisjoint(snowflakes)
+
+
+def prefix_range(entries: list[str],
+                 prefix: str) -> (int, int):
+
+    # FUNCTION: Find the range of sorted entries starting with a prefix
+
+    # PARAMS:
+    #   * entries: list[str]: Sorted entries
+    #   * prefix: str: Prefix entries must start with
+
+    # RETURNS:
+    #   * start: int: Index of first match
+    #   * end: int: Index after last match
+
+    if not prefix:
+        return 0, len(entries)
+    start = bisect.bisect_left(entries, prefix)
+    return start, bisect.bisect_left(entries, prefix + "\U0010ffff", lo=start)
+
+
+def page(entries: list[str],
+         prefix: str = "",
+         cursor: int = 0,
+         size: int = 20) -> (list[str], int):
+
+    # FUNCTION: Get one page of the sorted entries starting with a prefix
+
+    # PARAMS:
+    #   * entries: list[str]: Sorted entries
+    #   * prefix: str: Prefix entries must start with
+    #   * cursor: int: Offset of the page within the matching entries
+    #   * size: int: Entries per page
+
+    # RETURNS:
+    #   * page_entries: list[str]: Entries on the page
+    #   * total: int: Number of matching entries
+
+    # Find matching range
+    start, end = prefix_range(entries=entries,
+                              prefix=prefix)
+
+    # Return page
+    return entries[start + cursor:min(end, start + cursor + size)], end - start
+
+
+def is_snowflake(token: str) -> bool:
+
+    # FUNCTION: Check if a string is a valid snowflake id. Every id typed or uploaded by a user is checked with this.
+
+    # PARAMS:
+    #   * token: str: Candidate id
+
+    # RETURNS:
+    #   * valid: bool: Whether it is 17 to 20 digits and fits in 64 bits
+
+    return 17 <= len(token) <= 20 and token.isascii() and token.isdigit() and int(token) < 2 ** 64
+
+
+def parse_snowflakes(lines: Iterable[str]) -> (list[str], int, list[str]):
+
+    # FUNCTION: Parse ids from the lines of a text or CSV file, one line at a time
+
+    # PARAMS:
+    #   * lines: Iterable[str]: Lines of the file
+
+    # RETURNS:
+    #   * snowflakes: list[str]: Valid ids, in file order without repeats
+    #   * repeated: int: Number of valid ids that appeared more than once
+    #   * invalid: list[str]: Tokens that are not ids
+
+    seen = set()
+    snowflakes = []
+    repeated = 0
+    invalid = []
+    for line in lines:
+        for token in SNOWFLAKE_SEPARATORS.split(line):
+            token = token.strip(SNOWFLAKE_WRAPPERS)
+            if not token:
+                continue
+            if not is_snowflake(token=token):
+                invalid.append(token)
+            elif token in seen:
+                repeated += 1
+            else:
+                seen.add(token)
+                snowflakes.append(token)
+    return snowflakes, repeated, invalid
+
+
+def check_admin(user_id: int,
+                admins: AbstractSet[int]) -> bool:
+
+    # FUNCTION: Check if user is an admin
+
+    # PARAMS:
+    #   * user_id: int: Given ID
+    #   * admins: AbstractSet[int]: Admin IDs
+
+    # RETURNS:
+    #   * admin: bool: Whether the user is an admin
+
+    return user_id in admins
+
+
+# TESTING
+if __name__ == "__main__":
+    import random
+    import timeit
+
+    import snowflakes as snowflake_ids
+
+    # Build 100k-entry lists and a 50-role context that matches nothing
+    entries = [str(random.getrandbits(63)) for _ in range(100_000)]
+    data = {"whitelist": entries, "blacklist": entries[:], "admins": [], "streams": {}}
+    index = ACLIndex(data=snowflake_ids.unpack_data(data=data))
+    snowflakes = [random.getrandbits(63) for _ in range(50)]
+    snowflake_strings = [str(snowflake) for snowflake in snowflakes]
+
+    def list_scan() -> bool:
+        for snowflake in snowflake_strings:
+            if snowflake in data["blacklist"]:
+                return False
+        for snowflake in snowflake_strings:
+            if snowflake in data["whitelist"]:
+                return True
+        return False
+
+    def set_lookup() -> bool:
+        return check_ids(snowflakes=snowflakes,
+                         whitelist=index.whitelist,
+                         blacklist=index.blacklist)
+
+    for label, function, number in (("list", list_scan, 10), ("snowflake set", set_lookup, 10_000)):
+        seconds = min(timeit.repeat(function, number=number, repeat=5)) / number
+        print(f"{label}: {seconds * 1e6:.2f} us per check")
@@ -0,0 +1,133 @@
+# FILE: Announcement fan-out
+
+
+# DEPENDENCIES
+import asyncio
+import random
+from typing import Awaitable, Callable, Iterable
+
+import io_2
+from ratelimit import KeyedLimiter, TokenBucket
+
+
+# CLASSES
+class RouteLimiter:
+
+    # CLASS: Global + per-route rate limits. A route is a single channel's message endpoint.
+
+    def __init__(self,
+                 global_rate: float,
+                 route_rate: float,
+                 route_burst: float,
+                 max_routes: int = 10000) -> None:
+
+        # PARAMS:
+        #   * global_rate: float: Requests per second across all routes
+        #   * route_rate: float: Requests per second for a single route
+        #   * route_burst: float: Requests a single route may make back to back
+        #   * max_routes: int: Route buckets kept; the least recently used are dropped
+
+        self.global_bucket = TokenBucket(rate=global_rate,
+                                         burst=global_rate)
+        self.routes = KeyedLimiter(rate=route_rate,
+                                   burst=route_burst,
+                                   max_keys=max_routes)
+
+    async def wait(self,
+                   route: str) -> None:
+
+        # FUNCTION: Wait until a request may be made on a route
+
+        # PARAMS:
+        #   * route: str: Route key
+
+        # Get route bucket
+        bucket = self.routes.bucket(key=route)
+
+        # Wait for both limits
+        delay = max(bucket.reserve(), self.global_bucket.reserve())
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+# FUNCTIONS
+async def fan_out(channel_ids: Iterable[str],
+                  send: Callable[[str], Awaitable[None]],
+                  limiter: RouteLimiter,
+                  workers: int = 16,
+                  retries: int = 3,
+                  backoff: float = 1.0,
+                  is_transient: Callable[[Exception], bool] = lambda error: False) -> (list[str], dict[str, str]):
+
+    # FUNCTION: Send to every channel concurrently with a bounded worker pool
+
+    # PARAMS:
+    #   * channel_ids: Iterable[str]: Channels to send to
+    #   * send: Callable[[str], Awaitable[None]]: Coroutine function sending to one channel
+    #   * limiter: RouteLimiter: Rate limits to respect
+    #   * workers: int: Maximum number of concurrent sends
+    #   * retries: int: Number of retries for transient failures
+    #   * backoff: float: Base delay in seconds between retries, doubled per attempt
+    #   * is_transient: Callable[[Exception], bool]: Whether a failure is worth retrying
+
+    # RETURNS:
+    #   * delivered: list[str]: Channels sent to successfully
+    #   * failed: dict[str, str]: Channels that failed, mapped to the reason
+
+    # Queue up channels
+    queue = asyncio.Queue()
+    for channel_id in channel_ids:
+        queue.put_nowait(channel_id)
+
+    delivered = []
+    failed = {}
+
+    async def worker() -> None:
+        while not queue.empty():
+            channel_id = queue.get_nowait()
+            attempt = 0
+            while True:
+                await limiter.wait(route=channel_id)
+                try:
+                    await send(channel_id)
+                    delivered.append(channel_id)
+                    break
+                except Exception as error:
+                    if attempt >= retries or not is_transient(error):
+                        failed[channel_id] = f"{type(error).__name__}: {error}"
+                        break
+                    attempt += 1
+                    await asyncio.sleep(backoff * 2 ** (attempt - 1) * (1 + random.random()))
+
+    # Run worker pool
+    io_2.log(ticker="announce",
+             message="Fanning out to {} channels...",
+             args=(queue.qsize(),))
+    await asyncio.gather(*(worker() for _ in range(max(1, min(workers, queue.qsize())))))
+    io_2.log(ticker="announce",
+             message="Fanned out to {} channels, {} failed.",
+             args=(len(delivered), len(failed)))
+
+    # Return results
+    return delivered, failed
+
+
+# TESTING
+if __name__ == "__main__":
+
+    async def fake_send(channel_id: str) -> None:
+        await asyncio.sleep(0.01)
+        if channel_id.endswith("7"):
+            raise ConnectionError("flaky")
+
+    async def main() -> None:
+        limiter = RouteLimiter(global_rate=1000, route_rate=1, route_burst=5)
+        delivered, failed = await fan_out(channel_ids=[str(i) for i in range(500)],
+                                          send=fake_send,
+                                          limiter=limiter,
+                                          retries=1,
+                                          backoff=0.01,
+                                          is_transient=lambda error: isinstance(error, ConnectionError))
+        print(len(delivered), len(failed))
+
+    asyncio.run(main())
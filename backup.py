@@ -0,0 +1,383 @@
+# FILE: Full-state export and import. Streams and global lists are written as change records, one JSON line each,
+# into gzip parts that stay under an upload size limit. Lines are produced a batch at a time and compressed off the
+# event loop, and parts are read back line by line, so memory use depends on the part size, not on the data.
+
+
+# DEPENDENCIES
+import asyncio
+import gzip
+import io
+import json
+import zlib
+
+import acl
+import common
+import journal
+import snowflakes
+import state
+
+
+# CONSTANTS
+FORMAT = "raindrop-backup"  # Marks the header line of every part
+VERSION = 1
+LIST_NAMES = ("whitelist", "blacklist", "admins")
+IMPORT_OPS = ("stream_create", "list_add_many")  # Records a backup may hold
+GZIP_OVERHEAD = 64  # Bytes allowed for the gzip header, trailer and final block
+
+
+# CLASSES
+class PartWriter:
+
+    # CLASS: One gzip part. Tracks an upper bound on its finished size, counting lines not yet flushed out of the
+    # compressor at their uncompressed size.
+
+    def __init__(self,
+                 header: dict) -> None:
+
+        # PARAMS:
+        #   * header: dict: Header record, written first
+
+        self.compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+        self.chunks = []
+        self.compressed = 0  # Bytes output so far
+        self.buffered = 0  # Bytes written since the compressor last output anything
+        self.lines = 0
+        self.write(lines=[journal.encode(record=header)])
+
+    def bound(self) -> int:
+
+        # FUNCTION: Upper bound on the part's size if it were finished now
+
+        # RETURNS:
+        #   * size: int: Bytes
+
+        return self.compressed + self.buffered + self.buffered // 1000 + GZIP_OVERHEAD
+
+    def write(self,
+              lines: list[bytes]) -> None:
+
+        # FUNCTION: Compress lines into the part. Safe to run in a worker thread.
+
+        # PARAMS:
+        #   * lines: list[bytes]: Encoded records, newline terminated
+
+        for line in lines:
+            chunk = self.compressor.compress(line)
+            if chunk:
+                self.chunks.append(chunk)
+                self.compressed += len(chunk)
+                self.buffered = 0
+            self.buffered += len(line)
+        self.lines += len(lines)
+
+    def finish(self) -> bytes:
+
+        # FUNCTION: Finish the part
+
+        # RETURNS:
+        #   * content: bytes: Complete .jsonl.gz file
+
+        self.chunks.append(self.compressor.flush())
+        content = b"".join(self.chunks)
+        self.chunks = []
+        return content
+
+
+# FUNCTIONS
+def export_records(data: dict,
+                   ids_per_record: int = 1000):
+
+    # FUNCTION: Describe data as change records that rebuild it. Runs on the event loop, between changes.
+
+    # PARAMS:
+    #   * data: dict: Bot data, in the in-memory layout
+    #   * ids_per_record: int: Most list ids per record
+
+    # RETURNS:
+    #   * (generator): Yields records with string ids
+
+    # Streams, skipping those deleted since the export started
+    for name in list(data["streams"]):
+        stream = data["streams"].get(name)
+        if stream is not None:
+            yield {"op": "stream_create", "name": name, "stream": snowflakes.pack_stream(stream=stream)}
+
+    # Global lists, in slices, from a copy so list changes made while the export awaits cannot break the iteration
+    for list_name in LIST_NAMES:
+        ids = []
+        for snowflake in list(data[list_name]):
+            ids.append(str(snowflake))
+            if len(ids) >= ids_per_record:
+                yield {"op": "list_add_many", "list": list_name, "snowflakes": ids}
+                ids = []
+        if ids:
+            yield {"op": "list_add_many", "list": list_name, "snowflakes": ids}
+
+
+async def export_parts(data: dict,
+                       max_bytes: int,
+                       created: str,
+                       batch_bytes: int = 262144):
+
+    # FUNCTION: Export data as gzip parts of at most max_bytes each
+
+    # PARAMS:
+    #   * data: dict: Bot data, in the in-memory layout
+    #   * max_bytes: int: Largest part, e.g. the upload limit
+    #   * created: str: Export time, written into each part's header
+    #   * batch_bytes: int: Uncompressed bytes encoded on the event loop before compressing them off it
+
+    # RETURNS:
+    #   * (async generator): Yields each part's content, as bytes
+
+    loop = asyncio.get_running_loop()
+    records = export_records(data=data)
+    part = None
+    index = 0
+    exhausted = False
+    while not exhausted:
+
+        # Encode a batch on the event loop, so data does not change mid-record
+        batch = []
+        size = 0
+        overflow = None
+        for record in records:
+            line = journal.encode(record=record)
+            if part is None:
+                index += 1
+                part = PartWriter(header={"format": FORMAT, "version": VERSION, "part": index, "created": created})
+            if batch and part.bound() + size + len(line) > max_bytes:
+                overflow = line  # Starts the next part
+                break
+            batch.append(line)
+            size += len(line)
+            if size >= batch_bytes:
+                break
+        else:
+            exhausted = True
+
+        # Compress off it
+        if batch:
+            await loop.run_in_executor(None, part.write, batch)
+        if (overflow is not None or exhausted) and part is not None:
+            yield await loop.run_in_executor(None, part.finish)
+            part = None
+        if overflow is not None:
+            index += 1
+            part = PartWriter(header={"format": FORMAT, "version": VERSION, "part": index, "created": created})
+            part.write(lines=[overflow])
+
+
+def check_record(record: dict) -> dict:
+
+    # FUNCTION: Check a record read from a backup
+
+    # PARAMS:
+    #   * record: dict: Parsed record
+
+    # RETURNS:
+    #   * record: dict: The same record, with string ids
+
+    # RAISES:
+    #   * ValueError: If the record is not one a backup holds, or an id is not a snowflake
+
+    if not isinstance(record, dict) or record.get("op") not in IMPORT_OPS:
+        raise ValueError(f"unexpected record {str(record)[:80]}")
+    if record["op"] == "stream_create":
+        if not isinstance(record.get("name"), str) or not record["name"]:
+            raise ValueError("stream without a name")
+        common.validate_data(data={"configured": "True", "whitelist": [], "blacklist": [], "admins": [],
+                                   "streams": {record["name"]: record.get("stream")}})
+    elif record.get("list") not in LIST_NAMES or not isinstance(record.get("snowflakes"), list):
+        raise ValueError(f"list record for '{record.get('list')}'")
+    if not all(isinstance(value, str) for value in record.get("snowflakes", [])):
+        raise ValueError("ids must be strings")
+    if not all(acl.is_snowflake(token=value) for value in record.get("snowflakes", [])):
+        raise ValueError("ids must be snowflakes")
+    snowflakes.unpack_record(record=record)  # Raises ValueError on ids that are not numbers
+    return record
+
+
+def read_part(content: bytes,
+              max_line_bytes: int = 1048576):
+
+    # FUNCTION: Read and check the records in a backup part, one line at a time
+
+    # PARAMS:
+    #   * content: bytes: .jsonl.gz file, as exported, or the same uncompressed
+    #   * max_line_bytes: int: Longest line accepted
+
+    # RETURNS:
+    #   * (generator): Yields records with string ids, after the header
+
+    # RAISES:
+    #   * ValueError: If the file is not a backup part, or a line is not a valid record
+
+    file = gzip.GzipFile(fileobj=io.BytesIO(content)) if content[:2] == b"\x1f\x8b" else io.BytesIO(content)
+    try:
+        header = json.loads(file.readline(max_line_bytes) or b"null")
+        if not isinstance(header, dict) or header.get("format") != FORMAT:
+            raise ValueError("not a backup file")
+        if header.get("version") != VERSION:
+            raise ValueError(f"backup version {header.get('version')} is not supported")
+        line_number = 1
+        while True:
+            line = file.readline(max_line_bytes + 1)
+            if not line:
+                return
+            line_number += 1
+            if len(line) > max_line_bytes:
+                raise ValueError(f"line {line_number} is too long")
+            if line.strip():
+                try:
+                    yield check_record(record=json.loads(line))
+                except ValueError as error:
+                    raise ValueError(f"line {line_number}: {error}") from None
+    except (OSError, EOFError, zlib.error) as error:
+        raise ValueError(f"damaged file ({error})") from None
+
+
+def count_part(content: bytes) -> dict:
+
+    # FUNCTION: Check a whole part before importing any of it. Safe to run in a worker thread.
+
+    # PARAMS:
+    #   * content: bytes: .jsonl.gz file
+
+    # RETURNS:
+    #   * counts: dict: streams and ids in the part
+
+    # RAISES:
+    #   * ValueError: See read_part
+
+    counts = {"streams": 0, "ids": 0}
+    for record in read_part(content=content):
+        if record["op"] == "stream_create":
+            counts["streams"] += 1
+        else:
+            counts["ids"] += len(record["snowflakes"])
+    return counts
+
+
+async def import_part(content: bytes,
+                      batch_records: int = 500,
+                      include_admins: bool = False) -> dict:
+
+    # FUNCTION: Apply a part already checked with count_part, one batch of records at a time. Streams in the part
+    # replace streams of the same name; list ids are added to what is there. Admins are left out unless asked for,
+    # so an upload cannot grant admin by default.
+
+    # PARAMS:
+    #   * content: bytes: .jsonl.gz file
+    #   * batch_records: int: Records applied before waiting for them to be durable
+    #   * include_admins: bool: Whether to add the part's admins too
+
+    # RETURNS:
+    #   * counts: dict: streams imported, names of the streams replaced, ids added (admins among them), and admins
+    #     left out
+
+    counts = {"streams": 0, "replaced": [], "ids": 0, "admins": 0, "skipped_admins": 0}
+    batch = []
+    for record in read_part(content=content):
+        if record["op"] == "list_add_many" and record["list"] == "admins" and not include_admins:
+            counts["skipped_admins"] += len(record["snowflakes"])
+            continue
+        batch.append(record)
+        if len(batch) >= batch_records:
+            await import_batch(records=batch,
+                               counts=counts)
+            batch = []
+    if batch:
+        await import_batch(records=batch,
+                           counts=counts)
+    return counts
+
+
+async def import_batch(records: list[dict],
+                       counts: dict) -> None:
+
+    # FUNCTION: Apply a batch of records and wait until all of them are durable, in one group commit
+
+    # PARAMS:
+    #   * records: list[dict]: Checked records
+    #   * counts: dict: Counts to add to (see import_part)
+
+    waiting = []
+    for record in records:
+        if record["op"] == "stream_create":
+            async with common.stream_locks.hold(name=record["name"]):
+                if record["name"] in common.data["streams"]:
+                    counts["replaced"].append(record["name"])
+                waiting.append(common.store.enqueue(record=state.stage(record=record)))
+            counts["streams"] += 1
+        else:
+            waiting.append(common.list_writer.submit(list_name=record["list"],
+                                                     snowflakes=[int(snowflake) for snowflake in record["snowflakes"]]))
+    for record, result in zip(records, await asyncio.gather(*waiting)):
+        if result is not None:
+            counts["ids"] += len(result)
+            if record.get("list") == "admins":
+                counts["admins"] += len(result)
+
+
+# TESTING
+if __name__ == "__main__":
+    import random
+    import time
+
+    import mutations
+
+    class MemoryStore(journal.GroupCommitter):
+        def __init__(self) -> None:
+            super().__init__()
+            self.lines = []
+
+        def write(self, lines: list[bytes]) -> None:
+            self.lines.extend(lines)
+
+    # 2000 streams and 3M list ids
+    ids = [random.getrandbits(60) | (1 << 59) for _ in range(3_000_000)]
+    data = snowflakes.unpack_data(data={
+        "streams": {f"stream-{index}": {"origin_server": str(ids[index]),
+                                        "channels": [str(channel) for channel in ids[index:index + 50]],
+                                        "whitelist": [str(ids[index])],
+                                        "blacklist": [],
+                                        "locked": "False"}
+                    for index in range(2000)},
+        "whitelist": [str(snowflake) for snowflake in ids[:2_000_000]],
+        "blacklist": [str(snowflake) for snowflake in ids[2_000_000:]],
+        "admins": [str(ids[0])]
+    })
+    del ids
+
+    async def main() -> None:
+        started = time.perf_counter()
+        parts = [part async for part in export_parts(data=data,
+                                                     max_bytes=8 * 1024 * 1024,
+                                                     created="test")]
+        print(f"export: {len(parts)} parts of {[len(part) // 1024 for part in parts]} KiB "
+              f"in {time.perf_counter() - started:.1f}s")
+
+        # Import into empty data, as the import command does
+        started = time.perf_counter()
+        common.data = snowflakes.unpack_data(data={"streams": {}, "whitelist": [], "blacklist": [], "admins": []})
+        common.store = MemoryStore()
+        common.stream_locks = mutations.StreamLocks()
+        common.list_writer = mutations.ListWriter()
+        for part in parts:
+            counts = count_part(content=part)
+            imported = await import_part(content=part)
+            print(f"part: {counts}, imported {imported}")
+        same = (common.data["streams"] == data["streams"]
+                and all(common.data[list_name] == data[list_name] for list_name in ("whitelist", "blacklist")))
+        print(f"import: {time.perf_counter() - started:.1f}s, {len(common.store.lines)} records journalled, "
+              f"same as exported apart from admins: {same}, admins imported: {len(common.data['admins'])}")
+
+        # Import again, this time with admins: every stream is replaced and reported
+        for part in parts:
+            imported = await import_part(content=part,
+                                         include_admins=True)
+            print(f"again: {imported['streams']} streams, {len(imported['replaced'])} replaced, "
+                  f"{imported['ids']} new ids, {imported['admins']} admins added")
+
+    asyncio.run(main())
@@ -0,0 +1,263 @@
+# FILE: Microbenchmarks for io_2 and the ACL helpers
+
+# Usage:
+#   python benchmark.py [--max-exponent 6] [--output results.json]
+#                       [--baseline data/benchmark_baseline.json] [--save-baseline] [--tolerance 0.25]
+# Results are printed as JSON. With a baseline, exits with status 1 if any benchmark regressed.
+
+
+# DEPENDENCIES
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import acl
+import io_2
+import snowflakes
+
+
+# CONSTANTS
+DEFAULT_BASELINE_PATH = "data/benchmark_baseline.json"
+ROLES_PER_CONTEXT = 50
+TIME_BUDGET = 0.25  # Seconds spent timing each benchmark
+BATCH_TIME = 0.0005  # Seconds per timed batch, so timer overhead stays small for fast operations
+
+
+# FUNCTIONS
+def snowflake() -> str:
+
+    # FUNCTION: Make a random snowflake id
+
+    # RETURNS:
+    #   * snowflake: str: 18-19 digit id
+
+    return str(random.randrange(10 ** 17, 2 ** 63))
+
+
+def make_data(size: int) -> dict:
+
+    # FUNCTION: Generate synthetic data with `size` streams and `size` entries in each global list
+
+    # PARAMS:
+    #   * size: int: Number of streams and list entries
+
+    # RETURNS:
+    #   * data: dict: Data in the data.json layout
+
+    return {
+        "configured": "True",
+        "streams": {
+            f"stream-{index}": {
+                "locked": "False",
+                "origin_server": snowflake(),
+                "channels": [snowflake() for _ in range(3)],
+                "whitelist": [snowflake()],
+                "blacklist": []
+            }
+            for index in range(size)
+        },
+        "whitelist": [snowflake() for _ in range(size)],
+        "blacklist": [snowflake() for _ in range(size)],
+        "admins": [snowflake() for _ in range(min(size, 10))]
+    }
+
+
+def make_context(roles: int = ROLES_PER_CONTEXT) -> SimpleNamespace:
+
+    # FUNCTION: Make a fake command context with many roles
+
+    # PARAMS:
+    #   * roles: int: Number of roles on the user
+
+    # RETURNS:
+    #   * ctx: SimpleNamespace: Object with the attributes get_info reads
+
+    return SimpleNamespace(
+        user=SimpleNamespace(id=int(snowflake()),
+                             roles=[SimpleNamespace(id=int(snowflake())) for _ in range(roles)]),
+        channel_id=int(snowflake()),
+        guild_id=int(snowflake())
+    )
+
+
+def measure(function,
+            time_budget: float = TIME_BUDGET) -> dict:
+
+    # FUNCTION: Time a function in batches and measure its peak memory
+
+    # PARAMS:
+    #   * function: Callable[[], object]: Operation to time
+    #   * time_budget: float: Seconds to spend timing
+
+    # RETURNS:
+    #   * result: dict: ops_per_sec, p50_us, p99_us and peak_memory_bytes
+
+    # Pick batch size so each batch takes about BATCH_TIME
+    started = time.perf_counter()
+    function()
+    single = max(time.perf_counter() - started, 1e-9)
+    batch = max(1, int(BATCH_TIME / single))
+
+    # Time batches
+    samples = []
+    operations = 0
+    deadline = time.perf_counter() + time_budget
+    while time.perf_counter() < deadline or len(samples) < 5:
+        started = time.perf_counter_ns()
+        for _ in range(batch):
+            function()
+        samples.append((time.perf_counter_ns() - started) / batch / 1000)
+        operations += batch
+    total_seconds = sum(samples) * batch / 1e6
+
+    # Measure peak memory of one operation
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    samples.sort()
+    return {
+        "ops_per_sec": operations / total_seconds,
+        "p50_us": statistics.median(samples),
+        "p99_us": samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+        "peak_memory_bytes": peak
+    }
+
+
+def run(max_exponent: int = 5) -> dict:
+
+    # FUNCTION: Run every benchmark at sizes 10^2 .. 10^max_exponent
+
+    # PARAMS:
+    #   * max_exponent: int: Largest size as a power of ten
+
+    # RETURNS:
+    #   * results: dict: Benchmark name -> result (see measure)
+
+    results = {}
+    directory = tempfile.mkdtemp(prefix="raindrop-benchmark-")
+    io_2.configure_logging(file_path=os.path.join(directory, "log.txt"),
+                           tickers={"io": "WARN"})
+    context = make_context()
+
+    for exponent in range(2, max_exponent + 1):
+        size = 10 ** exponent
+        data = make_data(size=size)
+        index = acl.ACLIndex(data=snowflakes.unpack_data(data=data))
+        user_id, channel_id, role_ids, server_id = acl.get_info(ctx=context)
+        context_ids = role_ids + [user_id, channel_id, server_id]
+        stream = next(iter(data["streams"]))
+        data_path = os.path.join(directory, f"data-{size}.json")
+        io_2.write_json(file_path=data_path,
+                        data=data)
+
+        benchmarks = {
+            "check_ids": lambda: acl.check_ids(snowflakes=context_ids,
+                                               whitelist=index.whitelist,
+                                               blacklist=index.blacklist),
+            "check_ids_stream": lambda: acl.check_ids(snowflakes=context_ids,
+                                                      whitelist=index.streams[stream]["whitelist"],
+                                                      blacklist=index.streams[stream]["blacklist"]),
+            "check_admin": lambda: acl.check_admin(user_id=user_id,
+                                                   admins=index.admins),
+            "decide": lambda: acl.decide(index=index,
+                                         user_id=user_id,
+                                         channel_id=channel_id,
+                                         role_ids=role_ids,
+                                         server_id=server_id),
+            "read_json": lambda: io_2.read_json(file_path=data_path),
+            "write_json": lambda: io_2.write_json(file_path=data_path,
+                                                  data=data)
+        }
+        for name, function in benchmarks.items():
+            results[f"{name}[{size}]"] = measure(function=function)
+            print(f"{name}[{size}]: {results[f'{name}[{size}]']['ops_per_sec']:.0f} ops/sec", file=sys.stderr)
+
+    # Size independent benchmarks
+    context_benchmarks = {
+        "get_info": lambda: acl.get_info(ctx=context),
+        "log_enabled": lambda: io_2.log(ticker="benchmark",
+                                        message="Checking '{}' with roles '{}'",
+                                        args=(context.user.id, context.user.roles),
+                                        to_console=False),
+        "log_filtered": lambda: io_2.log(ticker="benchmark",
+                                         message="Checking '{}' with roles '{}'",
+                                         args=(context.user.id, context.user.roles),
+                                         level=io_2.DEBUG,
+                                         to_console=False)
+    }
+    for name, function in context_benchmarks.items():
+        results[name] = measure(function=function)
+        print(f"{name}: {results[name]['ops_per_sec']:.0f} ops/sec", file=sys.stderr)
+    io_2.update_log_file()
+
+    return results
+
+
+def compare(results: dict,
+            baseline: dict,
+            tolerance: float) -> list[str]:
+
+    # FUNCTION: Find benchmarks that got slower than the baseline
+
+    # PARAMS:
+    #   * results: dict: Current results
+    #   * baseline: dict: Stored results
+    #   * tolerance: float: Allowed fractional slowdown
+
+    # RETURNS:
+    #   * regressions: list[str]: Descriptions of regressed benchmarks
+
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]
+        if result["ops_per_sec"] < old["ops_per_sec"] * (1 - tolerance):
+            regressions.append(f"{name}: {result['ops_per_sec']:.0f} ops/sec, was {old['ops_per_sec']:.0f}")
+        if result["p99_us"] > old["p99_us"] * (1 + tolerance) * 2:
+            regressions.append(f"{name}: p99 {result['p99_us']:.2f} us, was {old['p99_us']:.2f}")
+    return regressions
+
+
+# MAIN
+if __name__ == "__main__":
+
+    # Parse arguments
+    parser = argparse.ArgumentParser(description="Benchmark io_2 and the ACL helpers.")
+    parser.add_argument("--max-exponent", type=int, default=5, help="Largest data size as a power of ten (2-6)")
+    parser.add_argument("--output", help="File to write JSON results to")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE_PATH, help="Stored results to compare against")
+    parser.add_argument("--save-baseline", action="store_true", help="Store these results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed fractional slowdown")
+    arguments = parser.parse_args()
+
+    # Run
+    results = run(max_exponent=arguments.max_exponent)
+    report = {"results": results, "regressions": []}
+
+    # Compare with baseline
+    if arguments.save_baseline:
+        with open(arguments.baseline, "w") as file:
+            json.dump(results, file, indent=4)
+    elif os.path.exists(arguments.baseline):
+        with open(arguments.baseline, "r") as file:
+            report["regressions"] = compare(results=results,
+                                            baseline=json.load(file),
+                                            tolerance=arguments.tolerance)
+
+    # Output
+    output = json.dumps(report, indent=4)
+    if arguments.output:
+        with open(arguments.output, "w") as file:
+            file.write(output)
+    print(output)
+    sys.exit(1 if report["regressions"] else 0)
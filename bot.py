@@ -5,97 +5,170 @@
 import discord
 import io_2
 import asyncio
+import itertools
 import common
+import announce
+import acl
+import state
+import journal
+import storage
+import streams
+import loader
+import scheduler
+import time
+import traceback
+import metrics
+import shard
+import snowflakes
+import responses
+import reloader
+import footprint
+import logsearch
+import ratelimit
+import mutations
+import backup
+import io
+from datetime import datetime
 
 
 # CONFIGURATION
+startup_timer = loader.PhaseTimer()
 common.BOT_TOKEN = io_2.read_json(file_path="secret/api_key.json")["bot_token"]
-try:
-    common.config = io_2.read_json(file_path="config/config.json")
-    if common.config["configured"] != "True":
-        # Log
-        io_2.log(ticker="bot",
-                 message="Config file is corrupted. Using defaults...")
-        common.config = io_2.read_json(file_path="defaults/config_defaults.json")
-except:
-    # Log
-    io_2.log(ticker="bot",
-             message="Config file could not be read. Using defaults...")
-    common.config = io_2.read_json(file_path="defaults/config_defaults.json")
-
-try:
-    common.data = io_2.read_json(file_path="data/data.json")
-    if common.data["configured"] != "True":
-        # Log
-        io_2.log(ticker="bot",
-                 message="Data file is corrupted. Using defaults...")
-        common.data = io_2.read_json(file_path="defaults/data_defaults.json")
-except:
-    # Log
-    io_2.log(ticker="bot",
-             message="Data file could not be read. Using defaults...")
-    common.data = io_2.read_json(file_path="defaults/data_defaults.json")
+startup_timer.mark(name="token")
+common.config, common.data = loader.load_state()
+io_2.configure_logging(**common.config["logging"])
+worker, shard_ids, shard_count = shard.shard_settings()
+startup_timer.mark(name="config and data")
+
+if worker is not None and common.config["storage"]["backend"] != "sqlite":
+    io_2.log(ticker="shard",
+             message="Sharded workers share state through the sqlite storage backend. Set storage.backend to 'sqlite'.",
+             level=io_2.ERROR)
+    io_2.update_log_file()
+    raise SystemExit(1)
+if common.config["storage"]["backend"] == "sqlite":
+    common.store = storage.SQLiteStore(file_path=common.config["storage"]["sqlite_path"],
+                                       group_commit_interval=common.config["storage"]["group_commit_interval"],
+                                       origin=None if worker is None else f"worker-{worker}",
+                                       change_retention=common.config["sharding"]["change_retention"])
+    common.data = common.store.load()
+else:
+    common.store = journal.Journal(snapshot_path=loader.DATA_PATH,
+                                   journal_path=common.config["storage"]["journal_path"],
+                                   group_commit_interval=common.config["storage"]["group_commit_interval"],
+                                   compact_records=common.config["storage"]["compact_records"])
+    common.store.replay(data=common.data)
+common.data = snowflakes.unpack_data(data=common.data)
+startup_timer.mark(name="storage")
+common.acl_index = acl.ACLIndex(data=common.data)
+state.listeners.append(common.acl_index.apply)
+common.subscription_index = streams.SubscriptionIndex(data=common.data)
+state.listeners.append(common.subscription_index.apply)
+common.stream_names = streams.StreamNameIndex(data=common.data)
+state.listeners.append(common.stream_names.apply)
+state.rebuilders.append(common.acl_index.build)
+state.rebuilders.append(common.subscription_index.build)
+state.rebuilders.append(common.stream_names.build)
+common.decision_cache = acl.DecisionCache(max_entries=common.config["permissions"]["cache_size"],
+                                          ttl=common.config["permissions"]["cache_ttl"])
+common.rate_limiter = ratelimit.CommandLimiter(settings=common.config["rate_limits"])
+common.stream_locks = mutations.StreamLocks()
+common.list_writer = mutations.ListWriter()
+startup_timer.mark(name="indexes")
+
+# Metrics
+command_seconds = metrics.registry.histogram(name="raindrop_command_seconds",
+                                             description="Slash command latency, from invoke to return",
+                                             labels=("command",))
+commands_total = metrics.registry.counter(name="raindrop_commands_total",
+                                          description="Slash commands run, by outcome",
+                                          labels=("command", "status"))
+response_messages = metrics.registry.counter(name="raindrop_response_messages_total",
+                                             description="Messages sent in response to slash commands")
+permission_seconds = metrics.registry.histogram(name="raindrop_permission_check_seconds",
+                                                description="Time to reach a permission decision",
+                                                labels=("cache",))
+permission_decisions = metrics.registry.counter(name="raindrop_permission_decisions_total",
+                                                description="Permission decisions, by result",
+                                                labels=("decision",))
+rate_limited = metrics.registry.counter(name="raindrop_rate_limited_total",
+                                        description="Commands rejected for going over a rate limit",
+                                        labels=("group",))
+metrics.registry.gauge(name="raindrop_decision_cache_hits",
+                       description="Permission decisions served from the cache since startup",
+                       function=lambda: common.decision_cache.hits)
+metrics.registry.gauge(name="raindrop_decision_cache_misses",
+                       description="Permission decisions computed since startup",
+                       function=lambda: common.decision_cache.misses)
+metrics.registry.gauge(name="raindrop_decision_cache_entries",
+                       description="Permission decisions currently cached",
+                       function=lambda: len(common.decision_cache.entries))
+metrics.registry.gauge(name="raindrop_store_healthy",
+                       description="1 if the last write to the store succeeded, 0 if memory is ahead of disk",
+                       function=lambda: int(common.store.healthy))
+metrics.registry.gauge(name="raindrop_streams",
+                       description="Streams",
+                       function=lambda: len(common.data["streams"]))
+metrics_exporter = None  # Task writing metrics to file, started once connected
+change_follower = None  # Task applying changes made by other shard workers, started once connected
+file_watcher = None  # Task reloading config.json and data.json when they change, started once connected
 
 
 # FUNCTIONS
-def check_ids(snowflakes: list[str],
-              whitelist: list = common.data["whitelist"],
-              blacklist: list = common.data["blacklist"]) -> bool:
-
-    # FUNCTION: Check if id is blacklisted or whitelisted. Blacklist overrides whitelist.
-
-    # PARAMS:
-    #   * snowflakes: list[str]: List of snowflake ids
-    #   * whitelist: list: List of allowed ids
-    #   * blacklist: list: List of disallowed ids
-
-    # Check if id is blacklisted
-    for snowflake in snowflakes:
-        if snowflake in blacklist:
-            return False
-
-    # Check if id is allowed
-    for snowflake in snowflakes:
-        if snowflake in whitelist:
-            return True
-
-    # Not allowed
-    return False
-
-
 async def check_allowed(ctx: discord.ApplicationContext,
-                        whitelist: list[str] = common.data["whitelist"],
-                        blacklist: list[str] = common.data["blacklist"],
+                        stream: str = None,
                         admin_only: bool = False,
-                        admins: list[str] = common.data["admins"],
                         disallowed_response: bool = True) -> bool:
 
     # FUNCTION: Check if command is allowed to be run in current context.
 
     # PARAMS:
     #   * ctx: discord.ApplicationContext: Command context
-    #   * whitelist: list[str]: Whitelisted roles
-    #   * blacklist: list[str]: Blacklisted roles
+    #   * stream: str: Stream whose lists to check against, or None for the global lists
     #   * admin_only: bool: whether this command is admin only
     #   * disallowed_response: bool: Whether to respond with an error message if not allowed
 
     # RETURNS:
     #   * allowed: bool: Whether command is allowed or not
 
+    # Reject if over the rate limit, before any other work
+    if not await check_rate(ctx=ctx):
+        return False
+
     # Get info
-    user_id, channel_id, role_ids, server_id = get_info(ctx=ctx)
+    started = time.perf_counter()
+    user_id, channel_id, role_ids, server_id = acl.get_info(ctx=ctx)
 
     # Log
-    io_2.log(ticker="bot",
-             message=f"Checking if command is allowed for '{user_id}'"
-                     f" in channel '{channel_id}'"
-                     f" in server '{server_id}'"
-                     f" with roles '{role_ids}'")
+    io_2.log(ticker="perm",
+             message="Checking if command is allowed for '{}'"
+                     " in channel '{}'"
+                     " in server '{}'"
+                     " with roles '{}'",
+             args=(user_id, channel_id, server_id, role_ids),
+             level=io_2.DEBUG)
+
+    # Decide, reusing the cached decision if the ACLs have not changed since
+    key = (user_id, frozenset(role_ids), channel_id, server_id, stream, admin_only, common.acl_index.version)
+    decision = common.decision_cache.get(key=key)
+    cache = "hit"
+    if decision is None:
+        decision = acl.decide(index=common.acl_index,
+                              user_id=user_id,
+                              channel_id=channel_id,
+                              role_ids=role_ids,
+                              server_id=server_id,
+                              stream=stream,
+                              admin_only=admin_only)
+        common.decision_cache.put(key=key,
+                                  decision=decision)
+        cache = "miss"
+    permission_seconds.observe(value=time.perf_counter() - started,
+                               labels=(cache,))
+    permission_decisions.inc(labels=(decision,))
 
     # Check if admin
-    admin = check_admin(user_id=user_id,
-                        admins=admins)
-    if admin:
+    if decision == acl.ADMIN:
 
         # Alert for admin override
         embed = discord.Embed(
@@ -103,31 +176,34 @@ async def check_allowed(ctx: discord.ApplicationContext,
             description="Permissions overridden with admin access.",
             color=common.config["colors"]["success"]
         )
-        await ctx.respond(embed=embed)
+        await responses.respond(ctx=ctx,
+                                embed=embed)
 
         # Log
-        io_2.log(ticker="bot",
-                 message=f"Command allowed via admin override for {user_id}")
+        io_2.log(ticker="perm",
+                 message="Command allowed via admin override for {}",
+                 args=(user_id,),
+                 level=io_2.DEBUG)
 
         # Return as allowed
         return True
 
     # Reject if command is for admins only
-    if admin_only:
+    if decision == acl.ADMIN_ONLY:
+        io_2.log(ticker="perm",
+                 message="Command '{}' rejected as admin only for '{}' in channel '{}' in server '{}' with roles '{}'",
+                 args=(ctx.command.qualified_name, user_id, channel_id, server_id, role_ids))
         embed = discord.Embed(
             title="Admin only command",
             description="Sorry, you must be a bot admin to use this command.",
             color=common.config["colors"]["error"]
         )
-        await ctx.respond(embed=embed)
+        await responses.respond(ctx=ctx,
+                                embed=embed)
         return False
 
     # Check if allowed
-    snowflakes = role_ids
-    snowflakes.extend([user_id, channel_id, server_id])
-    allowed = check_ids(snowflakes=snowflakes,
-                        whitelist=whitelist,
-                        blacklist=blacklist)
+    allowed = decision == acl.ALLOWED
 
     # Respond if not allowed & response setting is on
     if (not allowed) and disallowed_response:
@@ -140,71 +216,459 @@ async def check_allowed(ctx: discord.ApplicationContext,
                         value="* You have insufficient permissions in this server \n"
                               "* You are restricted from using the bot \n"
                               "* The bot is undergoing maintenance \n")
-        await ctx.respond(embed=embed)
-
-    # Log
-    io_2.log(ticker="bot",
-             message=f"Command {'allowed' if allowed else 'disallowed'} for {user_id}")
+        await responses.respond(ctx=ctx,
+                                embed=embed)
+
+    # Log, with the full context for denials so they can be found with /log search
+    if allowed:
+        io_2.log(ticker="perm",
+                 message="Command allowed for {}",
+                 args=(user_id,),
+                 level=io_2.DEBUG)
+    else:
+        io_2.log(ticker="perm",
+                 message="Command '{}' disallowed for '{}' in channel '{}' in server '{}' with roles '{}'"
+                         + (" on stream '{}'" if stream is not None else ""),
+                 args=(ctx.command.qualified_name, user_id, channel_id, server_id, role_ids)
+                      + ((stream,) if stream is not None else ()))
 
     # Return result
     return allowed
 
 
-def check_admin(user_id: str,
-                admins: list[str] = common.data["admins"]):
+async def check_rate(ctx: discord.ApplicationContext) -> bool:
 
-    # FUNCTION: Check if user is an admin
+    # FUNCTION: Take a token for the command from the user's and the guild's rate limit buckets. Only the first
+    # check of each command counts.
 
     # PARAMS:
-    #   * user_id: str: Given ID
-    #   * admins: list[str]: List of admin IDs
+    #   * ctx: discord.ApplicationContext: Command context
 
-    # Check if admin
-    admin = check_ids(snowflakes=[user_id],
-                      whitelist=admins,
-                      blacklist=[])
+    # RETURNS:
+    #   * allowed: bool: Whether the command is within the rate limits
 
-    # Return result
-    return admin
+    if getattr(ctx, "rate_checked", False):
+        return True
+    ctx.rate_checked = True
+
+    # Check
+    group = ctx.command.qualified_name.split()[0]
+    delay = common.rate_limiter.check(user_id=ctx.user.id,
+                                      server_id=ctx.guild_id,
+                                      group=group)
+    if delay <= 0:
+        return True
+    rate_limited.inc(labels=(group,))
+
+    # Log
+    io_2.log(ticker="perm",
+             message="Rate limited '{}' for {:.1f}s using /{}",
+             args=(ctx.user.id, delay, group),
+             level=io_2.DEBUG)
+
+    # Send error embed
+    embed = discord.Embed(
+        title="Slow down",
+        description=f"You are using `/{group}` too quickly. Try again in {max(1, round(delay))} seconds.",
+        color=common.config["colors"]["error"]
+    )
+    await responses.respond(ctx=ctx,
+                            embed=embed)
+    return False
 
 
-def get_info(ctx: discord.ApplicationContext) -> (str, str, list[str], str):
+async def complete_stream(ctx: discord.AutocompleteContext) -> list[str]:
 
-    # FUNCTION: Get various ids
+    # FUNCTION: Autocomplete stream names, for commands that work with any stream
+
+    # PARAMS:
+    #   * ctx: discord.AutocompleteContext: Autocomplete context
+
+    # RETURNS:
+    #   * names: list[str]: Up to 25 names starting with what was typed
+
+    return common.stream_names.complete(prefix=ctx.value or "")
+
+
+async def complete_managed_stream(ctx: discord.AutocompleteContext) -> list[str]:
+
+    # FUNCTION: Autocomplete the names of streams the user may modify or announce to
+
+    # PARAMS:
+    #   * ctx: discord.AutocompleteContext: Autocomplete context
+
+    # RETURNS:
+    #   * names: list[str]: Up to 25 names starting with what was typed
+
+    user_id, channel_id, role_ids, server_id = acl.get_info(ctx=ctx.interaction)
+    prefix = ctx.value or ""
+
+    # Admins may use every stream
+    if acl.check_admin(user_id=user_id,
+                       admins=common.acl_index.admins):
+        return common.stream_names.complete(prefix=prefix)
+
+    # Otherwise only streams whitelisting one of the user's ids, and not blacklisting any
+    names = []
+    for name in sorted(common.stream_names.granted(snowflakes=role_ids + [user_id, channel_id, server_id],
+                                                   prefix=prefix)):
+        decision = acl.decide(index=common.acl_index,
+                              user_id=user_id,
+                              channel_id=channel_id,
+                              role_ids=role_ids,
+                              server_id=server_id,
+                              stream=name)
+        if decision == acl.ALLOWED:
+            names.append(name)
+            if len(names) == 25:
+                break
+    return names
+
+
+def parse_time(value: str) -> float:
+
+    # FUNCTION: Parse a time given as a command option
+
+    # PARAMS:
+    #   * value: str: e.g. "2026-01-31 18:00", or a time ago like "90m", "6h" or "2d"
+
+    # RETURNS:
+    #   * time: float: Unix time
+
+    # RAISES:
+    #   * ValueError: If the value is not a time
+
+    value = value.strip()
+    units = {"m": 60, "h": 3600, "d": 86400}
+    if value[-1:].lower() in units:
+        return time.time() - float(value[:-1]) * units[value[-1].lower()]
+    return datetime.fromisoformat(value).timestamp()
+
+
+async def read_snowflake(ctx: discord.ApplicationContext,
+                         snowflake: str) -> int:
+
+    # FUNCTION: Parse an id given as a command option, responding with an error if it is not one
 
     # PARAMS:
     #   * ctx: discord.ApplicationContext: Command context
+    #   * snowflake: str: Id as typed
 
     # RETURNS:
-    #   * user_id: str: ID of user
-    #   * channel_id: ID of channel
-    #   * role_ids: list[str]: list of role IDs for that user
-    #   * server_id: str: ID of server
+    #   * snowflake: int: Id, or None if it is not valid
 
-    # Get info
-    user_id = str(ctx.user.id)
-    channel_id = str(ctx.channel_id)
-    role_ids = []
-    for role in ctx.user.roles:
-        role_ids.append(str(role.id))
-    server_id = str(ctx.guild_id)
+    token = snowflake.strip().strip(acl.SNOWFLAKE_WRAPPERS)
+    parsed = int(token) if acl.is_snowflake(token=token) else None
+    if parsed is None:
+
+        # Send error embed
+        embed = discord.Embed(
+            title="Invalid ID",
+            description=f"'{snowflake}' is not a valid ID. IDs are 17 to 20 digit numbers, like '{ctx.user.id}'.",
+            color=common.config["colors"]["error"]
+        )
+        await responses.respond(ctx=ctx,
+                                embed=embed)
+    return parsed
+
+
+def field_value(lines: list[str],
+                empty: str = "None") -> str:
+
+    # FUNCTION: Join lines into an embed field value, cut off at Discord's 1024 character limit
+
+    # PARAMS:
+    #   * lines: list[str]: Lines to show
+    #   * empty: str: Value to show if there are no lines
+
+    # RETURNS:
+    #   * value: str: Field value
+
+    if not lines:
+        return empty
+    value = ""
+    for index, line in enumerate(lines):
+        if len(value) + len(line) + 40 > 1024:
+            value += f"...and {len(lines) - index} more"
+            break
+        value += f"{line}\n"
+    return value
+
+
+async def send_list(ctx: discord.ApplicationContext,
+                    list_name: str,
+                    mode: str,
+                    prefix: str) -> None:
+
+    # FUNCTION: Send a global list as an attachment built in memory, or as pages with cursor buttons
+
+    # PARAMS:
+    #   * ctx: discord.ApplicationContext: Command context
+    #   * list_name: str: "whitelist" or "blacklist"
+    #   * mode: str: "file" or "pages"
+    #   * prefix: str: Only show ids starting with this
+
+    entries = common.acl_index.sorted_list(list_name=list_name)
+
+    # Send as pages
+    if mode == "pages":
+        pager = ListPager(list_name=list_name,
+                          prefix=prefix,
+                          user_id=ctx.user.id)
+        await responses.respond(ctx=ctx,
+                                embed=pager.embed(),
+                                view=pager)
+        return
+
+    # Send as file
+    start, end = acl.prefix_range(entries=entries,
+                                  prefix=prefix)
+    buffer = io_2.build_text_file(lines=itertools.islice(entries, start, end))
+    await responses.respond(ctx=ctx,
+                            file=discord.File(buffer, f"{list_name}.txt"))
+
+
+async def bulk_update_list(ctx: discord.ApplicationContext,
+                           list_name: str,
+                           file: discord.Attachment,
+                           remove: bool) -> None:
+
+    # FUNCTION: Add or remove every id in an uploaded text or CSV file as one change, then send a summary
+
+    # PARAMS:
+    #   * ctx: discord.ApplicationContext: Command context
+    #   * list_name: str: "whitelist" or "blacklist"
+    #   * file: discord.Attachment: File of ids, separated by newlines, commas or spaces
+    #   * remove: bool: Whether to remove the ids instead of adding them
+
+    # Check size
+    max_bytes = common.config["permissions"]["import_max_bytes"]
+    if file.size > max_bytes:
+
+        # Send error embed
+        embed = discord.Embed(
+            title="File too large",
+            description=f"'{file.filename}' is {file.size} bytes. Files can be at most {max_bytes} bytes.",
+            color=common.config["colors"]["error"]
+        )
+        await responses.respond(ctx=ctx,
+                                embed=embed)
+        return
+
+    # Parse
+    content = await file.read()
+    ids, repeated, invalid = acl.parse_snowflakes(
+        lines=io_2.iter_text_lines(content=content))
+
+    # Apply the difference with the current list in one change
+    changed = await common.list_writer.submit(list_name=list_name,
+                                              snowflakes=list(map(int, ids)),
+                                              remove=remove)
+    io_2.log(ticker="bot",
+             message="{} {} ids {} the {} from '{}' ({} unchanged, {} invalid)",
+             args=("Removed" if remove else "Added", len(changed), "from" if remove else "to",
+                   list_name, file.filename, len(ids) - len(changed) + repeated, len(invalid)))
+
+    # Send summary embed
+    embed = discord.Embed(
+        title="Successfully removed" if remove else "Successfully imported",
+        description=f"Read {len(ids) + repeated + len(invalid)} entries from '{file.filename}'.",
+        color=common.config["colors"]["success"] if changed or not ids else common.config["colors"]["error"]
+    )
+    embed.add_field(name="Removed" if remove else "Added",
+                    value=str(len(changed)))
+    embed.add_field(name="Not present" if remove else "Duplicates",
+                    value=str(len(ids) - len(changed) + repeated))
+    embed.add_field(name="Invalid",
+                    value=str(len(invalid)))
+    if invalid:
+        embed.add_field(name="Invalid entries",
+                        value=field_value(lines=[f"`{token[:40]}`" for token in invalid]),
+                        inline=False)
+    await responses.respond(ctx=ctx,
+                            embed=embed)
+
+
+async def announce_to_stream(name: str,
+                             title: str,
+                             message: str,
+                             channel_ids: list[int]) -> (list[int], dict[int, str]):
+
+    # FUNCTION: Send an announcement embed to every channel subscribed to a stream
+
+    # PARAMS:
+    #   * name: str: Stream name
+    #   * title: str: Announcement title
+    #   * message: str: Announcement text
+    #   * channel_ids: list[int]: Channels subscribed to the stream, read while holding it
 
-    # Return results
-    return user_id, channel_id, role_ids, server_id
+    # RETURNS:
+    #   * delivered: list[int]: Channels sent to successfully
+    #   * failed: dict[int, str]: Channels that failed, mapped to the reason
+
+    # Create announcement embed
+    announcement = discord.Embed(
+        title=title,
+        description=message,
+        color=common.config["colors"]["generic"]
+    )
+    announcement.set_footer(text=f"Sent via stream '{name}'")
+
+    async def send_to_channel(channel_id: int) -> None:
+        channel = client.get_channel(channel_id)
+        if channel is None:
+            channel = await client.fetch_channel(channel_id)
+        await channel.send(embed=announcement)
+
+    # Send to all subscribed channels
+    settings = common.config["announcements"]
+    return await announce.fan_out(channel_ids=channel_ids,
+                                  send=send_to_channel,
+                                  limiter=announcement_limiter,
+                                  workers=settings["workers"],
+                                  retries=settings["retries"],
+                                  backoff=settings["retry_backoff"],
+                                  is_transient=is_transient)
+
+
+async def fire_scheduled(entry: dict) -> None:
+
+    # FUNCTION: Send a due scheduled announcement
+
+    # PARAMS:
+    #   * entry: dict: Schedule
+
+    # Cancel if stream is gone, e.g. deleted by another shard worker or in data.json
+    if entry["stream"] not in common.data["streams"]:
+        await announcement_scheduler.cancel(entry_id=entry["id"])
+        io_2.log(ticker="scheduler",
+                 message="Cancelled announcement '{}', stream '{}' no longer exists",
+                 args=(entry["id"], entry["stream"]),
+                 level=io_2.WARN)
+        return
+
+    # Send
+    delivered, failed = await announce_to_stream(name=entry["stream"],
+                                                 title=entry["title"],
+                                                 message=entry["message"],
+                                                 channel_ids=list(common.data["streams"][entry["stream"]]["channels"]))
+    io_2.log(ticker="scheduler",
+             message="Sent announcement '{}' to {} channels, {} failed",
+             args=(entry["id"], len(delivered), len(failed)))
+
+
+def is_transient(error: Exception) -> bool:
+
+    # FUNCTION: Check if a send failure is worth retrying
+
+    # PARAMS:
+    #   * error: Exception: Error raised while sending
+
+    # RETURNS:
+    #   * transient: bool: Whether the error is likely temporary
+
+    if isinstance(error, discord.HTTPException):
+        return error.status == 429 or error.status >= 500
+    return isinstance(error, (asyncio.TimeoutError, OSError))
+
+
+# CLASSES
+class ListPager(discord.ui.View):
+
+    # CLASS: Paginated embed over a global list, with previous/next cursor buttons
+
+    def __init__(self,
+                 list_name: str,
+                 prefix: str,
+                 user_id: int,
+                 page_size: int = 20) -> None:
+
+        # PARAMS:
+        #   * list_name: str: "whitelist" or "blacklist"
+        #   * prefix: str: Only show ids starting with this
+        #   * user_id: int: User allowed to turn pages
+        #   * page_size: int: Ids per page
+
+        super().__init__(timeout=300)
+        self.list_name = list_name
+        self.prefix = prefix
+        self.user_id = user_id
+        self.page_size = page_size
+        self.cursor = 0
+
+    def embed(self) -> discord.Embed:
+
+        # FUNCTION: Build the embed for the current page
+
+        # RETURNS:
+        #   * embed: discord.Embed: Page embed
+
+        entries, total = acl.page(entries=common.acl_index.sorted_list(list_name=self.list_name),
+                                  prefix=self.prefix,
+                                  cursor=self.cursor,
+                                  size=self.page_size)
+        embed = discord.Embed(
+            title=f"{self.list_name.capitalize()}" + (f" matching '{self.prefix}'" if self.prefix else ""),
+            description="\n".join(entries) if entries else "No entries.",
+            color=common.config["colors"]["generic"]
+        )
+        embed.set_footer(text=f"{self.cursor + 1 if entries else 0}-{self.cursor + len(entries)} of {total}")
+        self.children[0].disabled = self.cursor == 0
+        self.children[1].disabled = self.cursor + self.page_size >= total
+        return embed
+
+    async def interaction_check(self,
+                                interaction: discord.Interaction) -> bool:
+        return interaction.user.id == self.user_id
+
+    @discord.ui.button(label="Previous", style=discord.ButtonStyle.secondary)
+    async def previous(self,
+                       button: discord.ui.Button,
+                       interaction: discord.Interaction):
+        self.cursor = max(0, self.cursor - self.page_size)
+        await interaction.response.edit_message(embed=self.embed(), view=self)
+
+    @discord.ui.button(label="Next", style=discord.ButtonStyle.secondary)
+    async def next(self,
+                   button: discord.ui.Button,
+                   interaction: discord.Interaction):
+        self.cursor += self.page_size
+        await interaction.response.edit_message(embed=self.embed(), view=self)
 
 
 # MAIN
 # Log
 io_2.log(ticker="bot",
-         message=f"Starting bot...")
+         message="Starting bot...")
 
 
-# Set bot intents
-intents = discord.Intents.default()
+# Set bot intents and caches
+client_options = footprint.client_options(settings=common.config["memory"])
+if not client_options["intents"].guilds:
+    io_2.log(ticker="bot",
+             message="The guilds intent is off, so role permissions cannot be checked.",
+             level=io_2.WARN)
 
 
 # Create various object handles
-client = discord.Bot(intents=intents)
+if worker is None:
+    client = discord.Bot(**client_options)
+else:
+    io_2.log(ticker="shard",
+             message="Worker {} running shards {} of {}",
+             args=(worker, shard_ids, shard_count))
+    client = discord.AutoShardedBot(shard_ids=shard_ids,
+                                    shard_count=shard_count,
+                                    **client_options)
+announcement_limiter = announce.RouteLimiter(global_rate=common.config["announcements"]["global_rate"],
+                                             route_rate=common.config["announcements"]["route_rate"],
+                                             route_burst=common.config["announcements"]["route_burst"],
+                                             max_routes=common.config["announcements"]["max_routes"])
+announcement_scheduler = scheduler.Scheduler(file_path=shard.worker_path(file_path=common.config["announcements"]["schedule_path"],
+                                                                         worker=worker),
+                                             fire=fire_scheduled,
+                                             group_commit_interval=common.config["storage"]["group_commit_interval"])
+announcement_scheduler.load()
 
 
 # EVENTS
@@ -212,13 +676,98 @@ client = discord.Bot(intents=intents)
 @client.event
 async def on_ready():
     io_2.log(ticker="bot",
-             message=f"Successfully logged in as {client.user}")
+             message="Successfully logged in as {}",
+             args=(client.user,))
+    announcement_scheduler.start()
+
+    # Follow changes made by other shard workers
+    global change_follower
+    if worker is not None and change_follower is None:
+        change_follower = asyncio.get_running_loop().create_task(
+            storage.follow_changes(store=common.store,
+                                   interval=common.config["sharding"]["poll_interval"]))
+
+    # Watch config and data for changes
+    global file_watcher
+    if file_watcher is None and common.config["reload"]["poll_interval"] > 0:
+        watched = [loader.CONFIG_PATH]
+        if common.config["storage"]["backend"] == "json":
+            watched.append(loader.DATA_PATH)
+        file_watcher = asyncio.get_running_loop().create_task(
+            reloader.FileWatcher(file_paths=watched,
+                                 on_change=reloader.on_change,
+                                 interval=common.config["reload"]["poll_interval"]).run())
+
+    # Start metrics export
+    global metrics_exporter
+    if metrics_exporter is None:
+        metrics_exporter = asyncio.get_running_loop().create_task(
+            metrics.run_exporter(file_path=shard.worker_path(file_path=common.config["metrics"]["file_path"],
+                                                             worker=worker),
+                                 interval=common.config["metrics"]["export_interval"],
+                                 on_error=lambda error: io_2.log(ticker="metrics",
+                                                                 message="Could not write metrics: {}",
+                                                                 args=(error,),
+                                                                 level=io_2.WARN)))
+
+
+# Before each command
+@client.before_invoke
+async def start_command(ctx: discord.ApplicationContext):
+    ctx.metrics_started = time.perf_counter()
+    ctx.collector = responses.ResponseCollector(ctx=ctx,
+                                                defer_after=common.config["responses"]["defer_after"])
+    ctx.collector.start()
+
+
+# After each command, whether or not it failed
+@client.after_invoke
+async def finish_command(ctx: discord.ApplicationContext):
+
+    # Send the collected response in as few messages as possible
+    response_messages.inc(amount=await ctx.collector.flush())
+    command_seconds.observe(value=time.perf_counter() - ctx.metrics_started,
+                            labels=(ctx.command.qualified_name,))
+
+
+# On command success
+@client.listen("on_application_command_completion")
+async def count_command(ctx: discord.ApplicationContext):
+    commands_total.inc(labels=(ctx.command.qualified_name, "ok"))
+
+
+# On command error
+@client.listen("on_application_command_error")
+async def count_command_error(ctx: discord.ApplicationContext,
+                              error: discord.DiscordException):
+    commands_total.inc(labels=(ctx.command.qualified_name if ctx.command else "unknown", "error"))
+    io_2.log(ticker="bot",
+             message="Command '{}' failed: {}",
+             args=(ctx.command, "".join(traceback.format_exception(type(error), error, error.__traceback__))),
+             level=io_2.ERROR)
+
+    # Send error embed, since the collected response (if any) was flushed before this ran
+    collector = getattr(ctx, "collector", None)
+    if collector is not None:
+        embed = discord.Embed(
+            title="Something went wrong",
+            description="Sorry, this command failed. The error has been logged.",
+            color=common.config["colors"]["error"]
+        )
+        response_messages.inc(amount=await collector.fail(embed=embed))
 
 
 # COMMANDS
 @client.command(description="Displays information about the bot and its configuration in this server.")
 async def about(ctx: discord.ApplicationContext):
 
+    # Get info
+    user_id, channel_id, role_ids, server_id = acl.get_info(ctx=ctx)
+    subscribed = common.subscription_index.streams_for_channel(channel_id=channel_id)
+    created = common.subscription_index.streams_for_server(server_id=server_id)
+    whitelisted = [role_id for role_id in role_ids if role_id in common.acl_index.whitelist]
+    blacklisted = [role_id for role_id in role_ids if role_id in common.acl_index.blacklist]
+
     # Create embed
     embed = discord.Embed(
         title="About Raindrop",
@@ -226,9 +775,11 @@ async def about(ctx: discord.ApplicationContext):
         color=common.config["colors"]["generic"]
     )
     embed.add_field(name="Subscriptions",
-                    value="")  # TODO
+                    value=field_value(lines=[f"This channel: '{name}'" for name in sorted(subscribed)]
+                                            + [f"Created here: '{name}'" for name in sorted(created)]))
     embed.add_field(name="Roles",
-                    value="")  # TODO
+                    value=field_value(lines=[f"Whitelisted: <@&{role_id}>" for role_id in whitelisted]
+                                            + [f"Blacklisted: <@&{role_id}>" for role_id in blacklisted]))
     embed.set_footer(text="version 0.0.1")  # TODO change as necessary
     embed.set_author(name="osteofelidae",
                      icon_url="https://avatars.githubusercontent.com/u/115187283")
@@ -236,7 +787,94 @@ async def about(ctx: discord.ApplicationContext):
     embed.set_image(url="")  # TODO
 
     # Respond to context
-    await ctx.respond(embed=embed)
+    await responses.respond(ctx=ctx,
+                            embed=embed)
+
+
+# Metrics command
+@client.command(name="metrics", description="Summarize command latency, permission checks and IO.")
+async def show_metrics(ctx: discord.ApplicationContext):
+
+    # Check if admin
+    allowed = await check_allowed(ctx=ctx,
+                                  admin_only=True)
+    if not allowed:
+        return
+
+    def latency(histogram: metrics.Histogram,
+                labels: tuple) -> str:
+        count = histogram.snapshot()[labels][2]
+        return (f"{count} runs, p50 {histogram.quantile(fraction=0.5, labels=labels) * 1000:.2f} ms,"
+                f" p99 {histogram.quantile(fraction=0.99, labels=labels) * 1000:.2f} ms")
+
+    # Gather
+    commands = sorted(command_seconds.snapshot().items(), key=lambda item: item[1][2], reverse=True)
+    errors = {labels[0]: count for labels, count in commands_total.values.items() if labels[1] == "error"}
+    lookups = common.decision_cache.hits + common.decision_cache.misses
+
+    # Send summary embed
+    embed = discord.Embed(
+        title="Metrics",
+        description=f"Written to '{common.config['metrics']['file_path']}'"
+                    f" every {common.config['metrics']['export_interval']} seconds.",
+        color=common.config["colors"]["generic"]
+    )
+    embed.add_field(name="Commands",
+                    value=field_value(lines=[f"`{labels[0]}`: {latency(histogram=command_seconds, labels=labels)}"
+                                             + (f", {errors[labels[0]]} errors" if labels[0] in errors else "")
+                                             for labels, entry in commands]),
+                    inline=False)
+    embed.add_field(name="Permission checks",
+                    value=field_value(lines=[f"Cache {labels[0]}: {latency(histogram=permission_seconds, labels=labels)}"
+                                             for labels in sorted(permission_seconds.snapshot())]
+                                            + [f"Cache hit rate: {common.decision_cache.hits / lookups:.1%}"
+                                               if lookups else "Cache hit rate: n/a"]),
+                    inline=False)
+    embed.add_field(name="IO",
+                    value=field_value(lines=[f"`{labels[0]}`: {latency(histogram=io_2.io_seconds, labels=labels)}"
+                                             for labels in sorted(io_2.io_seconds.snapshot())]
+                                            + [f"Log queue: {io_2.log_queue.qsize()} waiting,"
+                                               f" {io_2.dropped_lines} dropped"]),
+                    inline=False)
+    await responses.respond(ctx=ctx,
+                            embed=embed)
+
+
+# Memory command
+@client.command(name="memory", description="Report process memory, library cache sizes and data size.")
+async def show_memory(ctx: discord.ApplicationContext):
+
+    # Check if admin
+    allowed = await check_allowed(ctx=ctx,
+                                  admin_only=True)
+    if not allowed:
+        return
+
+    # Gather
+    rss, peak = footprint.read_rss()
+    caches = footprint.cache_sizes(client=client)
+    data_size = footprint.data_size(data=common.data)
+    settings = common.config["memory"]
+
+    # Send summary embed
+    embed = discord.Embed(
+        title="Memory",
+        description=f"Profile '{settings['profile']}'. Intents: "
+                    + ", ".join(name for name, enabled in client.intents if enabled) + ".",
+        color=common.config["colors"]["generic"]
+    )
+    embed.add_field(name="Process",
+                    value=f"RSS {footprint.format_bytes(size=rss)}, peak {footprint.format_bytes(size=peak)}",
+                    inline=False)
+    embed.add_field(name="Library caches",
+                    value=field_value(lines=[f"{name.capitalize()}: {count}" for name, count in caches.items()]),
+                    inline=False)
+    embed.add_field(name="Data",
+                    value=f"{data_size['streams']} streams, {data_size['subscriptions']} subscriptions,"
+                          f" {data_size['ids']} listed ids, about {footprint.format_bytes(size=data_size['bytes'])}",
+                    inline=False)
+    await responses.respond(ctx=ctx,
+                            embed=embed)
 
 
 # STREAM COMMANDS
@@ -250,37 +888,43 @@ async def create(ctx: discord.ApplicationContext,
                  name: str):
 
     # Check if allowed
-    allowed = await check_allowed(ctx=ctx,
-                                  whitelist=common.data["whitelist"],
-                                  blacklist=common.data["blacklist"])
+    allowed = await check_allowed(ctx=ctx)
     if not allowed:
         return
 
     # Get info
-    user_id, channel_id, role_ids, server_id = get_info(ctx=ctx)
-
-    # Check if exists
-    if name in common.data["streams"]:
-
-        # Send error embed
-        embed = discord.Embed(
-            title="Already exists",
-            description=f"'{name}' already exists. Streams must have a unique name.",
-            color=common.config["colors"]["error"]
-        )
-        await ctx.respond(embed=embed)
-        return
-
-    # Create stream
-    common.data["streams"][name] = {
-        "locked": "False",
-        "origin_server": server_id,
-        "channels": [],
-        "whitelist": [
-            server_id
-        ],
-        "blacklist": []
-    }
+    user_id, channel_id, role_ids, server_id = acl.get_info(ctx=ctx)
+
+    # Hold the stream while checking and changing it
+    async with common.stream_locks.hold(name=name):
+
+        # Check if exists
+        if name in common.data["streams"]:
+
+            # Send error embed
+            embed = discord.Embed(
+                title="Already exists",
+                description=f"'{name}' already exists. Streams must have a unique name.",
+                color=common.config["colors"]["error"]
+            )
+            await responses.respond(ctx=ctx,
+                                    embed=embed)
+            return
+
+        # Create stream
+        await state.commit(record={
+            "op": "stream_create",
+            "name": name,
+            "stream": {
+                "locked": "False",
+                "origin_server": server_id,
+                "channels": [],
+                "whitelist": [
+                    server_id
+                ],
+                "blacklist": []
+            }
+        })
 
     # Send success embed
     embed = discord.Embed(
@@ -288,103 +932,112 @@ async def create(ctx: discord.ApplicationContext,
         description=f"'{name}' has been created.",
         color=common.config["colors"]["success"]
     )
-    await ctx.respond(embed=embed)
+    await responses.respond(ctx=ctx,
+                            embed=embed)
 
 
 # Delete stream command
 @stream_command_group.command(description="Delete a stream.")
 async def delete(ctx: discord.ApplicationContext,
-                 name: str):
+                 name: discord.Option(str, autocomplete=complete_managed_stream)):
 
     # Check if allowed
-    allowed = await check_allowed(ctx=ctx,
-                                  whitelist=common.data["whitelist"],
-                                  blacklist=common.data["blacklist"])
+    allowed = await check_allowed(ctx=ctx)
     if not allowed:
         return
 
-    # Check if exists
-    if name not in common.data["streams"].keys():
-
-        # Send error embed
-        embed = discord.Embed(
-            title="Not found",
-            description=f"'{name}' does not exist.",
-            color=common.config["colors"]["error"]
-        )
-        await ctx.respond(embed=embed)
-        return
-
-    # Check if stream allows it
-    stream_allowed = await check_allowed(ctx=ctx,
-                                         whitelist=common.data["streams"][name]["whitelist"],
-                                         blacklist=common.data["streams"][name]["blacklist"],
-                                         disallowed_response=False)
-    if not stream_allowed:
-
-        # Send error embed
-        embed = discord.Embed(
-            title="Not allowed",
-            description=f"'{name}' cannot be modified here. A stream can only be modified in the server"
-                        f" it was created in, or by authorized users or in authorized servers.",
-            color=common.config["colors"]["error"]
-        )
-        await ctx.respond(embed=embed)
-        return
-
-    # Delete stream
-    del common.data["streams"][name]
+    # Hold the stream while checking and changing it
+    async with common.stream_locks.hold(name=name):
+
+        # Check if exists
+        if name not in common.data["streams"].keys():
+
+            # Send error embed
+            embed = discord.Embed(
+                title="Not found",
+                description=f"'{name}' does not exist.",
+                color=common.config["colors"]["error"]
+            )
+            await responses.respond(ctx=ctx,
+                                    embed=embed)
+            return
+
+        # Check if stream allows it
+        stream_allowed = await check_allowed(ctx=ctx,
+                                             stream=name,
+                                             disallowed_response=False)
+        if not stream_allowed:
+
+            # Send error embed
+            embed = discord.Embed(
+                title="Not allowed",
+                description=f"'{name}' cannot be modified here. A stream can only be modified in the server"
+                            f" it was created in, or by authorized users or in authorized servers.",
+                color=common.config["colors"]["error"]
+            )
+            await responses.respond(ctx=ctx,
+                                    embed=embed)
+            return
+
+        # Delete stream and its scheduled announcements
+        await state.commit(record={"op": "stream_delete", "name": name})
+        cancelled = await announcement_scheduler.cancel_stream(stream=name)
 
     # Send success embed
     embed = discord.Embed(
         title="Stream deleted",
-        description=f"'{name}' has been deleted.",
+        description=f"'{name}' has been deleted."
+                    + (f" {len(cancelled)} scheduled announcements to it were cancelled." if cancelled else ""),
         color=common.config["colors"]["success"]
     )
-    await ctx.respond(embed=embed)
+    await responses.respond(ctx=ctx,
+                            embed=embed)
 
 
 # Subscribe to stream command
 @stream_command_group.command(description="Subscribe to a stream.")
 async def subscribe(ctx: discord.ApplicationContext,
-                    name: str,
+                    name: discord.Option(str, autocomplete=complete_stream),
                     channel: discord.TextChannel):
 
     # Check if allowed
-    allowed = await check_allowed(ctx=ctx,
-                                  whitelist=common.data["whitelist"],
-                                  blacklist=common.data["blacklist"])
+    allowed = await check_allowed(ctx=ctx)
     if not allowed:
         return
 
     # Get info
-    subscribe_channel_id = str(channel.id)
-
-    # Check if stream exists
-    if name not in common.data["streams"]:
-
-        # Send error embed
-        embed = discord.Embed(
-            title="Not found",
-            description=f"'{name}' does not exist.",
-            color=common.config["colors"]["error"]
-        )
-        await ctx.respond(embed=embed)
-        return
-
-    # Check if already subscribed
-    if subscribe_channel_id in common.data["streams"][name]["channels"]:
-        # Send error embed
-        embed = discord.Embed(
-            title="Already subscribed",
-            description=f"'{channel}' is already subscribed to '{name}'.",
-            color=common.config["colors"]["error"]
-        )
-        await ctx.respond(embed=embed)
-        return
-
-    # Subscribe to stream
-    common.data["streams"][name]["channels"].append(subscribe_channel_id)
+    subscribe_channel_id = channel.id
+
+    # Hold the stream while checking and changing it
+    async with common.stream_locks.hold(name=name):
+
+        # Check if stream exists
+        if name not in common.data["streams"]:
+
+            # Send error embed
+            embed = discord.Embed(
+                title="Not found",
+                description=f"'{name}' does not exist.",
+                color=common.config["colors"]["error"]
+            )
+            await responses.respond(ctx=ctx,
+                                    embed=embed)
+            return
+
+        # Check if already subscribed
+        if subscribe_channel_id in common.data["streams"][name]["channels"]:
+            # Send error embed
+            embed = discord.Embed(
+                title="Already subscribed",
+                description=f"'{channel}' is already subscribed to '{name}'.",
+                color=common.config["colors"]["error"]
+            )
+            await responses.respond(ctx=ctx,
+                                    embed=embed)
+            return
+
+        # Subscribe to stream
+        await state.commit(record={"op": "subscribe", "name": name, "channel": subscribe_channel_id})
 
     # Send success embed
     embed = discord.Embed(
@@ -392,50 +1045,54 @@ async def subscribe(ctx: discord.ApplicationContext,
         description=f"'{channel}' has been subscribed to '{name}'.",
         color=common.config["colors"]["success"]
     )
-    await ctx.respond(embed=embed)
+    await responses.respond(ctx=ctx,
+                            embed=embed)
 
 
 # Unsubscribe from stream command
 @stream_command_group.command(description="Unsubscribe from a stream.")
 async def unsubscribe(ctx: discord.ApplicationContext,
-                      name: str,
+                      name: discord.Option(str, autocomplete=complete_stream),
                       channel: discord.TextChannel):
 
     # Check if allowed
-    allowed = await check_allowed(ctx=ctx,
-                                  whitelist=common.data["whitelist"],
-                                  blacklist=common.data["blacklist"])
+    allowed = await check_allowed(ctx=ctx)
     if not allowed:
         return
 
     # Get info
-    subscribe_channel_id = str(channel.id)
-
-    # Check if stream exists
-    if name not in common.data["streams"]:
-
-        # Send error embed
-        embed = discord.Embed(
-            title="Not found",
-            description=f"'{name}' does not exist.",
-            color=common.config["colors"]["error"]
-        )
-        await ctx.respond(embed=embed)
-        return
-
-    # Check if not subscribed
-    if subscribe_channel_id not in common.data["streams"][name]["channels"]:
-        # Send error embed
-        embed = discord.Embed(
-            title="Not found",
-            description=f"'{channel}' is not subscribed to '{name}'.",
-            color=common.config["colors"]["error"]
-        )
-        await ctx.respond(embed=embed)
-        return
-
-    # Subscribe to stream
-    common.data["streams"][name]["channels"].remove(subscribe_channel_id)
+    subscribe_channel_id = channel.id
+
+    # Hold the stream while checking and changing it
+    async with common.stream_locks.hold(name=name):
+
+        # Check if stream exists
+        if name not in common.data["streams"]:
+
+            # Send error embed
+            embed = discord.Embed(
+                title="Not found",
+                description=f"'{name}' does not exist.",
+                color=common.config["colors"]["error"]
+            )
+            await responses.respond(ctx=ctx,
+                                    embed=embed)
+            return
+
+        # Check if not subscribed
+        if subscribe_channel_id not in common.data["streams"][name]["channels"]:
+            # Send error embed
+            embed = discord.Embed(
+                title="Not found",
+                description=f"'{channel}' is not subscribed to '{name}'.",
+                color=common.config["colors"]["error"]
+            )
+            await responses.respond(ctx=ctx,
+                                    embed=embed)
+            return
+
+        # Unsubscribe from stream
+        await state.commit(record={"op": "unsubscribe", "name": name, "channel": subscribe_channel_id})
 
     # Send success embed
     embed = discord.Embed(
@@ -443,64 +1100,74 @@ async def unsubscribe(ctx: discord.ApplicationContext,
         description=f"'{channel}' has been unsubscribed from '{name}'.",
         color=common.config["colors"]["success"]
     )
-    await ctx.respond(embed=embed)
+    await responses.respond(ctx=ctx,
+                            embed=embed)
 
 
 # Whitelist object to stream command
 @stream_command_group.command(description="Whitelist an object to a stream.")
 async def authorize(ctx: discord.ApplicationContext,
-                    name: str,
+                    name: discord.Option(str, autocomplete=complete_managed_stream),
                     snowflake: str):
 
     # Check if allowed
-    allowed = await check_allowed(ctx=ctx,
-                                  whitelist=common.data["whitelist"],
-                                  blacklist=common.data["blacklist"])
+    allowed = await check_allowed(ctx=ctx)
     if not allowed:
         return
 
-    # Check if stream exists
-    if name not in common.data["streams"].keys():
-
-        # Send error embed
-        embed = discord.Embed(
-            title="Not found",
-            description=f"'{name}' does not exist.",
-            color=common.config["colors"]["error"]
-        )
-        await ctx.respond(embed=embed)
-        return
-
-    # Check if stream allows it
-    stream_allowed = await check_allowed(ctx=ctx,
-                                         whitelist=common.data["streams"][name]["whitelist"],
-                                         blacklist=common.data["streams"][name]["blacklist"],
-                                         disallowed_response=False)
-    if not stream_allowed:
-
-        # Send error embed
-        embed = discord.Embed(
-            title="Not allowed",
-            description=f"'{name}' cannot be modified here. A stream can only be modified in the server"
-                        f" it was created in, or by authorized users or in authorized servers.",
-            color=common.config["colors"]["error"]
-        )
-        await ctx.respond(embed=embed)
+    # Parse id
+    snowflake = await read_snowflake(ctx=ctx,
+                                     snowflake=snowflake)
+    if snowflake is None:
         return
 
-    # Check if object exists
-    if snowflake in common.data["streams"][name]["whitelist"]:
-        # Send error embed
-        embed = discord.Embed(
-            title="Already authorized",
-            description=f"'{snowflake}' is already authorized to modify '{name}'.",
-            color=common.config["colors"]["error"]
-        )
-        await ctx.respond(embed=embed)
-        return
-
-    # Whitelist
-    common.data["streams"][name]["whitelist"].append(snowflake)
+    # Hold the stream while checking and changing it
+    async with common.stream_locks.hold(name=name):
+
+        # Check if stream exists
+        if name not in common.data["streams"].keys():
+
+            # Send error embed
+            embed = discord.Embed(
+                title="Not found",
+                description=f"'{name}' does not exist.",
+                color=common.config["colors"]["error"]
+            )
+            await responses.respond(ctx=ctx,
+                                    embed=embed)
+            return
+
+        # Check if stream allows it
+        stream_allowed = await check_allowed(ctx=ctx,
+                                             stream=name,
+                                             disallowed_response=False)
+        if not stream_allowed:
+
+            # Send error embed
+            embed = discord.Embed(
+                title="Not allowed",
+                description=f"'{name}' cannot be modified here. A stream can only be modified in the server"
+                            f" it was created in, or by authorized users or in authorized servers.",
+                color=common.config["colors"]["error"]
+            )
+            await responses.respond(ctx=ctx,
+                                    embed=embed)
+            return
+
+        # Check if object exists
+        if snowflake in common.acl_index.streams[name]["whitelist"]:
+            # Send error embed
+            embed = discord.Embed(
+                title="Already authorized",
+                description=f"'{snowflake}' is already authorized to modify '{name}'.",
+                color=common.config["colors"]["error"]
+            )
+            await responses.respond(ctx=ctx,
+                                    embed=embed)
+            return
+
+        # Whitelist
+        await state.commit(record={"op": "authorize", "name": name, "snowflake": snowflake})
 
     # Send success embed
     embed = discord.Embed(
@@ -508,85 +1175,316 @@ async def authorize(ctx: discord.ApplicationContext,
         description=f"'{snowflake}' is now authorized to modify '{name}'.",
         color=common.config["colors"]["success"]
     )
-    await ctx.respond(embed=embed)
+    await responses.respond(ctx=ctx,
+                            embed=embed)
 
 
 # De-whitelist object to stream command
 @stream_command_group.command(description="De-whitelist an object to a stream.")
 async def unauthorize(ctx: discord.ApplicationContext,
-                      name: str,
+                      name: discord.Option(str, autocomplete=complete_managed_stream),
                       snowflake: str):
 
     # Check if allowed
-    allowed = await check_allowed(ctx=ctx,
-                                  whitelist=common.data["whitelist"],
-                                  blacklist=common.data["blacklist"])
+    allowed = await check_allowed(ctx=ctx)
     if not allowed:
         return
 
-    # Check if stream exists
-    if name not in common.data["streams"].keys():
+    # Parse id
+    snowflake = await read_snowflake(ctx=ctx,
+                                     snowflake=snowflake)
+    if snowflake is None:
+        return
 
-        # Send error embed
-        embed = discord.Embed(
-            title="Not found",
-            description=f"'{name}' does not exist.",
-            color=common.config["colors"]["error"]
-        )
-        await ctx.respond(embed=embed)
+    # Hold the stream while checking and changing it
+    async with common.stream_locks.hold(name=name):
+
+        # Check if stream exists
+        if name not in common.data["streams"].keys():
+
+            # Send error embed
+            embed = discord.Embed(
+                title="Not found",
+                description=f"'{name}' does not exist.",
+                color=common.config["colors"]["error"]
+            )
+            await responses.respond(ctx=ctx,
+                                    embed=embed)
+            return
+
+        # Check if stream allows it
+        stream_allowed = await check_allowed(ctx=ctx,
+                                             stream=name,
+                                             disallowed_response=False)
+        if not stream_allowed:
+
+            # Send error embed
+            embed = discord.Embed(
+                title="Not allowed",
+                description=f"'{name}' cannot be modified here. A stream can only be modified in the server"
+                            f" it was created in, or by authorized users or in authorized servers.",
+                color=common.config["colors"]["error"]
+            )
+            await responses.respond(ctx=ctx,
+                                    embed=embed)
+            return
+
+        # Check if object exists
+        if snowflake not in common.acl_index.streams[name]["whitelist"]:
+            # Send error embed
+            embed = discord.Embed(
+                title="Already authorized",
+                description=f"'{snowflake}' is already not authorized to modify '{name}'.",
+                color=common.config["colors"]["error"]
+            )
+            await responses.respond(ctx=ctx,
+                                    embed=embed)
+            return
+
+        # De-whitelist
+        await state.commit(record={"op": "unauthorize", "name": name, "snowflake": snowflake})
+
+    # Send success embed
+    embed = discord.Embed(
+        title="Unauthorized",
+        description=f"'{snowflake}' is now not authorized to modify '{name}'.",
+        color=common.config["colors"]["success"]
+    )
+    await responses.respond(ctx=ctx,
+                            embed=embed)
+
+
+# ANNOUNCEMENT COMMANDS
+announcement_command_group = client.create_group(name="announcement",
+                                                 description="Commands to interface with announcements.")
+
+
+# Send announcement command
+@announcement_command_group.command(description="Send an announcement to every channel subscribed to a stream.")
+async def send(ctx: discord.ApplicationContext,
+               name: discord.Option(str, autocomplete=complete_managed_stream),
+               title: str,
+               message: str):
+
+    # Check if allowed
+    allowed = await check_allowed(ctx=ctx)
+    if not allowed:
         return
 
-    # Check if stream allows it
-    stream_allowed = await check_allowed(ctx=ctx,
-                                         whitelist=common.data["streams"][name]["whitelist"],
-                                         blacklist=common.data["streams"][name]["blacklist"],
-                                         disallowed_response=False)
-    if not stream_allowed:
+    # Hold the stream while checking it and reading its subscribers
+    async with common.stream_locks.hold(name=name):
+
+        # Check if stream exists
+        if name not in common.data["streams"]:
+
+            # Send error embed
+            embed = discord.Embed(
+                title="Not found",
+                description=f"'{name}' does not exist.",
+                color=common.config["colors"]["error"]
+            )
+            await responses.respond(ctx=ctx,
+                                    embed=embed)
+            return
+
+        # Check if stream allows it
+        stream_allowed = await check_allowed(ctx=ctx,
+                                             stream=name,
+                                             disallowed_response=False)
+        if not stream_allowed:
+
+            # Send error embed
+            embed = discord.Embed(
+                title="Not allowed",
+                description=f"'{name}' cannot be announced to from here. Announcements can only be sent from the server"
+                            f" the stream was created in, or by authorized users or in authorized servers.",
+                color=common.config["colors"]["error"]
+            )
+            await responses.respond(ctx=ctx,
+                                    embed=embed)
+            return
+
+        # Read subscribers, so fan-out can run after the stream is released
+        channel_ids = list(common.data["streams"][name]["channels"])
+
+    # Defer, since fan-out can outlast the interaction deadline
+    await ctx.collector.defer()
+
+    # Send to all subscribed channels
+    delivered, failed = await announce_to_stream(name=name,
+                                                 title=title,
+                                                 message=message,
+                                                 channel_ids=channel_ids)
+
+    # Send report embed
+    embed = discord.Embed(
+        title="Announcement sent",
+        description=f"'{title}' was sent to {len(delivered)} of {len(delivered) + len(failed)} channels in '{name}'.",
+        color=common.config["colors"]["error" if failed else "success"]
+    )
+    if failed:
+        embed.add_field(name="Failed",
+                        value=field_value(lines=[f"<#{channel_id}>: {reason}" for channel_id, reason in failed.items()]))
+    await responses.respond(ctx=ctx,
+                            embed=embed)
+
+
+# Schedule announcement command
+@announcement_command_group.command(description="Schedule an announcement to a stream, optionally repeating.")
+async def schedule(ctx: discord.ApplicationContext,
+                   name: discord.Option(str, autocomplete=complete_managed_stream),
+                   title: str,
+                   message: str,
+                   delay_minutes: float,
+                   repeat_minutes: float = 0.0):
 
-        # Send error embed
-        embed = discord.Embed(
-            title="Not allowed",
-            description=f"'{name}' cannot be modified here. A stream can only be modified in the server"
-                        f" it was created in, or by authorized users or in authorized servers.",
-            color=common.config["colors"]["error"]
-        )
-        await ctx.respond(embed=embed)
+    # Check if allowed
+    allowed = await check_allowed(ctx=ctx)
+    if not allowed:
         return
 
-    # Check if object exists
-    if snowflake not in common.data["streams"][name]["whitelist"]:
+    # Hold the stream while checking it and scheduling to it
+    async with common.stream_locks.hold(name=name):
+
+        # Check if stream exists
+        if name not in common.data["streams"]:
+
+            # Send error embed
+            embed = discord.Embed(
+                title="Not found",
+                description=f"'{name}' does not exist.",
+                color=common.config["colors"]["error"]
+            )
+            await responses.respond(ctx=ctx,
+                                    embed=embed)
+            return
+
+        # Check if stream allows it
+        stream_allowed = await check_allowed(ctx=ctx,
+                                             stream=name,
+                                             disallowed_response=False)
+        if not stream_allowed:
+
+            # Send error embed
+            embed = discord.Embed(
+                title="Not allowed",
+                description=f"'{name}' cannot be announced to from here. Announcements can only be sent from the server"
+                            f" the stream was created in, or by authorized users or in authorized servers.",
+                color=common.config["colors"]["error"]
+            )
+            await responses.respond(ctx=ctx,
+                                    embed=embed)
+            return
+
+        # Check timing
+        if delay_minutes < 0 or (repeat_minutes != 0 and repeat_minutes < 1):
+
+            # Send error embed
+            embed = discord.Embed(
+                title="Invalid timing",
+                description="The delay cannot be negative, and repeats must be at least a minute apart.",
+                color=common.config["colors"]["error"]
+            )
+            await responses.respond(ctx=ctx,
+                                    embed=embed)
+            return
+
+        # Schedule
+        entry = await announcement_scheduler.add(stream=name,
+                                                 title=title,
+                                                 message=message,
+                                                 at=time.time() + delay_minutes * 60,
+                                                 interval=repeat_minutes * 60,
+                                                 author=str(ctx.user.id))
+
+    # Send success embed
+    embed = discord.Embed(
+        title="Announcement scheduled",
+        description=f"'{title}' will be sent to '{name}' <t:{int(entry['at'])}:R>"
+                    + (f" and every {repeat_minutes:g} minutes after." if repeat_minutes else ".")
+                    + f" Cancel it with ID '{entry['id']}'.",
+        color=common.config["colors"]["success"]
+    )
+    await responses.respond(ctx=ctx,
+                            embed=embed)
+
+
+# Cancel scheduled announcement command
+@announcement_command_group.command(description="Cancel a scheduled announcement.")
+async def cancel(ctx: discord.ApplicationContext,
+                 schedule_id: str):
+
+    # Check if allowed
+    allowed = await check_allowed(ctx=ctx)
+    if not allowed:
+        return
+
+    # Check if exists
+    entry = announcement_scheduler.entries.get(schedule_id)
+    if entry is None:
+
         # Send error embed
         embed = discord.Embed(
-            title="Already authorized",
-            description=f"'{snowflake}' is already not authorized to modify '{name}'.",
+            title="Not found",
+            description=f"There is no scheduled announcement '{schedule_id}'.",
             color=common.config["colors"]["error"]
         )
-        await ctx.respond(embed=embed)
+        await responses.respond(ctx=ctx,
+                                embed=embed)
         return
 
-    # Whitelist
-    common.data["streams"][name]["whitelist"].remove(snowflake)
+    # Check if stream allows it
+    if entry["stream"] in common.data["streams"]:
+        stream_allowed = await check_allowed(ctx=ctx,
+                                             stream=entry["stream"],
+                                             disallowed_response=False)
+        if not stream_allowed:
+
+            # Send error embed
+            embed = discord.Embed(
+                title="Not allowed",
+                description=f"Announcements to '{entry['stream']}' cannot be cancelled here.",
+                color=common.config["colors"]["error"]
+            )
+            await responses.respond(ctx=ctx,
+                                    embed=embed)
+            return
+
+    # Cancel
+    await announcement_scheduler.cancel(entry_id=schedule_id)
 
     # Send success embed
     embed = discord.Embed(
-        title="Unauthorized",
-        description=f"'{snowflake}' is now not authorized to modify '{name}'.",
+        title="Announcement cancelled",
+        description=f"'{entry['title']}' to '{entry['stream']}' has been cancelled.",
         color=common.config["colors"]["success"]
     )
-    await ctx.respond(embed=embed)
-
-
-# ANNOUNCEMENT COMMANDS
-announcement_command_group = client.create_group(name="announcement",
-                                                 description="Commands to interface with announcements.")
+    await responses.respond(ctx=ctx,
+                            embed=embed)
 
-# TODO announce send command w/ auto-propagate
 
-# TODO announce new command
+# List scheduled announcements command
+@announcement_command_group.command(description="List the next scheduled announcements.")
+async def scheduled(ctx: discord.ApplicationContext):
 
-# TODO announce send command
+    # Check if allowed
+    allowed = await check_allowed(ctx=ctx)
+    if not allowed:
+        return
 
-# TODO announcement scheduling?
+    # Send list embed
+    entries = announcement_scheduler.upcoming(limit=20)
+    embed = discord.Embed(
+        title="Scheduled announcements",
+        description=f"{len(announcement_scheduler.entries)} pending.",
+        color=common.config["colors"]["generic"]
+    )
+    embed.add_field(name="Next up",
+                    value=field_value(lines=[f"`{entry['id']}` <t:{int(entry['at'])}:R> '{entry['title']}' to '{entry['stream']}'"
+                                             + (f" every {entry['interval'] / 60:g} min" if entry["interval"] else "")
+                                             for entry in entries]))
+    await responses.respond(ctx=ctx,
+                            embed=embed)
 
 
 # WHITELIST COMMANDS
@@ -605,11 +1503,16 @@ async def add(ctx: discord.ApplicationContext,
     if not allowed:
         return
 
-    # Reinforce type
-    snowflake = str(snowflake)
+    # Parse id
+    snowflake = await read_snowflake(ctx=ctx,
+                                     snowflake=snowflake)
+    if snowflake is None:
+        return
 
-    # Check if already in it
-    if snowflake in common.data["whitelist"]:
+    # Add to whitelist, unless already in it
+    changed = await common.list_writer.submit(list_name="whitelist",
+                                              snowflakes=[snowflake])
+    if not changed:
 
         # Send error embed
         embed = discord.Embed(
@@ -617,19 +1520,18 @@ async def add(ctx: discord.ApplicationContext,
             description=f"'{snowflake}' is already whitelisted.",
             color=common.config["colors"]["error"]
         )
-        await ctx.respond(embed=embed)
+        await responses.respond(ctx=ctx,
+                                embed=embed)
         return
 
-    # Add to whitelist
-    common.data["whitelist"].append(snowflake)
-
     # Send success embed
     embed = discord.Embed(
         title="Successfully whitelisted",
         description=f"'{snowflake}' has been whitelisted successfully.",
         color=common.config["colors"]["success"]
     )
-    await ctx.respond(embed=embed)
+    await responses.respond(ctx=ctx,
+                            embed=embed)
 
 
 # Remove from whitelist command
@@ -643,11 +1545,17 @@ async def remove(ctx: discord.ApplicationContext,
     if not allowed:
         return
 
-    # Reinforce type
-    snowflake = str(snowflake)
+    # Parse id
+    snowflake = await read_snowflake(ctx=ctx,
+                                     snowflake=snowflake)
+    if snowflake is None:
+        return
 
-    # Check if not in it
-    if snowflake not in common.data["whitelist"]:
+    # Remove from whitelist, unless not in it
+    changed = await common.list_writer.submit(list_name="whitelist",
+                                              snowflakes=[snowflake],
+                                              remove=True)
+    if not changed:
 
         # Send error embed
         embed = discord.Embed(
@@ -655,24 +1563,43 @@ async def remove(ctx: discord.ApplicationContext,
             description=f"'{snowflake}' is not in the whitelist.",
             color=common.config["colors"]["error"]
         )
-        await ctx.respond(embed=embed)
+        await responses.respond(ctx=ctx,
+                                embed=embed)
         return
 
-    # Remove from whitelist
-    common.data["whitelist"].remove(snowflake)
-
     # Send success embed
     embed = discord.Embed(
         title="Successfully removed",
         description=f"'{snowflake}' has been removed from the whitelist.",
         color=common.config["colors"]["success"]
     )
-    await ctx.respond(embed=embed)
+    await responses.respond(ctx=ctx,
+                            embed=embed)
 
 
 # View whitelist command
 @whitelist_command_group.command(description="View the whitelist.")
-async def view(ctx: discord.ApplicationContext):
+async def view(ctx: discord.ApplicationContext,
+               mode: discord.Option(str, choices=["file", "pages"], default="file"),
+               prefix: str = ""):
+
+    # Check if admin
+    allowed = await check_allowed(ctx=ctx,
+                                  admin_only=True)
+    if not allowed:
+        return
+
+    # Send list
+    await send_list(ctx=ctx,
+                    list_name="whitelist",
+                    mode=mode,
+                    prefix=prefix)
+
+
+# Bulk add to whitelist command
+@whitelist_command_group.command(description="Add every id in a text or CSV file to the whitelist.")
+async def bulk_add(ctx: discord.ApplicationContext,
+                   file: discord.Attachment):
 
     # Check if admin
     allowed = await check_allowed(ctx=ctx,
@@ -680,14 +1607,29 @@ async def view(ctx: discord.ApplicationContext):
     if not allowed:
         return
 
-    # Write whitelist to file
-    with open("temp/whitelist.txt", "w") as file:
-        file.writelines(f"{line}\n" for line in common.data["whitelist"])
+    # Add ids
+    await bulk_update_list(ctx=ctx,
+                           list_name="whitelist",
+                           file=file,
+                           remove=False)
 
-    # Send file
-    with open("temp/whitelist.txt", "r") as file:
-        discord_file = discord.File(file, "whitelist.txt")
-        await ctx.respond(file=discord_file)
+
+# Bulk remove from whitelist command
+@whitelist_command_group.command(description="Remove every id in a text or CSV file from the whitelist.")
+async def bulk_remove(ctx: discord.ApplicationContext,
+                      file: discord.Attachment):
+
+    # Check if admin
+    allowed = await check_allowed(ctx=ctx,
+                                  admin_only=True)
+    if not allowed:
+        return
+
+    # Remove ids
+    await bulk_update_list(ctx=ctx,
+                           list_name="whitelist",
+                           file=file,
+                           remove=True)
 
 
 # BLACKLIST COMMANDS
@@ -706,11 +1648,16 @@ async def add(ctx: discord.ApplicationContext,
     if not allowed:
         return
 
-    # Reinforce type
-    snowflake = str(snowflake)
+    # Parse id
+    snowflake = await read_snowflake(ctx=ctx,
+                                     snowflake=snowflake)
+    if snowflake is None:
+        return
 
-    # Check if already in it
-    if snowflake in common.data["blacklist"]:
+    # Add to blacklist, unless already in it
+    changed = await common.list_writer.submit(list_name="blacklist",
+                                              snowflakes=[snowflake])
+    if not changed:
 
         # Send error embed
         embed = discord.Embed(
@@ -718,19 +1665,18 @@ async def add(ctx: discord.ApplicationContext,
             description=f"'{snowflake}' is already blacklisted.",
             color=common.config["colors"]["error"]
         )
-        await ctx.respond(embed=embed)
+        await responses.respond(ctx=ctx,
+                                embed=embed)
         return
 
-    # Add to whitelist
-    common.data["blacklist"].append(snowflake)
-
     # Send success embed
     embed = discord.Embed(
         title="Successfully blacklisted",
         description=f"'{snowflake}' has been blacklisted successfully.",
         color=common.config["colors"]["success"]
     )
-    await ctx.respond(embed=embed)
+    await responses.respond(ctx=ctx,
+                            embed=embed)
 
 
 # Remove from blacklist command
@@ -744,11 +1690,17 @@ async def remove(ctx: discord.ApplicationContext,
     if not allowed:
         return
 
-    # Reinforce type
-    snowflake = str(snowflake)
+    # Parse id
+    snowflake = await read_snowflake(ctx=ctx,
+                                     snowflake=snowflake)
+    if snowflake is None:
+        return
 
-    # Check if not in it
-    if snowflake not in common.data["blacklist"]:
+    # Remove from blacklist, unless not in it
+    changed = await common.list_writer.submit(list_name="blacklist",
+                                              snowflakes=[snowflake],
+                                              remove=True)
+    if not changed:
 
         # Send error embed
         embed = discord.Embed(
@@ -756,24 +1708,88 @@ async def remove(ctx: discord.ApplicationContext,
             description=f"'{snowflake}' is not in the blacklist.",
             color=common.config["colors"]["error"]
         )
-        await ctx.respond(embed=embed)
+        await responses.respond(ctx=ctx,
+                                embed=embed)
         return
 
-    # Remove from whitelist
-    common.data["blacklist"].remove(snowflake)
-
     # Send success embed
     embed = discord.Embed(
         title="Successfully removed",
         description=f"'{snowflake}' has been removed from the blacklist.",
         color=common.config["colors"]["success"]
     )
-    await ctx.respond(embed=embed)
+    await responses.respond(ctx=ctx,
+                            embed=embed)
 
 
 # View blacklist command
 @blacklist_command_group.command(description="View the blacklist.")
-async def view(ctx: discord.ApplicationContext):
+async def view(ctx: discord.ApplicationContext,
+               mode: discord.Option(str, choices=["file", "pages"], default="file"),
+               prefix: str = ""):
+
+    # Check if admin
+    allowed = await check_allowed(ctx=ctx,
+                                  admin_only=True)
+    if not allowed:
+        return
+
+    # Send list
+    await send_list(ctx=ctx,
+                    list_name="blacklist",
+                    mode=mode,
+                    prefix=prefix)
+
+
+# Bulk add to blacklist command
+@blacklist_command_group.command(description="Add every id in a text or CSV file to the blacklist.")
+async def bulk_add(ctx: discord.ApplicationContext,
+                   file: discord.Attachment):
+
+    # Check if admin
+    allowed = await check_allowed(ctx=ctx,
+                                  admin_only=True)
+    if not allowed:
+        return
+
+    # Add ids
+    await bulk_update_list(ctx=ctx,
+                           list_name="blacklist",
+                           file=file,
+                           remove=False)
+
+
+# Bulk remove from blacklist command
+@blacklist_command_group.command(description="Remove every id in a text or CSV file from the blacklist.")
+async def bulk_remove(ctx: discord.ApplicationContext,
+                      file: discord.Attachment):
+
+    # Check if admin
+    allowed = await check_allowed(ctx=ctx,
+                                  admin_only=True)
+    if not allowed:
+        return
+
+    # Remove ids
+    await bulk_update_list(ctx=ctx,
+                           list_name="blacklist",
+                           file=file,
+                           remove=True)
+
+
+# LOG COMMANDS
+log_command_group = client.create_group(name="log",
+                                        description="Commands to search the bot's logs.")
+
+
+# Search logs command
+@log_command_group.command(name="search",
+                           description="Search the logs by ticker, ID and time range, e.g. to review a denial.")
+async def search_logs(ctx: discord.ApplicationContext,
+                      ticker: discord.Option(str, description="e.g. perm", default=None),
+                      snowflake: discord.Option(str, description="ID the lines mention", default=None),
+                      since: discord.Option(str, description="e.g. 2026-01-31 18:00, or 6h ago as '6h'", default=None),
+                      until: discord.Option(str, description="Same format as since", default=None)):
 
     # Check if admin
     allowed = await check_allowed(ctx=ctx,
@@ -781,15 +1797,187 @@ async def view(ctx: discord.ApplicationContext):
     if not allowed:
         return
 
-    # Write blacklist to file
-    with open("temp/blacklist.txt", "w") as file:
-        file.writelines(f"{line}\n" for line in common.data["blacklist"])
+    # Parse options
+    if snowflake is not None:
+        snowflake = await read_snowflake(ctx=ctx,
+                                         snowflake=snowflake)
+        if snowflake is None:
+            return
+    try:
+        since_time = parse_time(value=since) if since else None
+        until_time = parse_time(value=until) if until else None
+    except ValueError:
+
+        # Send error embed
+        embed = discord.Embed(
+            title="Invalid time",
+            description="Times are like '2026-01-31 18:00', or a time ago like '90m', '6h' or '2d'.",
+            color=common.config["colors"]["error"]
+        )
+        await responses.respond(ctx=ctx,
+                                embed=embed)
+        return
+
+    # Search off the event loop, after writing out queued lines
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, io_2.update_log_file)
+    lines, stats = await loop.run_in_executor(None, lambda: logsearch.search(
+        file_path=common.config["logging"]["file_path"],
+        ticker=ticker,
+        snowflake=None if snowflake is None else str(snowflake),
+        since=since_time,
+        until=until_time,
+        max_lines=common.config["log_search"]["max_lines"]))
+
+    # Send summary embed with the lines attached
+    embed = discord.Embed(
+        title="Log search",
+        description=f"{len(lines)} matching lines"
+                    + (f" (the newest {len(lines)} shown)" if stats["truncated"] else "")
+                    + f", from {stats['files']} log files.",
+        color=common.config["colors"]["generic"]
+    )
+    await responses.respond(ctx=ctx,
+                            embed=embed,
+                            file=discord.File(io_2.build_text_file(lines=lines), "log-search.txt") if lines else None)
+
+
+# BACKUP COMMANDS
+backup_command_group = client.create_group(name="backup",
+                                           description="Commands to export and import every stream and list.")
+
+
+# Export command
+@backup_command_group.command(name="export",
+                              description="Export every stream, subscription and list as compressed attachments.")
+async def export_backup(ctx: discord.ApplicationContext):
+
+    # Check if admin
+    allowed = await check_allowed(ctx=ctx,
+                                  admin_only=True)
+    if not allowed:
+        return
+
+    # Send each part as it is finished, so only one is held at a time
+    await ctx.collector.defer()
+    created = datetime.now()
+    parts = 0
+    size = 0
+    async for part in backup.export_parts(data=common.data,
+                                          max_bytes=common.config["backup"]["max_part_bytes"],
+                                          created=created.isoformat(timespec="seconds")):
+        parts += 1
+        size += len(part)
+        await ctx.respond(file=discord.File(io.BytesIO(part),
+                                            f"raindrop-backup-{created:%Y-%m-%dT%H-%M-%S}-{parts:03}.jsonl.gz"))
+    io_2.log(ticker="bot",
+             message="Exported {} streams in {} parts ({} bytes)",
+             args=(len(common.data["streams"]), parts, size))
+
+    # Send summary embed
+    embed = discord.Embed(
+        title="Exported",
+        description=f"{len(common.data['streams'])} streams and their subscriptions, and the global lists, in"
+                    f" {parts} {'part' if parts == 1 else 'parts'} ({footprint.format_bytes(size=size)}). Import"
+                    f" each part with `/backup import`.",
+        color=common.config["colors"]["success"]
+    )
+    await responses.respond(ctx=ctx,
+                            embed=embed)
 
-    # Send file
-    with open("temp/blacklist.txt", "r") as file:
-        discord_file = discord.File(file, "blacklist.txt")
-        await ctx.respond(file=discord_file)
 
+# Import command
+@backup_command_group.command(name="import",
+                              description="Import one part of an export. Streams with the same name are replaced.")
+async def import_backup(ctx: discord.ApplicationContext,
+                        file: discord.Attachment,
+                        include_admins: bool = False):
 
-# Run bot loop
-client.run(common.BOT_TOKEN)
+    # Check if admin
+    allowed = await check_allowed(ctx=ctx,
+                                  admin_only=True)
+    if not allowed:
+        return
+
+    # Check size
+    settings = common.config["backup"]
+    if file.size > settings["max_part_bytes"]:
+
+        # Send error embed
+        embed = discord.Embed(
+            title="File too large",
+            description=f"'{file.filename}' is {file.size} bytes. Parts can be at most"
+                        f" {settings['max_part_bytes']} bytes.",
+            color=common.config["colors"]["error"]
+        )
+        await responses.respond(ctx=ctx,
+                                embed=embed)
+        return
+
+    # Check the whole part off the event loop before changing anything
+    await ctx.collector.defer()
+    content = await file.read()
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, backup.count_part, content)
+    except ValueError as error:
+
+        # Send error embed
+        embed = discord.Embed(
+            title="Invalid backup",
+            description=f"'{file.filename}' could not be imported: {error}. Nothing was changed.",
+            color=common.config["colors"]["error"]
+        )
+        await responses.respond(ctx=ctx,
+                                embed=embed)
+        return
+
+    # Import
+    counts = await backup.import_part(content=content,
+                                      batch_records=settings["batch_records"],
+                                      include_admins=include_admins)
+    io_2.log(ticker="bot",
+             message="Imported {} streams ({} replaced) and {} new ids ({} admins, {} admins left out) from '{}'",
+             args=(counts["streams"], len(counts["replaced"]), counts["ids"], counts["admins"],
+                   counts["skipped_admins"], file.filename))
+    if counts["admins"]:
+        io_2.log(ticker="bot",
+                 message="Backup import by '{}' added {} admins",
+                 args=(ctx.user.id, counts["admins"]),
+                 level=io_2.WARN)
+
+    # Send summary embed
+    embed = discord.Embed(
+        title="Imported",
+        description=f"Imported '{file.filename}'.",
+        color=common.config["colors"]["success"]
+    )
+    embed.add_field(name="Streams",
+                    value=str(counts["streams"]))
+    embed.add_field(name="New list IDs",
+                    value=str(counts["ids"]))
+    embed.add_field(name="New admins",
+                    value=str(counts["admins"]))
+    if counts["replaced"]:
+        embed.add_field(name="Replaced streams",
+                        value=field_value(lines=[f"'{name}'" for name in counts["replaced"]]),
+                        inline=False)
+    if counts["skipped_admins"]:
+        embed.add_field(name="Admins not imported",
+                        value=f"{counts['skipped_admins']} admin IDs in the file were left out. Import again with"
+                              f" `include_admins` to add them.",
+                        inline=False)
+    await responses.respond(ctx=ctx,
+                            embed=embed)
+
+
+# Log startup timings
+startup_timer.mark(name="client and commands")
+startup_timer.report()
+
+# Run bot loop, unless imported to drive the commands without Discord (see mutations.py)
+if __name__ == "__main__":
+    client.run(common.BOT_TOKEN)
+    common.store.close()
+
+    # Flush remaining log lines
+    io_2.update_log_file()
@@ -1,8 +1,13 @@
 # FILE: Shared variables (globals) + miscellaneous functions
 
 
+# DEPENDENCIES
+import copy
+
+
 # CONSTANTS
 LOG_FILE_PATH = "logs/log.txt"
+SNAPSHOT_PATH = "data/state.snapshot"  # Binary cache of parsed config and data
 
 BOT_TOKEN = ""  # TODO move to config
 
@@ -10,3 +15,77 @@ BOT_TOKEN = ""  # TODO move to config
 # VARIABLES
 config = {}
 data = {}
+acl_index = None  # ACL index over data, built at startup
+store = None  # Persistence backend for data changes
+subscription_index = None  # Channel/server to stream indexes, built at startup
+stream_names = None  # Stream name prefix index for autocomplete, built at startup
+decision_cache = None  # Cached permission decisions
+rate_limiter = None  # Command rate limits per user and guild
+stream_locks = None  # Locks held by commands that check and change a stream
+list_writer = None  # Single writer for global list changes
+
+
+# FUNCTIONS
+def validate_config(config: dict,
+                    defaults: dict) -> dict:
+
+    # FUNCTION: Check a parsed config file, filling in sections and settings it is missing from the defaults
+
+    # PARAMS:
+    #   * config: dict: Parsed config
+    #   * defaults: dict: Parsed default config
+
+    # RETURNS:
+    #   * config: dict: The same config, completed
+
+    if not isinstance(config, dict) or config.get("configured") != "True":
+        raise ValueError("config is not configured")
+
+    # Fill missing sections and settings
+    for section, default in defaults.items():
+        if section not in config:
+            config[section] = copy.deepcopy(default)
+        elif isinstance(default, dict):
+            if not isinstance(config[section], dict):
+                raise ValueError(f"config section '{section}' is not an object")
+            for key, value in default.items():
+                config[section].setdefault(key, copy.deepcopy(value))
+
+    # Check colors
+    for name, color in config["colors"].items():
+        if not isinstance(color, int):
+            raise ValueError(f"color '{name}' is not an integer")
+
+    return config
+
+
+def validate_data(data: dict) -> dict:
+
+    # FUNCTION: Check parsed data, adding empty stream lists where they are missing
+
+    # PARAMS:
+    #   * data: dict: Parsed data
+
+    # RETURNS:
+    #   * data: dict: The same data, completed
+
+    if not isinstance(data, dict) or data.get("configured") != "True":
+        raise ValueError("data is not configured")
+
+    # Check global lists
+    for list_name in ("whitelist", "blacklist", "admins"):
+        if not isinstance(data.get(list_name), list) or not all(isinstance(item, str) for item in data[list_name]):
+            raise ValueError(f"'{list_name}' is not a list of ids")
+
+    # Check streams
+    if not isinstance(data.get("streams"), dict):
+        raise ValueError("'streams' is not an object")
+    for name, stream in data["streams"].items():
+        if not isinstance(stream, dict) or not isinstance(stream.get("origin_server"), str):
+            raise ValueError(f"stream '{name}' has no origin server")
+        for list_name in ("channels", "whitelist", "blacklist"):
+            if not isinstance(stream.setdefault(list_name, []), list):
+                raise ValueError(f"'{list_name}' of stream '{name}' is not a list")
+        stream.setdefault("locked", "False")
+
+    return data
@@ -15,6 +15,87 @@ if __name__ == "__main__":
             "generic": 0x00FFFF,  # General embeds
             "error": 0xFF9494,  # Error embeds
             "success": 0x94FF94  # Success embeds
+        },
+        "announcements": {  # Announcement fan-out
+            "workers": 16,  # Maximum concurrent sends
+            "retries": 3,  # Retries for transient failures
+            "retry_backoff": 1.0,  # Base delay between retries (seconds)
+            "global_rate": 40,  # Requests per second across all channels
+            "route_rate": 1.0,  # Requests per second per channel
+            "route_burst": 5,  # Back to back requests per channel
+            "max_routes": 10000,  # Channels whose rate limits are remembered; the least recently used are dropped
+            "schedule_path": "data/schedules.jsonl"  # Scheduled announcements, next to data.json
+        },
+        "logging": {  # Background log writer
+            "file_path": "logs/log.txt",  # Log file to append to
+            "batch_size": 256,  # Lines per write
+            "flush_interval": 1.0,  # Maximum seconds a line waits before being written
+            "max_queue": 10000,  # Maximum lines waiting to be written
+            "overflow": "drop_oldest",  # "drop_newest", "drop_oldest" or "block" when the queue is full
+            "level": "INFO",  # Default level: "DEBUG", "INFO", "WARN" or "ERROR"
+            "tickers": {  # Levels per ticker, overriding the default
+                "perm": "INFO"  # Permission checks. Lower to "DEBUG" to log every check
+            },
+            "max_bytes": 10485760,  # Size at which the log file is rotated, or 0 for no limit
+            "rotate_daily": True,  # Whether to also rotate when the day changes
+            "compress": True,  # Whether to gzip rotated files, in a background thread
+            "keep_files": 30,  # Rotated files to keep, or 0 for no limit
+            "keep_days": 30  # Days to keep rotated files, or 0 for no limit
+        },
+        "storage": {  # Persistence of data changes
+            "backend": "json",  # "json" (data.json + journal) or "sqlite"
+            "sqlite_path": "data/data.sqlite3",  # Database for the sqlite backend. Create with storage.py
+            "journal_path": "data/journal.jsonl",  # Append-only change journal next to data.json
+            "group_commit_interval": 0.005,  # Seconds to gather changes before each fsync
+            "compact_records": 10000  # Journal length at which it is folded into data.json
+        },
+        "permissions": {  # Permission checks
+            "cache_size": 10000,  # Cached decisions
+            "cache_ttl": 60,  # Seconds a cached decision stays valid
+            "import_max_bytes": 8388608  # Largest file bulk_add and bulk_remove will read
+        },
+        "metrics": {  # Prometheus text export
+            "file_path": "logs/metrics.prom",  # Rewritten atomically, e.g. for a textfile collector
+            "export_interval": 15  # Seconds between writes
+        },
+        "sharding": {  # Multi-process mode, run with shard.py. Needs the sqlite storage backend
+            "processes": 0,  # Worker processes, or 0 for one per core
+            "shard_count": 4,  # Total gateway shards across all workers
+            "poll_interval": 0.25,  # Seconds between checks for changes made by other workers
+            "change_retention": 3600,  # Seconds changes are kept for workers to catch up on
+            "restart_delay": 5  # Seconds before a worker that exited is restarted
+        },
+        "responses": {  # Command responses
+            "defer_after": 2.0  # Seconds before a command still working defers. Discord allows 3
+        },
+        "reload": {  # Hot reload of config.json, and data.json with the json backend
+            "poll_interval": 2.0  # Seconds between checks for changed files, or 0 to only load at startup
+        },
+        "memory": {  # Gateway intents and library caches. Check the result with /memory
+            "profile": "lean",  # "lean" uses the settings below, "default" the library's default intents and caches
+            "intents": ["guilds"],  # Intents to enable. Role checks need "guilds"
+            "member_cache": [],  # Member cache flags to enable: "voice", "joined", "interaction"
+            "max_messages": 0,  # Messages to cache, or 0 for none
+            "chunk_guilds_at_startup": False  # Whether to fetch every guild's members when connecting
+        },
+        "log_search": {  # /log search
+            "max_lines": 20000  # Most lines to attach; the newest are kept
+        },
+        "rate_limits": {  # Command rate limits, with separate buckets for each command group
+            "user": {  # Per user
+                "rate": 0.5,  # Commands per second, long term. 0 to turn off
+                "burst": 5  # Commands in a row before the rate applies
+            },
+            "guild": {  # Per server
+                "rate": 2.0,
+                "burst": 20
+            },
+            "groups": {},  # Overrides by group, e.g. {"whitelist": {"user": {"rate": 0.1, "burst": 3}}}
+            "max_keys": 50000  # Buckets kept per group and scope; the least recently used are dropped
+        },
+        "backup": {  # /backup export and import
+            "max_part_bytes": 8388608,  # Largest attachment, under Discord's upload limit. Also the largest import
+            "batch_records": 500  # Records imported per group commit
         }
     }
 
@@ -0,0 +1,194 @@
+# FILE: Memory footprint. Builds the client's intents and cache options from config, and measures process RSS,
+# library cache sizes and the size of the bot's data.
+
+
+# DEPENDENCIES
+import sys
+
+import discord
+
+
+# CONSTANTS
+STATUS_PATH = "/proc/self/status"  # Linux process status, for RSS
+
+
+# FUNCTIONS
+def client_options(settings: dict) -> dict:
+
+    # FUNCTION: Build the intents and cache options to create the client with
+
+    # PARAMS:
+    #   * settings: dict: The memory section of the config
+
+    # RETURNS:
+    #   * options: dict: Keyword arguments for discord.Bot
+
+    # RAISES:
+    #   * ValueError: If the profile or a flag name is unknown
+
+    if settings["profile"] == "default":
+        return {"intents": discord.Intents.default()}
+    if settings["profile"] != "lean":
+        raise ValueError(f"Unknown memory profile '{settings['profile']}'")
+
+    return {
+        "intents": build_flags(flag_type=discord.Intents,
+                               names=settings["intents"]),
+        "member_cache_flags": build_flags(flag_type=discord.MemberCacheFlags,
+                                          names=settings["member_cache"]),
+        "max_messages": settings["max_messages"] or None,  # The library treats 0 as its default of 1000
+        "chunk_guilds_at_startup": settings["chunk_guilds_at_startup"]
+    }
+
+
+def build_flags(flag_type: type,
+                names: list[str]):
+
+    # FUNCTION: Build flags with only the named ones set
+
+    # PARAMS:
+    #   * flag_type: type: discord.Intents or discord.MemberCacheFlags
+    #   * names: list[str]: Flag names, e.g. ["guilds"]
+
+    # RETURNS:
+    #   * flags: Flags object
+
+    # RAISES:
+    #   * ValueError: If a name is not a flag
+
+    flags = flag_type.none()
+    for name in names:
+        if name not in flag_type.VALID_FLAGS:
+            raise ValueError(f"Unknown {flag_type.__name__} flag '{name}'")
+        setattr(flags, name, True)
+    return flags
+
+
+def read_rss() -> (int, int):
+
+    # FUNCTION: Read the process's resident set size
+
+    # RETURNS:
+    #   * rss: int: Current RSS in bytes, or None if it cannot be read
+    #   * peak: int: Peak RSS in bytes, or None if it cannot be read
+
+    rss = peak = None
+    try:
+        with open(STATUS_PATH) as file:
+            for line in file:
+                if line.startswith("VmRSS:"):
+                    rss = int(line.split()[1]) * 1024
+                elif line.startswith("VmHWM:"):
+                    peak = int(line.split()[1]) * 1024
+    except OSError:
+        try:
+            import resource
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+        except ImportError:
+            pass
+    return rss, peak
+
+
+def cache_sizes(client: discord.Client) -> dict:
+
+    # FUNCTION: Count the objects held in the library's caches
+
+    # PARAMS:
+    #   * client: discord.Client: Connected client
+
+    # RETURNS:
+    #   * sizes: dict: Cache name -> number of objects
+
+    guilds = client.guilds
+    return {
+        "guilds": len(guilds),
+        "channels": sum(len(guild.channels) for guild in guilds),
+        "roles": sum(len(guild.roles) for guild in guilds),
+        "members": sum(len(guild.members) for guild in guilds),
+        "users": len(client.users),
+        "emojis": len(client.emojis),
+        "messages": len(client.cached_messages)
+    }
+
+
+def deep_size(value,
+              seen: set = None) -> int:
+
+    # FUNCTION: Estimate the memory held by an object and everything it references
+
+    # PARAMS:
+    #   * value: Object to measure
+    #   * seen: set: Ids of objects already counted
+
+    # RETURNS:
+    #   * size: int: Bytes
+
+    if seen is None:
+        seen = set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_size(value=key, seen=seen) + deep_size(value=item, seen=seen) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(deep_size(value=item, seen=seen) for item in value)
+    elif hasattr(value, "__dict__"):
+        size += deep_size(value=vars(value), seen=seen)
+    return size
+
+
+def data_size(data: dict) -> dict:
+
+    # FUNCTION: Summarize the size of the bot's data
+
+    # PARAMS:
+    #   * data: dict: Bot data, in the in-memory layout
+
+    # RETURNS:
+    #   * size: dict: streams, subscriptions, ids (in all lists) and bytes
+
+    streams = data["streams"].values()
+    return {
+        "streams": len(data["streams"]),
+        "subscriptions": sum(len(stream["channels"]) for stream in streams),
+        "ids": (len(data["whitelist"]) + len(data["blacklist"]) + len(data["admins"])
+                + sum(len(stream["whitelist"]) + len(stream["blacklist"]) for stream in streams)),
+        "bytes": deep_size(value=data)
+    }
+
+
+def format_bytes(size: int) -> str:
+
+    # FUNCTION: Format a byte count for display
+
+    # PARAMS:
+    #   * size: int: Bytes, or None
+
+    # RETURNS:
+    #   * text: str: e.g. "41.2 MiB", or "n/a"
+
+    if size is None:
+        return "n/a"
+    if size < 1024:
+        return f"{size} B"
+    for unit in ("KiB", "MiB", "GiB"):
+        size /= 1024
+        if size < 1024 or unit == "GiB":
+            return f"{size:.1f} {unit}"
+
+
+# TESTING
+if __name__ == "__main__":
+    import random
+
+    import snowflakes
+
+    rss, peak = read_rss()
+    print(f"RSS {format_bytes(size=rss)}, peak {format_bytes(size=peak)}")
+    print(client_options(settings={"profile": "lean", "intents": ["guilds"], "member_cache": [],
+                                   "max_messages": 0, "chunk_guilds_at_startup": False}))
+
+    ids = [str(random.getrandbits(62)) for _ in range(100_000)]
+    data = snowflakes.unpack_data(data={"streams": {}, "whitelist": ids, "blacklist": [], "admins": []})
+    print(data_size(data=data))
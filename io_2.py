@@ -3,82 +3,674 @@
 
 # DEPENDENCIES
 import common
-from datetime import datetime
+from datetime import date, datetime
+import gzip
+import hashlib
+import io
 import json
+import marshal
+import metrics
+import os
+import atexit
+import queue
+import re
+import shutil
+import threading
+import time
+
+
+# CONSTANTS
+DEBUG = 10  # Log levels
+INFO = 20
+WARN = 30
+ERROR = 40
+LOG_LEVELS = {"DEBUG": DEBUG, "INFO": INFO, "WARN": WARN, "ERROR": ERROR}
+
+OVERFLOW_POLICIES = ("drop_newest", "drop_oldest", "block")  # What to do when the log queue is full
+
+SNAPSHOT_MAGIC = b"RAINDROP-SNAPSHOT-1\n"  # Header of binary snapshot files
+
+ROTATED_STAMP_FORMAT = "%Y-%m-%dT%H-%M-%S"  # In rotated log names, e.g. logs/log.2026-01-31T23-59-59.txt.gz
+LOG_INDEX_SUFFIX = ".idx"  # Sidecar index next to each log file, one json line per written batch (see logsearch)
+LOG_ID_PATTERN = re.compile(r"(?<!\d)\d{15,20}(?!\d)")  # Snowflakes in log lines
 
 
 # VARIABLES
-log_file_buffer = []  # Buffer to write to file
+log_queue = queue.Queue(maxsize=10000)  # Lines waiting for the background writer
+log_writer = None  # Background writer thread
+log_writer_lock = threading.Lock()
+log_settings = {
+    "file_path": common.LOG_FILE_PATH,  # Log file to append to
+    "batch_size": 256,  # Lines per write
+    "flush_interval": 1.0,  # Maximum seconds a line waits before being written
+    "overflow": "drop_oldest",  # One of OVERFLOW_POLICIES
+    "max_bytes": 10485760,  # Size at which the log file is rotated, or 0 for no limit
+    "rotate_daily": True,  # Whether to rotate when the day changes
+    "compress": True,  # Whether to gzip rotated files
+    "keep_files": 30,  # Rotated files to keep, or 0 for no limit
+    "keep_days": 30  # Days to keep rotated files, or 0 for no limit
+}
+log_file_state = {"size": None, "day": None}  # Size and start day of the current log file. Writer thread only
+log_compressor = None  # Background thread compressing and pruning rotated logs
+log_compress_queue = queue.Queue()  # Log file paths whose rotated files need compressing
+dropped_lines = 0  # Lines lost to a full queue
+log_level = INFO  # Default threshold
+ticker_levels = {}  # Per-ticker thresholds, overriding log_level
+io_seconds = metrics.registry.histogram(name="raindrop_io_seconds",
+                                        description="Time spent reading and writing json files",
+                                        labels=("op",))
+metrics.registry.gauge(name="raindrop_log_queue_depth",
+                       description="Log lines waiting for the background writer",
+                       function=lambda: log_queue.qsize())
+metrics.registry.gauge(name="raindrop_log_dropped_lines",
+                       description="Log lines lost to a full queue since startup",
+                       function=lambda: dropped_lines)
 
 
 # FUNCTIONS
 def log(ticker: str = "INFO",
         message: str = "(No message provided)",
+        args: tuple = (),
+        level: int = INFO,
         timestamp: bool = True,
         to_console: bool = True,
         to_file: bool = True) -> None:
 
-    # FUNCTION: Log to console and log file
+    # FUNCTION: Log to console and log file. Formatting is deferred to the writer, and skipped
+    # entirely if the level is below the ticker's threshold.
 
     # PARAMS:
     #   * ticker: str: Ticker to display
-    #   * message: str: Message to display
+    #   * message: str: Message to display, formatted with str.format if args are given
+    #   * args: tuple: Values to format into message
+    #   * level: int: DEBUG, INFO, WARN or ERROR
     #   * timestamp: bool: Whether to include timestamp
     #   * to_console: bool: Whether to print to console
     #   * to_file: bool: Whether to write to log file
 
     # RETURNS:
-    #   * (print): Print message
-    #   * (variable set): Add to log_file_buffer
+    #   * (queue put): Hand line to the background writer
 
-    # Define globals
-    global log_file_buffer
+    # Filter by level
+    if level < ticker_levels.get(ticker, log_level):
+        return
+
+    # Hand to writer
+    if to_console or to_file:
+        enqueue_log_item(item=(time.time() if timestamp else None, ticker, message, args, to_console, to_file))
+
+
+def log_enabled(ticker: str,
+                level: int) -> bool:
+
+    # FUNCTION: Check if a log call would be written, for callers whose arguments are costly to gather
+
+    # PARAMS:
+    #   * ticker: str: Ticker to check
+    #   * level: int: Level to check
+
+    # RETURNS:
+    #   * enabled: bool: Whether the level passes the ticker's threshold
+
+    return level >= ticker_levels.get(ticker, log_level)
+
+
+def format_log_line(created: float,
+                    ticker: str,
+                    message: str,
+                    args: tuple) -> str:
+
+    # FUNCTION: Build the output line for a log call
+
+    # PARAMS:
+    #   * created: float: Unix time of the call, or None for no timestamp
+    #   * ticker: str: Ticker to display
+    #   * message: str: Message to display
+    #   * args: tuple: Values to format into message
+
+    # RETURNS:
+    #   * output: str: Formatted line
 
     # Create output
+    if args:
+        message = message.format(*args)
     output = ""
-    if timestamp:
-        output += f"({datetime.now()})\t"
+    if created is not None:
+        output += f"({datetime.fromtimestamp(created)})\t"
     output += f"[{ticker.upper()}]\t"
     output += f"{message.capitalize()}\t"
 
+    # Return line
+    return output
+
+
+def enqueue_log_item(item) -> None:
+
+    # FUNCTION: Put an item on the log queue, applying the overflow policy if it is full
+
+    # PARAMS:
+    #   * item: Line tuple or control item for the writer
+
+    # Define globals
+    global dropped_lines
+
+    # Make sure the writer is running
+    if log_writer is None:
+        start_log_writer()
+
+    # Put on queue
+    if log_settings["overflow"] == "block":
+        log_queue.put(item)
+        return
+    while True:
+        try:
+            log_queue.put_nowait(item)
+            return
+        except queue.Full:
+            dropped_lines += 1
+            if log_settings["overflow"] == "drop_newest" or not drop_oldest_line():
+                return
+
+
+def drop_oldest_line() -> bool:
+
+    # FUNCTION: Drop the oldest line on the log queue, skipping flush markers so update_log_file never waits on
+    # one that was thrown away
+
+    # RETURNS:
+    #   * dropped: bool: Whether a line was dropped; False if the queue holds only markers
+
+    with log_queue.mutex:
+        for position, queued in enumerate(log_queue.queue):
+            if not isinstance(queued, threading.Event):
+                del log_queue.queue[position]
+                log_queue.not_full.notify()
+                return True
+    return False
+
+
+def configure_logging(file_path: str = common.LOG_FILE_PATH,
+                      batch_size: int = 256,
+                      flush_interval: float = 1.0,
+                      max_queue: int = 10000,
+                      overflow: str = "drop_oldest",
+                      level: str = "INFO",
+                      tickers: dict = None,
+                      max_bytes: int = 10485760,
+                      rotate_daily: bool = True,
+                      compress: bool = True,
+                      keep_files: int = 30,
+                      keep_days: float = 30) -> None:
+
+    # FUNCTION: Configure log levels and the background log writer
+
+    # PARAMS:
+    #   * file_path: str: Log file to append to
+    #   * batch_size: int: Lines per write
+    #   * flush_interval: float: Maximum seconds a line waits before being written
+    #   * max_queue: int: Maximum lines waiting to be written
+    #   * overflow: str: One of OVERFLOW_POLICIES
+    #   * level: str: Default level name, one of LOG_LEVELS
+    #   * tickers: dict: Level names per ticker, overriding level
+    #   * max_bytes: int: Size at which the log file is rotated, or 0 for no limit
+    #   * rotate_daily: bool: Whether to rotate when the day changes
+    #   * compress: bool: Whether to gzip rotated files in the background
+    #   * keep_files: int: Rotated files to keep, or 0 for no limit
+    #   * keep_days: float: Days to keep rotated files, or 0 for no limit
+
+    # Define globals
+    global log_level
+
+    if overflow not in OVERFLOW_POLICIES:
+        raise ValueError(f"Unknown log overflow policy '{overflow}'")
+
+    # Set levels
+    log_level = LOG_LEVELS[level.upper()]
+    ticker_levels.clear()
+    for ticker, ticker_level in (tickers or {}).items():
+        ticker_levels[ticker] = LOG_LEVELS[ticker_level.upper()]
+
+    # Set writer settings
+    if file_path != log_settings["file_path"]:
+        log_file_state["size"] = None
+    log_settings.update(file_path=file_path,
+                        batch_size=batch_size,
+                        flush_interval=flush_interval,
+                        overflow=overflow,
+                        max_bytes=max_bytes,
+                        rotate_daily=rotate_daily,
+                        compress=compress,
+                        keep_files=keep_files,
+                        keep_days=keep_days)
+    log_queue.maxsize = max_queue
+
+
+def check_logging(settings: dict) -> None:
+
+    # FUNCTION: Check the logging section of a config before applying it, so configure_logging cannot fail halfway
+
+    # PARAMS:
+    #   * settings: dict: Keyword arguments for configure_logging
+
+    # RAISES:
+    #   * ValueError: If a setting is unknown or has an unusable value
+
+    numbers = {"batch_size": 1, "flush_interval": 0, "max_queue": 0, "max_bytes": 0, "keep_files": 0, "keep_days": 0}
+    for key, value in settings.items():
+        if key in numbers:
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value < numbers[key]:
+                raise ValueError(f"logging.{key} must be a number of at least {numbers[key]}")
+        elif key in ("rotate_daily", "compress"):
+            if not isinstance(value, bool):
+                raise ValueError(f"logging.{key} must be true or false")
+        elif key == "file_path":
+            if not isinstance(value, str) or not value:
+                raise ValueError("logging.file_path must be a path")
+        elif key == "overflow":
+            if value not in OVERFLOW_POLICIES:
+                raise ValueError(f"logging.overflow must be one of {', '.join(OVERFLOW_POLICIES)}")
+        elif key == "level":
+            if not isinstance(value, str) or value.upper() not in LOG_LEVELS:
+                raise ValueError(f"logging.level must be one of {', '.join(LOG_LEVELS)}")
+        elif key == "tickers":
+            if not isinstance(value, dict) or not all(isinstance(level, str) and level.upper() in LOG_LEVELS
+                                                      for level in value.values()):
+                raise ValueError(f"logging.tickers must map tickers to one of {', '.join(LOG_LEVELS)}")
+        else:
+            raise ValueError(f"unknown setting logging.{key}")
+
+
+def start_log_writer() -> None:
+
+    # FUNCTION: Start the background log writer thread if it is not running
+
+    # Define globals
+    global log_writer
+
+    with log_writer_lock:
+        if log_writer is None:
+            log_writer = threading.Thread(target=run_log_writer,
+                                          name="log-writer",
+                                          daemon=True)
+            log_writer.start()
+
+
+def run_log_writer() -> None:
+
+    # FUNCTION: Background writer loop. Writes lines in batches once the batch is full or the flush interval passes.
+
+    batch = []
+    deadline = None
+    while True:
+
+        # Wait for next item, up to the flush deadline
+        timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+        try:
+            item = log_queue.get(timeout=timeout)
+        except queue.Empty:
+            item = None
+
+        # Handle control items
+        if isinstance(item, threading.Event):
+            write_log_batch(batch=batch)
+            batch, deadline = [], None
+            item.set()
+            continue
+
+        # Add line to batch
+        if item is not None:
+            batch.append(item)
+            if deadline is None:
+                deadline = time.monotonic() + log_settings["flush_interval"]
+
+        # Write if full or due
+        if batch and (len(batch) >= log_settings["batch_size"] or time.monotonic() >= deadline):
+            write_log_batch(batch=batch)
+            batch, deadline = [], None
+
+
+def write_log_batch(batch: list) -> None:
+
+    # FUNCTION: Write a batch of lines to console and log file
+
+    # PARAMS:
+    #   * batch: list: (created, ticker, message, args, to_console, to_file) tuples
+
+    if not batch:
+        return
+
+    # Format lines
+    lines = []
+    for created, ticker, message, args, to_console, to_file in batch:
+        try:
+            output = format_log_line(created=created,
+                                     ticker=ticker,
+                                     message=message,
+                                     args=args)
+        except (IndexError, KeyError, ValueError) as error:
+            output = format_log_line(created=created,
+                                     ticker=ticker,
+                                     message=f"{message} {args} (could not format: {error})",
+                                     args=())
+        lines.append((output, to_console, to_file))
+
     # Print to console
-    if to_console:
-        print(output)
+    console_lines = [output for output, to_console, to_file in lines if to_console]
+    if console_lines:
+        print("\n".join(console_lines), flush=True)
+
+    # Append to log file, then index the batch
+    file_lines = [f"{output}\n" for output, to_console, to_file in lines if to_file]
+    if file_lines:
+        try:
+            rotate_log_if_due(file_path=log_settings["file_path"],
+                              incoming=sum(len(line) for line in file_lines))
+            with open(log_settings["file_path"], "a") as file:
+                start = file.tell()
+                file.writelines(file_lines)
+                log_file_state["size"] = file.tell()
+            write_log_index(file_path=log_settings["file_path"],
+                            batch=[item for item in batch if item[5]],
+                            lines=file_lines,
+                            start=start,
+                            end=log_file_state["size"])
+        except OSError as error:
+            print(f"[IO]\tCould not write log file: {error}", flush=True)
+
+
+def write_log_index(file_path: str,
+                    batch: list,
+                    lines: list[str],
+                    start: int,
+                    end: int) -> None:
+
+    # FUNCTION: Append an index entry for a written batch: its byte range, time range, tickers and snowflakes
+
+    # PARAMS:
+    #   * file_path: str: Log file
+    #   * batch: list: Line tuples written to the file
+    #   * lines: list[str]: Formatted lines written
+    #   * start: int: Offset of the first line
+    #   * end: int: Offset after the last line
+
+    created = [item[0] for item in batch if item[0] is not None]
+    snowflakes = set()
+    for line in lines:
+        snowflakes.update(LOG_ID_PATTERN.findall(line))
+    entry = {
+        "start": start,
+        "end": end,
+        "first": min(created) if created else None,
+        "last": max(created) if created else None,
+        "tickers": sorted({item[1].upper() for item in batch}),
+        "snowflakes": sorted(snowflakes)
+    }
+    with open(f"{file_path}{LOG_INDEX_SUFFIX}", "a") as file:
+        file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+
+
+def rotate_log_if_due(file_path: str,
+                      incoming: int) -> None:
+
+    # FUNCTION: Rotate the log file before a write if it would grow past max_bytes, or if it was started on an
+    # earlier day. Runs on the writer thread; renaming is all it does, compression happens in the background.
 
-    # Add to file buffer
-    if to_file:
-        log_file_buffer.append(output)
+    # PARAMS:
+    #   * file_path: str: Log file
+    #   * incoming: int: Approximate bytes about to be written
+
+    # Find size and day of the current file on the first write
+    today = date.today()
+    if log_file_state["size"] is None:
+        try:
+            stat = os.stat(file_path)
+            log_file_state.update(size=stat.st_size,
+                                  day=date.fromtimestamp(stat.st_mtime))
+        except OSError:
+            log_file_state.update(size=0,
+                                  day=today)
+
+    # Rotate if due
+    size = log_file_state["size"]
+    too_big = log_settings["max_bytes"] and size + incoming > log_settings["max_bytes"]
+    new_day = log_settings["rotate_daily"] and log_file_state["day"] != today
+    if size > 0 and (too_big or new_day):
+        rotate_log(file_path=file_path)
+        log_file_state["size"] = 0
+    if log_file_state["size"] == 0:
+        log_file_state["day"] = today
+
+
+def rotate_log(file_path: str) -> str:
+
+    # FUNCTION: Move the log file aside under a timestamped name and wake the compressor
+
+    # PARAMS:
+    #   * file_path: str: Log file
+
+    # RETURNS:
+    #   * rotated_path: str: New name of the old file
 
+    root, extension = os.path.splitext(file_path)
+    stamp = datetime.now().strftime(ROTATED_STAMP_FORMAT)
+    rotated_path = f"{root}.{stamp}{extension}"
+    count = 1
+    while os.path.exists(rotated_path) or os.path.exists(f"{rotated_path}.gz"):
+        count += 1
+        rotated_path = f"{root}.{stamp}-{count}{extension}"
+    os.replace(file_path, rotated_path)
+    if os.path.exists(f"{file_path}{LOG_INDEX_SUFFIX}"):
+        os.replace(f"{file_path}{LOG_INDEX_SUFFIX}", f"{rotated_path}{LOG_INDEX_SUFFIX}")
 
-def update_log_file(file_path: str = common.LOG_FILE_PATH) -> None:
+    # Compress and prune in the background
+    start_log_compressor()
+    log_compress_queue.put(file_path)
+    return rotated_path
 
-    # FUNCTION: Write buffer to log file
+
+def rotated_log_paths(file_path: str) -> list[str]:
+
+    # FUNCTION: Find the rotated files of a log file
 
     # PARAMS:
-    #   * file_path: str: Path where log file is stored
+    #   * file_path: str: Log file
 
     # RETURNS:
-    #   * (file output): Write to file
+    #   * rotated_paths: list[str]: Rotated files, compressed or not, oldest first
 
-    # Log
-    log(ticker="io",
-        message=f"Updating log file at '{file_path}'...")
+    directory = os.path.dirname(file_path) or "."
+    root, extension = os.path.splitext(os.path.basename(file_path))
+    pattern = re.compile(rf"{re.escape(root)}\.(\d{{4}}-\d\d-\d\dT\d\d-\d\d-\d\d(?:-\d+)?){re.escape(extension)}(\.gz)?")
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    rotated = []
+    for name in names:
+        match = pattern.fullmatch(name)
+        if match:
+            stamp = match.group(1)
+            rotated.append(((stamp[:19], int(stamp[20:] or 1)), os.path.join(directory, name)))
+    return [rotated_path for order, rotated_path in sorted(rotated)]
+
+
+def start_log_compressor() -> None:
+
+    # FUNCTION: Start the background log compressor thread if it is not running
 
     # Define globals
-    global log_file_buffer
+    global log_compressor
 
-    # Duplicate file buffer and clear original
-    buffer = log_file_buffer
-    log_file_buffer = []
+    with log_writer_lock:
+        if log_compressor is None:
+            log_compressor = threading.Thread(target=run_log_compressor,
+                                              name="log-compressor",
+                                              daemon=True)
+            log_compressor.start()
 
-    # Write to file
-    file = open(file_path, "a")
-    file.writelines(f"{line}\n" for line in buffer)
-    file.close()
 
-    # Log
-    log(ticker="io",
-        message=f"Updated log file at '{file_path}'.")
+def run_log_compressor() -> None:
+
+    # FUNCTION: Background compressor loop. Compresses rotated logs, then deletes those past the retention policy.
+
+    while True:
+        file_path = log_compress_queue.get()
+        try:
+            prune_rotated_logs(file_path=file_path)
+        except OSError as error:
+            log(ticker="io",
+                message="Could not compress or prune rotated logs: {}",
+                args=(error,),
+                level=WARN)
+
+
+def prune_rotated_logs(file_path: str) -> None:
+
+    # FUNCTION: Gzip uncompressed rotated logs, then delete rotated logs beyond keep_files or older than keep_days
+
+    # PARAMS:
+    #   * file_path: str: Log file
+
+    # Compress
+    if log_settings["compress"]:
+        for rotated_path in rotated_log_paths(file_path=file_path):
+            if not rotated_path.endswith(".gz"):
+                compress_log(file_path=rotated_path)
+
+    # Apply retention, oldest first
+    rotated_paths = rotated_log_paths(file_path=file_path)
+    cutoff = time.time() - log_settings["keep_days"] * 86400
+    for index, rotated_path in enumerate(rotated_paths):
+        too_many = log_settings["keep_files"] and len(rotated_paths) - index > log_settings["keep_files"]
+        too_old = log_settings["keep_days"] and os.stat(rotated_path).st_mtime < cutoff
+        if too_many or too_old:
+            os.remove(rotated_path)
+            if os.path.exists(f"{rotated_path}{LOG_INDEX_SUFFIX}"):
+                os.remove(f"{rotated_path}{LOG_INDEX_SUFFIX}")
+
+
+def compress_log(file_path: str) -> None:
+
+    # FUNCTION: Gzip a rotated log. Each indexed batch becomes its own gzip member, and its compressed byte range is
+    # added to the index, so searches can decompress just the batches they need. Unindexed stretches are
+    # compressed in 1 MiB members.
+
+    # PARAMS:
+    #   * file_path: str: Rotated log file
+
+    compressed_path = f"{file_path}.gz"
+    index_path = f"{file_path}{LOG_INDEX_SUFFIX}"
+    entries = []
+    if os.path.exists(index_path):
+        with open(index_path, "rb") as file:
+            for line in file:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    pass  # Line cut short by a crash
+    entries.sort(key=lambda entry: entry["start"])
+
+    with open(file_path, "rb") as source, open(f"{compressed_path}.tmp", "wb") as target:
+
+        def copy_member(start: int,
+                        end: int) -> (int, int):
+            source.seek(start)
+            offset = target.tell()
+            target.write(gzip.compress(source.read(end - start), compresslevel=6))
+            return offset, target.tell()
+
+        position = 0
+        size = os.fstat(source.fileno()).st_size
+        for entry in entries + [{"start": size, "end": size}]:
+            while position < entry["start"]:  # Unindexed stretch
+                copy_member(start=position,
+                            end=min(entry["start"], position + (1 << 20)))
+                position = min(entry["start"], position + (1 << 20))
+            if entry["end"] > entry["start"] >= position:
+                entry["compressed_start"], entry["compressed_end"] = copy_member(start=entry["start"],
+                                                                                 end=entry["end"])
+                position = entry["end"]
+        target.flush()
+        os.fsync(target.fileno())
+
+    # Swap in, index first so the compressed file is never without it
+    if entries:
+        with open(f"{compressed_path}{LOG_INDEX_SUFFIX}.tmp", "w") as file:
+            file.writelines(json.dumps(entry, separators=(",", ":")) + "\n" for entry in entries
+                            if "compressed_start" in entry)
+        os.replace(f"{compressed_path}{LOG_INDEX_SUFFIX}.tmp", f"{compressed_path}{LOG_INDEX_SUFFIX}")
+    shutil.copystat(file_path, f"{compressed_path}.tmp")
+    os.replace(f"{compressed_path}.tmp", compressed_path)
+    os.remove(file_path)
+    if os.path.exists(index_path):
+        os.remove(index_path)
+
+
+def update_log_file(timeout: float = 5.0) -> bool:
+
+    # FUNCTION: Flush queued lines to the log file, waiting for the writer to finish
+
+    # PARAMS:
+    #   * timeout: float: Maximum seconds to wait
+
+    # RETURNS:
+    #   * flushed: bool: Whether the writer finished in time
+
+    # Queue flush marker, never dropping it
+    if log_writer is None:
+        start_log_writer()
+    flushed = threading.Event()
+    try:
+        log_queue.put(flushed, timeout=timeout)
+    except queue.Full:
+        return False
+
+    # Wait for writer
+    return flushed.wait(timeout=timeout)
+
+
+atexit.register(update_log_file)
+
+
+def build_text_file(lines,
+                    chunk_lines: int = 4096) -> io.BytesIO:
+
+    # FUNCTION: Build a text file in memory, one chunk of lines at a time
+
+    # PARAMS:
+    #   * lines: Iterable[str]: Lines to write, without newlines
+    #   * chunk_lines: int: Lines encoded per write
+
+    # RETURNS:
+    #   * buffer: io.BytesIO: File contents, positioned at the start
+
+    buffer = io.BytesIO()
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) >= chunk_lines:
+            buffer.write(("\n".join(chunk) + "\n").encode())
+            chunk = []
+    if chunk:
+        buffer.write(("\n".join(chunk) + "\n").encode())
+    buffer.seek(0)
+    return buffer
+
+
+def iter_text_lines(content: bytes):
+
+    # FUNCTION: Decode an uploaded text file one line at a time, without splitting it up front
+
+    # PARAMS:
+    #   * content: bytes: File contents, UTF-8 with or without a byte order mark
+
+    # RETURNS:
+    #   * lines: Iterator[str]: Lines, with newlines
+
+    return io.TextIOWrapper(io.BytesIO(content),
+                            encoding="utf-8-sig",
+                            errors="replace",
+                            newline=None)
 
 
 def read_json(file_path: str) -> dict:
@@ -93,45 +685,145 @@ def read_json(file_path: str) -> dict:
 
     # Log
     log(ticker="io",
-        message=f"Reading json from '{file_path}'...")
+        message="Reading json from '{}'...",
+        args=(file_path,))
 
     # Open json file and parse
-    with open(file_path, "r") as file:
+    with io_seconds.time(labels=("read_json",)), open(file_path, "r") as file:
         result = json.load(file)
 
     # Log
     log(ticker="io",
-        message=f"Read json from '{file_path}'.")
+        message="Read json from '{}'.",
+        args=(file_path,))
 
     # Return resulting dict
     return result
 
 
 def write_json(file_path: str,
-               data: dict) -> None:
+               data: dict,
+               atomic: bool = False) -> None:
 
     # FUNCTION: Write dictionary to file in json format
 
     # PARAMS:
     #   * file_path: str: Path to json file
     #   * data: dict: Dict to parse into json
+    #   * atomic: bool: Whether to write to a temporary file, fsync and rename over the target
 
     # RETURN:
     #   * (file output): Write to file
 
     # Log
     log(ticker="io",
-        message=f"Writing data to '{file_path}'...")
+        message="Writing data to '{}'...",
+        args=(file_path,))
 
     # Write json to file
-    with open(file_path, "w") as file:
-        json.dump(data,
-                  file,
-                  indent=4)
+    target_path = f"{file_path}.tmp" if atomic else file_path
+    with io_seconds.time(labels=("write_json",)):
+        with open(target_path, "w") as file:
+            json.dump(data,
+                      file,
+                      indent=4)
+            if atomic:
+                file.flush()
+                os.fsync(file.fileno())
+
+        # Swap into place
+        if atomic:
+            os.replace(target_path, file_path)
 
     # Log
     log(ticker="io",
-        message=f"Wrote data to '{file_path}'.")
+        message="Wrote data to '{}'.",
+        args=(file_path,))
+
+
+def source_key(file_paths: list[str]) -> list:
+
+    # FUNCTION: Identify the current version of source files by mtime and size
+
+    # PARAMS:
+    #   * file_paths: list[str]: Source files
+
+    # RETURNS:
+    #   * key: list: [path, mtime_ns, size] per file, with None for missing files
+
+    key = []
+    for file_path in file_paths:
+        try:
+            stat = os.stat(file_path)
+            key.append([file_path, stat.st_mtime_ns, stat.st_size])
+        except OSError:
+            key.append([file_path, None, None])
+    return key
+
+
+def read_snapshot(file_path: str,
+                  key: list):
+
+    # FUNCTION: Read a binary snapshot if it is intact and was made from the given sources
+
+    # PARAMS:
+    #   * file_path: str: Path to snapshot
+    #   * key: list: Source key the snapshot must match (see source_key)
+
+    # RETURNS:
+    #   * payload: Snapshot contents, or None if missing, corrupt or stale
+
+    # Read file
+    try:
+        with open(file_path, "rb") as file:
+            contents = file.read()
+    except OSError:
+        return None
+
+    # Check header and checksum
+    header_length = len(SNAPSHOT_MAGIC)
+    digest_length = hashlib.blake2b().digest_size
+    if not contents.startswith(SNAPSHOT_MAGIC):
+        return None
+    digest = contents[header_length:header_length + digest_length]
+    body = contents[header_length + digest_length:]
+    if hashlib.blake2b(body).digest() != digest:
+        log(ticker="io",
+            message="Snapshot '{}' failed its checksum",
+            args=(file_path,),
+            level=WARN)
+        return None
+
+    # Check sources
+    try:
+        snapshot_key, payload = marshal.loads(body)
+    except (EOFError, ValueError, TypeError):
+        return None
+    if snapshot_key != key:
+        return None
+    return payload
+
+
+def write_snapshot(file_path: str,
+                   key: list,
+                   payload) -> None:
+
+    # FUNCTION: Write a checksummed binary snapshot, atomically
+
+    # PARAMS:
+    #   * file_path: str: Path to snapshot
+    #   * key: list: Source key the snapshot was made from (see source_key)
+    #   * payload: Contents, made of dicts, lists, strings and numbers only
+
+    body = marshal.dumps((key, payload))
+    temporary_path = f"{file_path}.{os.getpid()}.tmp"  # Per process, as shard workers start together
+    with open(temporary_path, "wb") as file:
+        file.write(SNAPSHOT_MAGIC)
+        file.write(hashlib.blake2b(body).digest())
+        file.write(body)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temporary_path, file_path)
 
 
 # TESTING
@@ -0,0 +1,349 @@
+# FILE: Append-only journal of data changes, compacted into the data.json snapshot
+
+
+# DEPENDENCIES
+import asyncio
+import json
+import os
+import threading
+import time
+
+import io_2
+import state
+
+
+# CONSTANTS
+COMPACT_RETRY_SECONDS = 60  # Wait after a failed compaction before trying again
+
+
+# CLASSES
+class GroupCommitter:
+
+    # CLASS: Base for stores that persist change records in groups, off the event loop.
+    # Subclasses implement write(), which must make a batch durable before returning.
+
+    def __init__(self,
+                 group_commit_interval: float = 0.005) -> None:
+
+        # PARAMS:
+        #   * group_commit_interval: float: Seconds to gather records before each write
+
+        self.group_commit_interval = group_commit_interval
+        self.pending = []  # (line, future) waiting for the next group commit
+        self.wakeup = None
+        self.committer = None
+        self.writing = asyncio.Lock()  # Held while a batch is being written
+        self.healthy = True  # False after a failed write until the next one succeeds; memory is then ahead of disk
+
+    async def append(self,
+                     record: dict) -> None:
+
+        # FUNCTION: Queue a record and wait until it is durable
+
+        # PARAMS:
+        #   * record: dict: Change record
+
+        await self.enqueue(record=record)
+
+    def enqueue(self,
+                record: dict) -> asyncio.Future:
+
+        # FUNCTION: Queue a record straight away, so records queued one after another are written in that order
+
+        # PARAMS:
+        #   * record: dict: Change record
+
+        # RETURNS:
+        #   * future: asyncio.Future: Done once the record is durable
+
+        # Start committer on first use, inside the running loop
+        if self.committer is None:
+            self.wakeup = asyncio.Event()
+            self.committer = asyncio.get_running_loop().create_task(self.run_committer())
+
+        # Queue for the next group commit
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((encode(record=record), future))
+        self.wakeup.set()
+        return future
+
+    async def run_committer(self) -> None:
+
+        # FUNCTION: Group commit loop. Writes everything queued since the last commit in one go.
+
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.wakeup.wait()
+            await asyncio.sleep(self.group_commit_interval)
+            self.wakeup.clear()
+
+            # Write off the event loop
+            async with self.writing:
+                batch, self.pending = self.pending, []
+                try:
+                    await loop.run_in_executor(None, self.write, [line for line, future in batch])
+                except Exception as error:
+                    self.healthy = False
+                    io_2.log(ticker="storage",
+                             message="Could not persist {} records: {!r}. They are applied in memory only.",
+                             args=(len(batch), error),
+                             level=io_2.ERROR)
+                    for line, future in batch:
+                        if not future.cancelled():
+                            future.set_exception(error)
+                    continue
+                self.healthy = True
+                self.committed(count=len(batch))
+            for line, future in batch:
+                future.set_result(None)
+
+    def write(self,
+              lines: list[bytes]) -> None:
+
+        # FUNCTION: Make a batch of encoded records durable. Runs in a worker thread.
+
+        # PARAMS:
+        #   * lines: list[bytes]: Encoded records
+
+        raise NotImplementedError
+
+    def committed(self,
+                  count: int) -> None:
+
+        # FUNCTION: Hook called on the event loop after a batch is durable, still holding the writing lock
+
+        # PARAMS:
+        #   * count: int: Records in the batch
+
+        pass
+
+
+class Journal(GroupCommitter):
+
+    # CLASS: Write-ahead journal. Records are appended one compact JSON line each and fsynced in groups;
+    # once enough have built up the journal is rotated and folded into the snapshot in the background.
+
+    def __init__(self,
+                 snapshot_path: str,
+                 journal_path: str,
+                 group_commit_interval: float = 0.005,
+                 compact_records: int = 10000) -> None:
+
+        # PARAMS:
+        #   * snapshot_path: str: Path to data.json
+        #   * journal_path: str: Path to the journal
+        #   * group_commit_interval: float: Seconds to gather records before each fsync
+        #   * compact_records: int: Records after which the journal is folded into the snapshot
+
+        super().__init__(group_commit_interval=group_commit_interval)
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.rotated_path = f"{journal_path}.old"
+        self.compact_records = compact_records
+        self.file = None
+        self.records = 0  # Records in the current journal
+        self.compactor = None
+        self.compact_failed = None  # time.monotonic() of the last failed compaction
+        self.snapshot_key = None  # Source key of the last snapshot written by compaction, see reloader
+
+    def replay(self,
+               data: dict) -> int:
+
+        # FUNCTION: Apply journalled records on top of the snapshot, then reopen the journal for appending
+
+        # PARAMS:
+        #   * data: dict: Snapshot data to apply records to
+
+        # RETURNS:
+        #   * count: int: Number of records applied
+
+        count = apply_records(data=data,
+                              file_path=self.rotated_path)
+        self.records = apply_records(data=data,
+                                     file_path=self.journal_path)
+        count += self.records
+
+        io_2.log(ticker="journal",
+                 message="Replayed {} records",
+                 args=(count,))
+
+        # Finish a compaction interrupted by a restart
+        if os.path.exists(self.rotated_path):
+            self.start_compactor()
+
+        # Open for appending
+        self.file = open(self.journal_path, "ab")
+        return count
+
+    def write(self,
+              lines: list[bytes]) -> None:
+
+        # FUNCTION: Append lines to the journal and fsync
+
+        # PARAMS:
+        #   * lines: list[bytes]: Encoded records
+
+        self.file.write(b"".join(lines))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def committed(self,
+                  count: int) -> None:
+
+        # FUNCTION: Compact once the journal is long enough
+
+        # PARAMS:
+        #   * count: int: Records in the batch
+
+        self.records += count
+        if self.records >= self.compact_records:
+            self.rotate()
+
+    def rotate(self) -> None:
+
+        # FUNCTION: Move the journal aside and fold it into the snapshot in a background thread
+
+        # Skip if the last compaction is still running
+        if self.compactor is not None and self.compactor.is_alive():
+            return
+
+        # Retry a failed compaction rather than rotate over its journal, which would lose those records
+        if os.path.exists(self.rotated_path):
+            if self.compact_failed is None or time.monotonic() - self.compact_failed >= COMPACT_RETRY_SECONDS:
+                self.start_compactor()
+            return
+
+        # Swap in a fresh journal
+        self.file.close()
+        os.replace(self.journal_path, self.rotated_path)
+        self.file = open(self.journal_path, "ab")
+        self.records = 0
+
+        # Compact
+        self.start_compactor()
+
+    def start_compactor(self) -> None:
+
+        # FUNCTION: Start folding the rotated journal into the snapshot in a background thread
+
+        self.compactor = threading.Thread(target=self.compact,
+                                          name="journal-compactor",
+                                          daemon=True)
+        self.compactor.start()
+
+    def compact(self) -> None:
+
+        # FUNCTION: Compactor thread. Logs failures and keeps the rotated journal, so rotate retries it later.
+
+        try:
+            self.fold()
+            self.compact_failed = None
+        except Exception as error:
+            self.compact_failed = time.monotonic()
+            io_2.log(ticker="journal",
+                     message="Compacting journal failed: {!r}. Keeping '{}' to retry.",
+                     args=(error, self.rotated_path),
+                     level=io_2.ERROR)
+
+    def fold(self) -> None:
+
+        # FUNCTION: Fold the rotated journal into the snapshot. Works on disk only, never on the live data.
+
+        io_2.log(ticker="journal",
+                 message="Compacting journal into '{}'...",
+                 args=(self.snapshot_path,))
+
+        # Load snapshot, or start from nothing if it is missing or unreadable
+        try:
+            data = io_2.read_json(file_path=self.snapshot_path)
+            if data["configured"] != "True":
+                raise ValueError("snapshot not configured")
+        except (OSError, ValueError, KeyError):
+            data = io_2.read_json(file_path="defaults/data_defaults.json")
+
+        # Apply rotated records
+        apply_records(data=data,
+                      file_path=self.rotated_path)
+
+        # Replace snapshot, then drop the folded journal
+        io_2.write_json(file_path=self.snapshot_path,
+                        data=data,
+                        atomic=True)
+        self.snapshot_key = io_2.source_key(file_paths=[self.snapshot_path])
+        os.remove(self.rotated_path)
+
+        io_2.log(ticker="journal",
+                 message="Compacted journal into '{}'.",
+                 args=(self.snapshot_path,))
+
+    def close(self) -> None:
+
+        # FUNCTION: Close the journal file
+
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+# FUNCTIONS
+def encode(record: dict) -> bytes:
+
+    # FUNCTION: Encode a record as one compact JSON line
+
+    # PARAMS:
+    #   * record: dict: Change record
+
+    # RETURNS:
+    #   * line: bytes: Encoded record, newline terminated
+
+    return json.dumps(record, separators=(",", ":")).encode() + b"\n"
+
+
+def read_records(file_path: str):
+
+    # FUNCTION: Read records from a journal file, skipping a torn final write left by a crash
+
+    # PARAMS:
+    #   * file_path: str: Path to journal
+
+    # RETURNS:
+    #   * (generator): Yields records in order
+
+    if not os.path.exists(file_path):
+        return
+    with open(file_path, "rb") as file:
+        for line in file:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                io_2.log(ticker="journal",
+                         message="Skipping unreadable record in '{}'",
+                         args=(file_path,),
+                         level=io_2.WARN)
+
+
+def apply_records(data: dict,
+                  file_path: str) -> int:
+
+    # FUNCTION: Apply every record in a journal file to data, skipping records that no longer apply
+
+    # PARAMS:
+    #   * data: dict: Data to apply records to
+    #   * file_path: str: Path to journal
+
+    # RETURNS:
+    #   * count: int: Number of records applied
+
+    count = 0
+    for record in read_records(file_path=file_path):
+        try:
+            state.apply(data=data,
+                        record=record)
+        except (KeyError, ValueError) as error:
+            io_2.log(ticker="journal",
+                     message="Skipping record {} that does not apply: {!r}",
+                     args=(record, error),
+                     level=io_2.WARN)
+            continue
+        count += 1
+    return count
@@ -0,0 +1,141 @@
+# FILE: Loading config and data at startup
+
+
+# DEPENDENCIES
+import time
+
+import common
+import io_2
+
+
+# CONSTANTS
+CONFIG_PATH = "config/config.json"
+CONFIG_DEFAULTS_PATH = "defaults/config_defaults.json"
+DATA_PATH = "data/data.json"
+DATA_DEFAULTS_PATH = "defaults/data_defaults.json"
+
+
+# CLASSES
+class PhaseTimer:
+
+    # CLASS: Times consecutive startup phases and logs them together
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.last = self.started
+        self.phases = []
+
+    def mark(self,
+             name: str) -> None:
+
+        # FUNCTION: End the current phase
+
+        # PARAMS:
+        #   * name: str: Name of the phase that just finished
+
+        now = time.perf_counter()
+        self.phases.append((name, now - self.last))
+        self.last = now
+
+    def report(self) -> None:
+
+        # FUNCTION: Log all phase timings and the total
+
+        io_2.log(ticker="startup",
+                 message="Startup took {:.1f} ms ({})",
+                 args=((self.last - self.started) * 1000,
+                       ", ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in self.phases)))
+
+
+# FUNCTIONS
+def load_json(file_path: str,
+              defaults_path: str,
+              validate,
+              label: str) -> dict:
+
+    # FUNCTION: Read and validate a json file, falling back to its defaults if it cannot be used
+
+    # PARAMS:
+    #   * file_path: str: Path to json file
+    #   * defaults_path: str: Path to defaults
+    #   * validate: Callable[[dict], dict]: Validator, raising ValueError if the file is unusable
+    #   * label: str: Name of the file for logs
+
+    # RETURNS:
+    #   * result: dict: Validated contents
+
+    try:
+        return validate(io_2.read_json(file_path=file_path))
+    except (OSError, ValueError, KeyError, TypeError) as error:
+        io_2.log(ticker="bot",
+                 message="{} file could not be used ({}). Using defaults...",
+                 args=(label, error),
+                 level=io_2.WARN)
+        return validate(io_2.read_json(file_path=defaults_path))
+
+
+def load_config() -> dict:
+
+    # FUNCTION: Load and validate the config
+
+    # RETURNS:
+    #   * config: dict: Config, completed from the defaults
+
+    defaults = io_2.read_json(file_path=CONFIG_DEFAULTS_PATH)
+    return load_json(file_path=CONFIG_PATH,
+                     defaults_path=CONFIG_DEFAULTS_PATH,
+                     validate=lambda config: common.validate_config(config=config,
+                                                                    defaults=defaults),
+                     label="Config")
+
+
+def load_data() -> dict:
+
+    # FUNCTION: Load and validate the data snapshot (data.json)
+
+    # RETURNS:
+    #   * data: dict: Data
+
+    return load_json(file_path=DATA_PATH,
+                     defaults_path=DATA_DEFAULTS_PATH,
+                     validate=common.validate_data,
+                     label="Data")
+
+
+def load_state(snapshot_path: str = common.SNAPSHOT_PATH) -> (dict, dict):
+
+    # FUNCTION: Load config and data, from the binary snapshot if it is still fresh, otherwise from json
+
+    # PARAMS:
+    #   * snapshot_path: str: Path to binary snapshot
+
+    # RETURNS:
+    #   * config: dict: Config
+    #   * data: dict: Data, or None if it is not kept in data.json
+
+    # Use snapshot if made from the current files
+    key = io_2.source_key(file_paths=[CONFIG_PATH, CONFIG_DEFAULTS_PATH, DATA_PATH, DATA_DEFAULTS_PATH])
+    payload = io_2.read_snapshot(file_path=snapshot_path,
+                                 key=key)
+    if payload is not None:
+        io_2.log(ticker="startup",
+                 message="Loaded config and data from snapshot '{}'",
+                 args=(snapshot_path,))
+        return payload
+
+    # Parse and validate json
+    config = load_config()
+    data = load_data() if config["storage"]["backend"] == "json" else None
+
+    # Save snapshot for next start
+    try:
+        io_2.write_snapshot(file_path=snapshot_path,
+                            key=key,
+                            payload=(config, data))
+    except OSError as error:
+        io_2.log(ticker="startup",
+                 message="Could not write snapshot '{}': {}",
+                 args=(snapshot_path, error),
+                 level=io_2.WARN)
+
+    return config, data
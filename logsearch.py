@@ -0,0 +1,228 @@
+# FILE: Log search over the current and rotated log files, using the sidecar indexes written by io_2.
+# Only the batches whose index entry matches the ticker, snowflake and time range are read.
+
+
+# DEPENDENCIES
+import gzip
+import json
+import os
+import re
+from datetime import datetime
+
+import io_2
+
+
+# CONSTANTS
+LINE_TIME_PATTERN = re.compile(r"\((\d{4}-\d\d-\d\d \d\d:\d\d:\d\d(?:\.\d+)?)\)")  # Timestamp at the start of a line
+ROTATED_STAMP_PATTERN = re.compile(r"\.(\d{4}-\d\d-\d\dT\d\d-\d\d-\d\d)")  # Rotation time in a rotated file's name
+
+
+# FUNCTIONS
+def read_index(file_path: str) -> list[dict]:
+
+    # FUNCTION: Read a log file's sidecar index
+
+    # PARAMS:
+    #   * file_path: str: Log file, compressed or not
+
+    # RETURNS:
+    #   * entries: list[dict]: Index entries, or None if the file has no index
+
+    try:
+        with open(f"{file_path}{io_2.LOG_INDEX_SUFFIX}", "rb") as file:
+            entries = []
+            for line in file:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    pass  # Entry still being written
+            return entries
+    except FileNotFoundError:
+        return None
+
+
+def entry_matches(entry: dict,
+                  ticker: str,
+                  snowflake: str,
+                  since: float,
+                  until: float) -> bool:
+
+    # FUNCTION: Check whether a batch may hold matching lines
+
+    # PARAMS:
+    #   * entry: dict: Index entry
+    #   * ticker: str: Ticker, upper case, or None for any
+    #   * snowflake: str: Snowflake, or None for any
+    #   * since: float: Unix time, or None for no lower bound
+    #   * until: float: Unix time, or None for no upper bound
+
+    # RETURNS:
+    #   * matches: bool: Whether the batch needs reading
+
+    if ticker is not None and ticker not in entry["tickers"]:
+        return False
+    if snowflake is not None and snowflake not in entry["snowflakes"]:
+        return False
+    if entry["first"] is not None:
+        if since is not None and entry["last"] < since:
+            return False
+        if until is not None and entry["first"] > until:
+            return False
+    return True
+
+
+def line_matches(line: str,
+                 ticker: str,
+                 snowflake: str,
+                 since: float,
+                 until: float) -> bool:
+
+    # FUNCTION: Check a single log line (see entry_matches for the params)
+
+    # RETURNS:
+    #   * matches: bool: Whether the line matches
+
+    if ticker is not None and f"[{ticker}]" not in line:
+        return False
+    if snowflake is not None and snowflake not in io_2.LOG_ID_PATTERN.findall(line):
+        return False
+    if since is not None or until is not None:
+        match = LINE_TIME_PATTERN.match(line)
+        if match is None:
+            return False
+        created = datetime.fromisoformat(match.group(1)).timestamp()
+        if (since is not None and created < since) or (until is not None and created > until):
+            return False
+    return True
+
+
+def read_lines(file_path: str,
+               entries: list[dict]):
+
+    # FUNCTION: Read the lines of a log file, or of just the given batches
+
+    # PARAMS:
+    #   * file_path: str: Log file, compressed or not
+    #   * entries: list[dict]: Index entries to read, or None to read the whole file
+
+    # RETURNS:
+    #   * (yield) line: str: Lines, without newlines
+
+    compressed = file_path.endswith(".gz")
+
+    # Whole file, for files written before indexing
+    if entries is None:
+        with (gzip.open(file_path, "rt", errors="replace") if compressed
+              else open(file_path, errors="replace")) as file:
+            for line in file:
+                yield line.rstrip("\n")
+        return
+
+    # Matching byte ranges only
+    with open(file_path, "rb") as file:
+        for entry in entries:
+            start, end = ((entry["compressed_start"], entry["compressed_end"]) if compressed
+                          else (entry["start"], entry["end"]))
+            file.seek(start)
+            content = file.read(end - start)
+            if compressed:
+                content = gzip.decompress(content)
+            yield from content.decode(errors="replace").splitlines()
+
+
+def search(file_path: str,
+           ticker: str = None,
+           snowflake: str = None,
+           since: float = None,
+           until: float = None,
+           max_lines: int = 20000) -> (list[str], dict):
+
+    # FUNCTION: Find log lines by ticker, snowflake and time range, across the log file and its rotated files
+
+    # PARAMS:
+    #   * file_path: str: Log file, e.g. logs/log.txt
+    #   * ticker: str: Ticker, e.g. "perm", or None for any
+    #   * snowflake: str: Snowflake the line mentions, or None for any
+    #   * since: float: Unix time, or None for no lower bound
+    #   * until: float: Unix time, or None for no upper bound
+    #   * max_lines: int: Maximum lines to return; the newest are kept
+
+    # RETURNS:
+    #   * lines: list[str]: Matching lines, oldest first
+    #   * stats: dict: files searched, bytes read and whether results were cut off
+
+    ticker = ticker.upper() if ticker else None
+    lines = []
+    stats = {"files": 0, "bytes": 0, "truncated": False}
+    for segment_path in io_2.rotated_log_paths(file_path=file_path) + [file_path]:
+
+        # Skip rotated files that ended before the range
+        stamp = ROTATED_STAMP_PATTERN.search(os.path.basename(segment_path))
+        if stamp and since is not None:
+            if datetime.strptime(stamp.group(1), io_2.ROTATED_STAMP_FORMAT).timestamp() < since:
+                continue
+
+        # Pick batches
+        entries = read_index(file_path=segment_path)
+        if entries is not None:
+            entries = [entry for entry in entries
+                       if entry_matches(entry=entry, ticker=ticker, snowflake=snowflake, since=since, until=until)
+                       and (not segment_path.endswith(".gz") or "compressed_start" in entry)]
+            if not entries:
+                continue
+
+        # Read
+        try:
+            for line in read_lines(file_path=segment_path,
+                                   entries=entries):
+                if line_matches(line=line, ticker=ticker, snowflake=snowflake, since=since, until=until):
+                    lines.append(line)
+        except OSError:
+            continue  # Rotated or compressed meanwhile
+        stats["files"] += 1
+        stats["bytes"] += (sum(entry["end"] - entry["start"] for entry in entries) if entries is not None
+                           else os.path.getsize(segment_path))
+        if len(lines) > max_lines:
+            stats["truncated"] = True
+            del lines[:len(lines) - max_lines]
+    return lines, stats
+
+
+# TESTING
+if __name__ == "__main__":
+    import random
+    import tempfile
+    import time
+
+    # Log 200k lines across rotations, from 1000 users
+    os.chdir(tempfile.mkdtemp())
+    os.mkdir("logs")
+    io_2.configure_logging(file_path="logs/log.txt",
+                           max_bytes=4 * 1024 * 1024,
+                           batch_size=256,
+                           flush_interval=0.05,
+                           overflow="block")
+    users = [random.getrandbits(60) | (1 << 59) for _ in range(1000)]
+    for index in range(200_000):
+        io_2.log(ticker="perm" if index % 2 else "bot",
+                 message="Checking if command is allowed for '{}' in channel '{}'",
+                 args=(random.choice(users), users[0]),
+                 to_console=False)
+    io_2.update_log_file(timeout=60)
+    time.sleep(1.0)  # Let the compressor finish
+
+    total = sum(os.path.getsize(os.path.join("logs", name)) for name in os.listdir("logs") if "idx" not in name)
+    index_total = sum(os.path.getsize(os.path.join("logs", name)) for name in os.listdir("logs") if "idx" in name)
+    started = time.perf_counter()
+    found, found_stats = search(file_path="logs/log.txt",
+                                ticker="perm",
+                                snowflake=str(users[1]))
+    indexed_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    scanned = [line for path in io_2.rotated_log_paths(file_path="logs/log.txt") + ["logs/log.txt"]
+               for line in read_lines(file_path=path, entries=None)
+               if line_matches(line=line, ticker="PERM", snowflake=str(users[1]), since=None, until=None)]
+    scan_seconds = time.perf_counter() - started
+    print(f"{len(os.listdir('logs'))} files, {total / 1e6:.1f} MB on disk, index {index_total / 1e6:.1f} MB")
+    print(f"indexed: {len(found)} lines in {indexed_seconds * 1000:.1f} ms, read {found_stats['bytes'] / 1e6:.2f} MB")
+    print(f"scan: {len(scanned)} lines in {scan_seconds * 1000:.1f} ms, same: {found == scanned}")
@@ -0,0 +1,441 @@
+# FILE: Metrics registry with Prometheus text export
+
+
+# DEPENDENCIES
+import asyncio
+import bisect
+import math
+import os
+import threading
+import time
+from typing import Callable
+
+
+# CONSTANTS
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0)  # Seconds
+
+
+# CLASSES
+class Metric:
+
+    # CLASS: Base for metrics. Values are kept per tuple of label values.
+
+    kind = "untyped"
+
+    def __init__(self,
+                 name: str,
+                 description: str,
+                 labels: tuple = ()) -> None:
+
+        # PARAMS:
+        #   * name: str: Metric name, e.g. raindrop_commands_total
+        #   * description: str: Help text
+        #   * labels: tuple[str]: Label names
+
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values = {}  # Label values -> value
+        self.lock = threading.Lock()
+
+    def label_text(self,
+                   values: tuple,
+                   extra: str = "") -> str:
+
+        # FUNCTION: Format label values for the text format
+
+        # PARAMS:
+        #   * values: tuple: Label values
+        #   * extra: str: Extra label, already formatted
+
+        # RETURNS:
+        #   * text: str: e.g. {command="about"}, or "" if there are no labels
+
+        pairs = [f'{name}="{escape(value=str(value))}"' for name, value in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def samples(self) -> list[str]:
+
+        # FUNCTION: Format current values as sample lines
+
+        # RETURNS:
+        #   * lines: list[str]: Sample lines
+
+        with self.lock:
+            values = list(self.values.items())
+        return [f"{self.name}{self.label_text(values=labels)} {format_value(value=value)}"
+                for labels, value in values]
+
+    def render(self) -> list[str]:
+
+        # FUNCTION: Format the metric with its HELP and TYPE lines
+
+        # RETURNS:
+        #   * lines: list[str]: Lines in the Prometheus text format
+
+        return [f"# HELP {self.name} {self.description}",
+                f"# TYPE {self.name} {self.kind}"] + self.samples()
+
+
+class Counter(Metric):
+
+    # CLASS: Value that only goes up
+
+    kind = "counter"
+
+    def inc(self,
+            amount: float = 1.0,
+            labels: tuple = ()) -> None:
+
+        # FUNCTION: Add to the counter
+
+        # PARAMS:
+        #   * amount: float: Amount to add
+        #   * labels: tuple: Label values
+
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+
+    # CLASS: Value that goes up and down, either set directly or read from a function at export time
+
+    kind = "gauge"
+
+    def __init__(self,
+                 name: str,
+                 description: str,
+                 labels: tuple = (),
+                 function: Callable[[], float] = None) -> None:
+
+        # PARAMS:
+        #   * name: str: Metric name
+        #   * description: str: Help text
+        #   * labels: tuple[str]: Label names
+        #   * function: Callable[[], float]: Reads the value when exported, for unlabelled gauges
+
+        super().__init__(name=name,
+                         description=description,
+                         labels=labels)
+        self.function = function
+
+    def set(self,
+            value: float,
+            labels: tuple = ()) -> None:
+
+        # FUNCTION: Set the gauge
+
+        # PARAMS:
+        #   * value: float: New value
+        #   * labels: tuple: Label values
+
+        with self.lock:
+            self.values[labels] = value
+
+    def samples(self) -> list[str]:
+        if self.function is not None:
+            self.set(value=self.function())
+        return super().samples()
+
+
+class Histogram(Metric):
+
+    # CLASS: Counts observations into fixed buckets, so observing is one bisect and two additions
+
+    kind = "histogram"
+
+    def __init__(self,
+                 name: str,
+                 description: str,
+                 labels: tuple = (),
+                 buckets: tuple = LATENCY_BUCKETS) -> None:
+
+        # PARAMS:
+        #   * name: str: Metric name
+        #   * description: str: Help text
+        #   * labels: tuple[str]: Label names
+        #   * buckets: tuple[float]: Sorted upper bounds, not including +Inf
+
+        super().__init__(name=name,
+                         description=description,
+                         labels=labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self,
+                value: float,
+                labels: tuple = ()) -> None:
+
+        # FUNCTION: Record an observation
+
+        # PARAMS:
+        #   * value: float: Observed value
+        #   * labels: tuple: Label values
+
+        position = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(labels)
+            if entry is None:
+                entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]  # Counts, sum, count
+            entry[0][position] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def time(self,
+             labels: tuple = ()) -> "Timer":
+
+        # FUNCTION: Time a block of code into the histogram
+
+        # PARAMS:
+        #   * labels: tuple: Label values
+
+        # RETURNS:
+        #   * timer: Timer: Context manager
+
+        return Timer(histogram=self,
+                     labels=labels)
+
+    def snapshot(self) -> dict:
+
+        # FUNCTION: Copy the current values
+
+        # RETURNS:
+        #   * values: dict: Label values -> (bucket counts, sum, count)
+
+        with self.lock:
+            return {labels: (list(counts), total, count) for labels, (counts, total, count) in self.values.items()}
+
+    def quantile(self,
+                 fraction: float,
+                 labels: tuple = ()) -> float:
+
+        # FUNCTION: Estimate a quantile by interpolating within its bucket
+
+        # PARAMS:
+        #   * fraction: float: Quantile, between 0 and 1
+        #   * labels: tuple: Label values
+
+        # RETURNS:
+        #   * value: float: Estimate, or NaN if nothing was observed
+
+        entry = self.snapshot().get(labels)
+        if entry is None or entry[2] == 0:
+            return math.nan
+        counts, total, count = entry
+        rank = fraction * count
+        seen = 0
+        for position, bucket_count in enumerate(counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = self.buckets[position - 1] if position > 0 else 0.0
+                if position == len(self.buckets):
+                    return lower
+                return lower + (self.buckets[position] - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return self.buckets[-1]
+
+    def samples(self) -> list[str]:
+        lines = []
+        for labels, (counts, total, count) in self.snapshot().items():
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                le = 'le="+Inf"' if bound == math.inf else f'le="{format_value(value=bound)}"'
+                lines.append(f"{self.name}_bucket{self.label_text(values=labels, extra=le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self.label_text(values=labels)} {format_value(value=total)}")
+            lines.append(f"{self.name}_count{self.label_text(values=labels)} {count}")
+        return lines
+
+
+class Timer:
+
+    # CLASS: Context manager observing the time spent inside it
+
+    def __init__(self,
+                 histogram: Histogram,
+                 labels: tuple = ()) -> None:
+
+        # PARAMS:
+        #   * histogram: Histogram: Histogram to observe into
+        #   * labels: tuple: Label values
+
+        self.histogram = histogram
+        self.labels = labels
+        self.started = None
+
+    def __enter__(self) -> "Timer":
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exception) -> None:
+        self.histogram.observe(value=time.perf_counter() - self.started,
+                               labels=self.labels)
+
+
+class Registry:
+
+    # CLASS: Named collection of metrics. Getting a metric that already exists returns it.
+
+    def __init__(self) -> None:
+        self.metrics = {}  # Name -> metric
+        self.lock = threading.Lock()
+
+    def register(self,
+                 metric: Metric) -> Metric:
+
+        # FUNCTION: Add a metric, or return the existing one of the same name
+
+        # PARAMS:
+        #   * metric: Metric: Metric to add
+
+        # RETURNS:
+        #   * metric: Metric: Registered metric
+
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self,
+                name: str,
+                description: str,
+                labels: tuple = ()) -> Counter:
+
+        # FUNCTION: Get or create a counter (see Counter)
+
+        return self.register(metric=Counter(name=name,
+                                            description=description,
+                                            labels=labels))
+
+    def gauge(self,
+              name: str,
+              description: str,
+              labels: tuple = (),
+              function: Callable[[], float] = None) -> Gauge:
+
+        # FUNCTION: Get or create a gauge (see Gauge)
+
+        return self.register(metric=Gauge(name=name,
+                                          description=description,
+                                          labels=labels,
+                                          function=function))
+
+    def histogram(self,
+                  name: str,
+                  description: str,
+                  labels: tuple = (),
+                  buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+
+        # FUNCTION: Get or create a histogram (see Histogram)
+
+        return self.register(metric=Histogram(name=name,
+                                              description=description,
+                                              labels=labels,
+                                              buckets=buckets))
+
+    def render(self) -> str:
+
+        # FUNCTION: Format every metric in the Prometheus text format
+
+        # RETURNS:
+        #   * text: str: Exposition text
+
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def write(self,
+              file_path: str) -> None:
+
+        # FUNCTION: Write the exposition text atomically, so scrapers never read a partial file
+
+        # PARAMS:
+        #   * file_path: str: Path to write, e.g. for the node exporter textfile collector
+
+        with open(f"{file_path}.tmp", "w") as file:
+            file.write(self.render())
+        os.replace(f"{file_path}.tmp", file_path)
+
+
+# VARIABLES
+registry = Registry()  # Default registry, shared by every module
+
+
+# FUNCTIONS
+def escape(value: str) -> str:
+
+    # FUNCTION: Escape a label value for the text format
+
+    # PARAMS:
+    #   * value: str: Label value
+
+    # RETURNS:
+    #   * escaped: str: Escaped value
+
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value: float) -> str:
+
+    # FUNCTION: Format a sample value for the text format
+
+    # PARAMS:
+    #   * value: float: Value
+
+    # RETURNS:
+    #   * text: str: Formatted value
+
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+async def run_exporter(file_path: str,
+                       interval: float,
+                       on_error: Callable[[Exception], None] = None) -> None:
+
+    # FUNCTION: Write the default registry to a file every interval, off the event loop
+
+    # PARAMS:
+    #   * file_path: str: Path to write
+    #   * interval: float: Seconds between writes
+    #   * on_error: Callable[[Exception], None]: Called when a write fails
+
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            await loop.run_in_executor(None, registry.write, file_path)
+        except OSError as error:
+            if on_error is not None:
+                on_error(error)
+        await asyncio.sleep(interval)
+
+
+# TESTING
+if __name__ == "__main__":
+    import timeit
+
+    test_registry = Registry()
+    counter = test_registry.counter(name="test_total",
+                                    description="Test counter",
+                                    labels=("command",))
+    histogram = test_registry.histogram(name="test_seconds",
+                                        description="Test latency",
+                                        labels=("command",))
+    test_registry.gauge(name="test_depth",
+                        description="Test gauge",
+                        function=lambda: 3)
+    for index in range(1000):
+        counter.inc(labels=("about",))
+        histogram.observe(value=index / 100000,
+                          labels=("about",))
+    print(test_registry.render())
+    print(f"p50: {histogram.quantile(fraction=0.5, labels=('about',)) * 1000:.3f} ms")
+
+    seconds = min(timeit.repeat(lambda: histogram.observe(value=0.003, labels=("about",)), number=100_000, repeat=5))
+    print(f"observe: {seconds / 100_000 * 1e9:.0f} ns")
@@ -0,0 +1,308 @@
+# FILE: Serialized data changes. Commands that check a stream and then change it hold that stream's lock across
+# their awaits, so changes to other streams still run concurrently. Global list changes go through a single writer
+# task, which checks and applies them strictly in the order they were made.
+
+
+# DEPENDENCIES
+import asyncio
+import contextlib
+
+import common
+import state
+
+
+# CLASSES
+class StreamLocks:
+
+    # CLASS: One lock per stream name, created on first use and dropped once nothing holds or waits for it
+
+    def __init__(self) -> None:
+        self.locks = {}  # Name -> [asyncio.Lock, number of holders and waiters]
+
+    @contextlib.asynccontextmanager
+    async def hold(self,
+                   name: str):
+
+        # FUNCTION: Hold a stream's lock for the body of an async with block
+
+        # PARAMS:
+        #   * name: str: Stream name, whether or not the stream exists
+
+        entry = self.locks.get(name)
+        if entry is None:
+            entry = self.locks[name] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self.locks[name]
+
+
+class ListWriter:
+
+    # CLASS: Single writer for the global lists. Each change is checked against the list as left by the changes
+    # before it and applied in memory in turn; waiting for it to be durable happens outside the writer.
+
+    def __init__(self) -> None:
+        self.queue = None
+        self.writer = None
+
+    async def submit(self,
+                     list_name: str,
+                     snowflakes: list[int],
+                     remove: bool = False) -> list[int]:
+
+        # FUNCTION: Queue a change to a global list and wait until it is durable
+
+        # PARAMS:
+        #   * list_name: str: "whitelist", "blacklist" or "admins"
+        #   * snowflakes: list[int]: Ids to add or remove
+        #   * remove: bool: Whether to remove the ids instead of adding them
+
+        # RETURNS:
+        #   * changed: list[int]: Ids actually added or removed; the others were already present or absent
+
+        # Start writer on first use, inside the running loop
+        if self.writer is None:
+            self.queue = asyncio.Queue()
+            self.writer = asyncio.get_running_loop().create_task(self.run_writer())
+
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((list_name, snowflakes, remove, future))
+        changed, durable = await future
+        if durable is not None:
+            await durable
+        return changed
+
+    async def run_writer(self) -> None:
+
+        # FUNCTION: Writer loop
+
+        while True:
+            list_name, snowflakes, remove, future = await self.queue.get()
+            try:
+                result = self.apply(list_name=list_name,
+                                    snowflakes=snowflakes,
+                                    remove=remove)
+            except Exception as error:
+                if not future.cancelled():
+                    future.set_exception(error)
+                continue
+            if not future.cancelled():
+                future.set_result(result)
+
+    def apply(self,
+              list_name: str,
+              snowflakes: list[int],
+              remove: bool) -> (list[int], asyncio.Future):
+
+        # FUNCTION: Apply a change in memory and start persisting it (see submit for the params)
+
+        # RETURNS:
+        #   * changed: list[int]: Ids actually added or removed
+        #   * durable: asyncio.Future: Done once the change is durable, or None if nothing changed
+
+        current = common.data[list_name]
+        changed = [snowflake for snowflake in dict.fromkeys(snowflakes) if (snowflake in current) == remove]
+        if not changed:
+            return changed, None
+
+        if len(changed) == 1:
+            record = {"op": "list_remove" if remove else "list_add", "list": list_name, "snowflake": changed[0]}
+        else:
+            record = {"op": "list_remove_many" if remove else "list_add_many", "list": list_name, "snowflakes": changed}
+        return changed, common.store.enqueue(record=state.stage(record=record))
+
+
+# TESTING
+if __name__ == "__main__":
+    import json
+    import os
+    import random
+    import shutil
+    import sys
+    import tempfile
+    import time
+    import traceback
+
+    # Run the real bot.py commands in a scratch directory, with fake interactions instead of Discord
+    source = os.path.dirname(os.path.abspath(__file__))
+    workspace = tempfile.mkdtemp(prefix="raindrop-mutations-")
+    shutil.copytree(os.path.join(source, "defaults"), os.path.join(workspace, "defaults"))
+    for directory in ("config", "data", "logs", "secret"):
+        os.makedirs(os.path.join(workspace, directory))
+    with open(os.path.join(workspace, "defaults/config_defaults.json")) as file:
+        config = json.load(file)
+    config["logging"]["level"] = "WARN"
+    config["reload"]["poll_interval"] = 0
+    config["storage"]["compact_records"] = 10 ** 9
+    config["rate_limits"]["user"]["rate"] = config["rate_limits"]["guild"]["rate"] = 0
+    config["announcements"]["global_rate"] = config["announcements"]["route_rate"] = 100000
+    admin = 446592818136219648
+    initial = {"configured": "True", "streams": {}, "whitelist": [], "blacklist": [], "admins": [str(admin)]}
+    for file_path, content in (("config/config.json", config),
+                               ("data/data.json", initial),
+                               ("secret/api_key.json", {"bot_token": ""})):
+        with open(os.path.join(workspace, file_path), "w") as file:
+            json.dump(content, file)
+    os.chdir(workspace)
+    sys.path.insert(0, source)
+
+    import bot
+    import io_2
+    import snowflakes
+
+    class FakeChannel:
+        def __init__(self, channel_id: int) -> None:
+            self.id = channel_id
+
+        def __str__(self) -> str:
+            return f"channel-{self.id}"
+
+        async def send(self, **kwargs) -> None:
+            await asyncio.sleep(random.random() * 0.01)
+
+    class FakeUser:
+        def __init__(self, user_id: int) -> None:
+            self.id = user_id
+            self.roles = []
+
+    class FakeResponse:
+        def __init__(self) -> None:
+            self.done = False
+
+        def is_done(self) -> bool:
+            return self.done
+
+    class FakeInteraction:
+        def __init__(self) -> None:
+            self.response = FakeResponse()
+
+    class FakeContext:
+
+        # An admin's interaction. Deferring and responding take as long as a round trip to Discord.
+        def __init__(self, command) -> None:
+            self.command = command
+            self.user = FakeUser(user_id=admin)
+            self.channel_id = 1 << 58
+            self.guild_id = 1 << 57
+            self.interaction = FakeInteraction()
+
+        async def defer(self) -> None:
+            await asyncio.sleep(random.random() * 0.01)
+            self.interaction.response.done = True
+
+        async def respond(self, **kwargs) -> None:
+            await asyncio.sleep(random.random() * 0.01)
+            self.interaction.response.done = True
+
+    def subcommand(group, name: str):
+        return next(command for command in group.subcommands if command.name == name)
+
+    def locked(name: str) -> bool:
+        entry = common.stream_locks.locks.get(name)
+        return entry is not None and entry[0].locked()
+
+    # Count stream changes and schedules made without holding the stream
+    counts = {"unlocked": 0, "errors": 0}
+    stage = state.stage
+    add_schedule = bot.announcement_scheduler.add
+
+    def checked_stage(record: dict) -> dict:
+        if "name" in record and not locked(name=record["name"]):
+            counts["unlocked"] += 1
+        return stage(record=record)
+
+    async def checked_add(stream: str, **kwargs) -> dict:
+        if not locked(name=stream):
+            counts["unlocked"] += 1
+        return await add_schedule(stream=stream, **kwargs)
+
+    state.stage = checked_stage
+    bot.announcement_scheduler.add = checked_add
+    bot.client.get_channel = FakeChannel
+
+    async def interaction(command, options: dict) -> None:
+
+        # A command arriving at a random time, run as the bot runs it
+        await asyncio.sleep(random.random() * 0.5)
+        ctx = FakeContext(command=command)
+        await bot.start_command(ctx)
+        try:
+            await command.callback(ctx, **options)
+        except Exception:
+            counts["errors"] += 1
+            if counts["errors"] == 1:
+                traceback.print_exc()
+        finally:
+            await bot.finish_command(ctx)
+
+    def check_journal() -> bool:
+
+        # Replay onto the starting data; every record must apply cleanly and leave the same data as memory
+        data = json.loads(json.dumps(initial))
+        with open(common.config["storage"]["journal_path"], "rb") as file:
+            for line in file:
+                state.apply(data=data,
+                            record=json.loads(line))
+        replayed = snowflakes.unpack_data(data=data)
+        return (replayed["streams"].keys() == common.data["streams"].keys()
+                and all(set(replayed["streams"][name]["channels"]) == set(stream["channels"])
+                        for name, stream in common.data["streams"].items())
+                and set(replayed["whitelist"]) == set(common.data["whitelist"]))
+
+    async def stress(interactions: int) -> None:
+        names = [f"stream-{index}" for index in range(20)]
+        stream_commands = [subcommand(group=bot.stream_command_group, name=name)
+                           for name in ("create", "delete", "subscribe", "unsubscribe")]
+        send = subcommand(group=bot.announcement_command_group, name="send")
+        schedule = subcommand(group=bot.announcement_command_group, name="schedule")
+        list_commands = [subcommand(group=bot.whitelist_command_group, name=name) for name in ("add", "remove")]
+        tasks = []
+        for _ in range(interactions):
+            roll = random.random()
+            name = random.choice(names)
+            if roll < 0.6:
+                command = random.choice(stream_commands)
+                options = {"name": name}
+                if command.name in ("subscribe", "unsubscribe"):
+                    options["channel"] = FakeChannel(channel_id=(1 << 59) + random.randrange(50))
+            elif roll < 0.7:
+                command = send
+                options = {"name": name, "title": "Test", "message": "Test"}
+            elif roll < 0.75:
+                command = schedule
+                options = {"name": name, "title": "Test", "message": "Test", "delay_minutes": 60.0}
+            else:
+                command = random.choice(list_commands)
+                options = {"snowflake": str((1 << 59) + random.randrange(100))}
+            tasks.append(interaction(command=command,
+                                     options=options))
+        started = time.perf_counter()
+        await asyncio.gather(*tasks)
+        seconds = time.perf_counter() - started
+        orphaned = sum(entry["stream"] not in common.data["streams"]
+                       for entry in bot.announcement_scheduler.entries.values())
+        print(f"{interactions} interactions in {seconds:.2f}s, handler errors: {counts['errors']}, "
+              f"changes and schedules made without the stream lock: {counts['unlocked']}, "
+              f"journal matches memory: {check_journal()}, locks left: {len(common.stream_locks.locks)}, "
+              f"schedules left for deleted streams: {orphaned}")
+
+        # A repeating schedule whose stream went away without a delete command, e.g. in another shard worker
+        entry = await add_schedule(stream="deleted-elsewhere",
+                                   title="Test",
+                                   message="Test",
+                                   at=time.time(),
+                                   interval=60)
+        await bot.fire_scheduled(entry=entry)
+        print(f"repeating schedule for a missing stream cancelled when due: "
+              f"{entry['id'] not in bot.announcement_scheduler.entries}")
+
+    random.seed(1)
+    asyncio.run(stress(interactions=5000))
+    common.store.close()
+    io_2.update_log_file()
+    shutil.rmtree(workspace)
@@ -0,0 +1,229 @@
+# FILE: Rate limiting
+
+
+# DEPENDENCIES
+import time
+from collections import OrderedDict
+
+
+# CLASSES
+class TokenBucket:
+
+    # CLASS: Token bucket. Refills at a fixed rate up to a burst capacity.
+
+    def __init__(self,
+                 rate: float,
+                 burst: float) -> None:
+
+        # PARAMS:
+        #   * rate: float: Tokens added per second
+        #   * burst: float: Maximum number of tokens held
+
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self,
+               now: float) -> None:
+
+        # FUNCTION: Add tokens accumulated since the last update
+
+        # PARAMS:
+        #   * now: float: Current monotonic time
+
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self,
+                tokens: float = 1.0) -> float:
+
+        # FUNCTION: Take tokens, going into debt if there are not enough
+
+        # PARAMS:
+        #   * tokens: float: Number of tokens to take
+
+        # RETURNS:
+        #   * delay: float: Seconds to wait before the reservation may be used
+
+        # Refill and take
+        self.refill(now=time.monotonic())
+        self.tokens -= tokens
+
+        # Return time until debt is paid off
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def try_take(self,
+                 tokens: float = 1.0) -> float:
+
+        # FUNCTION: Take tokens only if there are enough
+
+        # PARAMS:
+        #   * tokens: float: Number of tokens to take
+
+        # RETURNS:
+        #   * delay: float: 0 if taken, otherwise seconds until there will be enough
+
+        self.refill(now=time.monotonic())
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return 0.0
+        return (tokens - self.tokens) / self.rate
+
+
+class KeyedLimiter:
+
+    # CLASS: Token buckets per key, created on first use. Beyond max_keys the least recently used bucket is evicted;
+    # by then it has usually refilled, so evicting it is the same as keeping it.
+
+    def __init__(self,
+                 rate: float,
+                 burst: float,
+                 max_keys: int = 50000) -> None:
+
+        # PARAMS:
+        #   * rate: float: Tokens added per second to each bucket
+        #   * burst: float: Maximum number of tokens each bucket holds
+        #   * max_keys: int: Maximum number of buckets kept
+
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()  # Key -> TokenBucket, least recently used first
+
+    def bucket(self,
+               key) -> TokenBucket:
+
+        # FUNCTION: Get the bucket for a key, creating it full if there is none
+
+        # PARAMS:
+        #   * key: Hashable key, e.g. a user id
+
+        # RETURNS:
+        #   * bucket: TokenBucket: Bucket
+
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = TokenBucket(rate=self.rate,
+                                                     burst=self.burst)
+            if len(self.buckets) > self.max_keys:
+                self.buckets.popitem(last=False)
+        else:
+            self.buckets.move_to_end(key)
+        return bucket
+
+
+class CommandLimiter:
+
+    # CLASS: Limits commands per user and per guild, with separate buckets for each command group
+
+    def __init__(self,
+                 settings: dict) -> None:
+
+        # PARAMS:
+        #   * settings: dict: The rate_limits section of the config
+
+        self.settings = None
+        self.limiters = {}  # (scope, group) -> KeyedLimiter
+        self.configure(settings=settings)
+
+    def configure(self,
+                  settings: dict) -> None:
+
+        # FUNCTION: Apply new settings, starting every bucket afresh
+
+        # PARAMS:
+        #   * settings: dict: The rate_limits section of the config
+
+        self.settings = settings
+        self.limiters.clear()
+
+    def limiter(self,
+                scope: str,
+                group: str) -> KeyedLimiter:
+
+        # FUNCTION: Get the limiter for a scope and command group
+
+        # PARAMS:
+        #   * scope: str: "user" or "guild"
+        #   * group: str: Command group, e.g. "whitelist", or the command name for commands outside a group
+
+        # RETURNS:
+        #   * limiter: KeyedLimiter: Limiter, or None if the scope is not limited for the group
+
+        key = (scope, group)
+        if key not in self.limiters:
+            limit = self.settings["groups"].get(group, {}).get(scope, self.settings[scope])
+            self.limiters[key] = None if limit["rate"] <= 0 else KeyedLimiter(rate=limit["rate"],
+                                                                              burst=limit["burst"],
+                                                                              max_keys=self.settings["max_keys"])
+        return self.limiters[key]
+
+    def check(self,
+              user_id: int,
+              server_id: int,
+              group: str) -> float:
+
+        # FUNCTION: Take a token from the user's and the guild's bucket for a command group, or from neither
+
+        # PARAMS:
+        #   * user_id: int: ID of user
+        #   * server_id: int: ID of server, or None in DMs
+        #   * group: str: Command group
+
+        # RETURNS:
+        #   * delay: float: 0 if allowed, otherwise seconds until the command may be used again
+
+        taken = []
+        for scope, key in (("user", user_id), ("guild", server_id)):
+            limiter = self.limiter(scope=scope,
+                                   group=group)
+            if limiter is None or key is None:
+                continue
+            bucket = limiter.bucket(key=key)
+            delay = bucket.try_take()
+            if delay > 0:
+                for taken_bucket in taken:  # Give back, so a rejected call costs nothing
+                    taken_bucket.tokens += 1
+                return delay
+            taken.append(bucket)
+        return 0.0
+
+
+# FUNCTIONS
+def check_settings(settings: dict) -> None:
+
+    # FUNCTION: Check the rate_limits section of a config before applying it
+
+    # PARAMS:
+    #   * settings: dict: The rate_limits section of the config
+
+    # RAISES:
+    #   * ValueError: If a limit is malformed
+
+    def check_limit(name: str,
+                    limit) -> None:
+        if not isinstance(limit, dict):
+            raise ValueError(f"{name} must be an object with a rate and a burst")
+        for key in ("rate", "burst"):
+            value = limit.get(key)
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+                raise ValueError(f"{name}.{key} must be a number of at least 0")
+        if limit["rate"] > 0 and limit["burst"] < 1:
+            raise ValueError(f"{name}.burst must be at least 1")
+
+    for scope in ("user", "guild"):
+        check_limit(name=f"rate_limits.{scope}",
+                    limit=settings[scope])
+    if not isinstance(settings["groups"], dict):
+        raise ValueError("rate_limits.groups must be an object")
+    for group, limits in settings["groups"].items():
+        if not isinstance(limits, dict) or not set(limits) <= {"user", "guild"}:
+            raise ValueError(f"rate_limits.groups.{group} must only set user and guild limits")
+        for scope, limit in limits.items():
+            check_limit(name=f"rate_limits.groups.{group}.{scope}",
+                        limit=limit)
+    if isinstance(settings["max_keys"], bool) or not isinstance(settings["max_keys"], int) or settings["max_keys"] < 1:
+        raise ValueError("rate_limits.max_keys must be a whole number of at least 1")
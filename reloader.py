@@ -0,0 +1,191 @@
+# FILE: Hot reload of config.json and data.json. A watcher polls the files' mtime and size; changed files are
+# parsed and validated off the event loop and swapped in, keeping the current state if they do not validate.
+
+
+# DEPENDENCIES
+import asyncio
+import json
+from typing import Awaitable, Callable
+
+import common
+import io_2
+import journal
+import loader
+import ratelimit
+import state
+
+
+# CONSTANTS
+RESTART_SECTIONS = ("storage", "sharding", "metrics", "memory", "reload")  # Config sections only read at startup
+RESTART_SETTINGS = {  # Settings only read at startup, in sections that otherwise apply live
+    "announcements": ("global_rate", "route_rate", "route_burst", "max_routes", "schedule_path")
+}
+
+
+# CLASSES
+class FileWatcher:
+
+    # CLASS: Polls files for changes by mtime and size, calling back once per change
+
+    def __init__(self,
+                 file_paths: list[str],
+                 on_change: Callable[[str], Awaitable[bool]],
+                 interval: float = 2.0) -> None:
+
+        # PARAMS:
+        #   * file_paths: list[str]: Files to watch
+        #   * on_change: Callable[[str], Awaitable[bool]]: Called with a changed file's path. Returns False to be
+        #     called again on the next poll
+        #   * interval: float: Seconds between polls
+
+        self.on_change = on_change
+        self.interval = interval
+        self.keys = {key[0]: key[1:] for key in io_2.source_key(file_paths=file_paths)}  # Path -> [mtime, size]
+
+    async def run(self) -> None:
+
+        # FUNCTION: Poll loop
+
+        while True:
+            await asyncio.sleep(self.interval)
+            for file_path, *key in io_2.source_key(file_paths=list(self.keys)):
+                if key == self.keys[file_path] or key[0] is None:
+                    continue
+                try:
+                    handled = await self.on_change(file_path)
+                except Exception as error:
+                    io_2.log(ticker="reload",
+                             message="Reloading '{}' failed: {!r}",
+                             args=(file_path, error),
+                             level=io_2.ERROR)
+                    handled = True
+                if handled is not False:
+                    self.keys[file_path] = key
+
+
+# FUNCTIONS
+def read_config() -> dict:
+
+    # FUNCTION: Parse and validate config.json, including the settings applied while running. Runs in a worker
+    # thread.
+
+    # RETURNS:
+    #   * config: dict: Config, completed from the defaults
+
+    # RAISES:
+    #   * OSError, ValueError, KeyError, TypeError: If the config cannot be used
+
+    config = common.validate_config(config=io_2.read_json(file_path=loader.CONFIG_PATH),
+                                    defaults=io_2.read_json(file_path=loader.CONFIG_DEFAULTS_PATH))
+    io_2.check_logging(settings=config["logging"])
+    ratelimit.check_settings(settings=config["rate_limits"])
+    for key in ("cache_size", "cache_ttl"):
+        value = config["permissions"][key]
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+            raise ValueError(f"permissions.{key} must be a number of at least 0")
+    return config
+
+
+def read_data(store: journal.Journal) -> dict:
+
+    # FUNCTION: Parse and validate data.json and replay the journal on top, like at startup. Runs in a worker
+    # thread while the journal is not being written.
+
+    # PARAMS:
+    #   * store: journal.Journal: Journal of changes not yet folded into data.json
+
+    # RETURNS:
+    #   * data: dict: Data, in the json layout
+
+    # RAISES:
+    #   * OSError, ValueError, KeyError, TypeError: If data.json cannot be used
+
+    data = common.validate_data(data=io_2.read_json(file_path=store.snapshot_path))
+    journal.apply_records(data=data,
+                          file_path=store.rotated_path)
+    journal.apply_records(data=data,
+                          file_path=store.journal_path)
+    return data
+
+
+async def reload_config() -> bool:
+
+    # FUNCTION: Swap in config.json if it validates, and apply the settings that can change while running
+
+    # RETURNS:
+    #   * handled: bool: Always True
+
+    try:
+        config = await asyncio.get_running_loop().run_in_executor(None, read_config)
+    except (OSError, ValueError, KeyError, TypeError) as error:
+        io_2.log(ticker="reload",
+                 message="Config file could not be used ({}). Keeping the current config.",
+                 args=(error,),
+                 level=io_2.WARN)
+        return True
+
+    # Apply the live settings, all checked by read_config, then swap
+    previous = common.config
+    io_2.configure_logging(**config["logging"])
+    common.decision_cache.max_entries = config["permissions"]["cache_size"]
+    common.decision_cache.ttl = config["permissions"]["cache_ttl"]
+    if config["rate_limits"] != previous.get("rate_limits"):
+        common.rate_limiter.configure(settings=config["rate_limits"])
+    common.config = config
+
+    # Log
+    restart = [section for section in RESTART_SECTIONS if config[section] != previous.get(section)]
+    restart += [f"{section}.{key}" for section, keys in RESTART_SETTINGS.items() for key in keys
+                if config[section].get(key) != previous.get(section, {}).get(key)]
+    io_2.log(ticker="reload",
+             message="Reloaded config." + (" Changes to {} apply after a restart." if restart else ""),
+             args=(", ".join(restart),) if restart else ())
+    return True
+
+
+async def reload_data() -> bool:
+
+    # FUNCTION: Swap in data.json if it validates, skipping the bot's own compactions (see journal.Journal)
+
+    # RETURNS:
+    #   * handled: bool: False if a compaction is still running, so the change is looked at again later
+
+    store = common.store
+    if store.compactor is not None and store.compactor.is_alive():
+        return False
+    if io_2.source_key(file_paths=[store.snapshot_path]) == store.snapshot_key:
+        return True
+
+    # Read with the journal held still, then apply the changes not yet written on top
+    async with store.writing:
+        try:
+            data = await asyncio.get_running_loop().run_in_executor(None, read_data, store)
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            io_2.log(ticker="reload",
+                     message="Data file could not be used ({}). Keeping the current data.",
+                     args=(error,),
+                     level=io_2.WARN)
+            return True
+        state.replace(data=data)
+        for line, future in store.pending:
+            state.receive(record=json.loads(line))
+
+    io_2.log(ticker="reload",
+             message="Reloaded data ({} streams).",
+             args=(len(common.data["streams"]),))
+    return True
+
+
+async def on_change(file_path: str) -> bool:
+
+    # FUNCTION: Watcher callback, reloading whichever file changed
+
+    # PARAMS:
+    #   * file_path: str: Changed file
+
+    # RETURNS:
+    #   * handled: bool: Whether the change was dealt with
+
+    if file_path == loader.CONFIG_PATH:
+        return await reload_config()
+    return await reload_data()
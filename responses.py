@@ -0,0 +1,229 @@
+# FILE: Per-interaction response collection. Commands add the embeds they produce to a collector, which sends
+# them in as few messages as Discord allows once the command returns, deferring if the command runs long.
+
+
+# DEPENDENCIES
+import asyncio
+
+
+# CONSTANTS
+MAX_EMBEDS = 10  # Embeds per message
+MAX_EMBED_CHARACTERS = 6000  # Total characters across a message's embeds
+
+
+# CLASSES
+class ResponseCollector:
+
+    # CLASS: Gathers the embeds, file and view a command responds with, and sends them together in one response
+    # (or a few, if over Discord's per-message limits). Defers the interaction if nothing is sent before the deadline.
+
+    def __init__(self,
+                 ctx: "discord.ApplicationContext",
+                 defer_after: float = 2.0) -> None:
+
+        # PARAMS:
+        #   * ctx: discord.ApplicationContext: Command context
+        #   * defer_after: float: Seconds after which to defer, inside Discord's 3 second interaction deadline
+
+        self.ctx = ctx
+        self.defer_after = defer_after
+        self.embeds = []
+        self.file = None
+        self.view = None
+        self.timer = None  # Handle for the automatic defer
+        self.deferring = None  # Task deferring the interaction
+
+    def start(self) -> None:
+
+        # FUNCTION: Start the deadline timer. Must be called inside the running loop.
+
+        self.timer = asyncio.get_running_loop().call_later(self.defer_after, self.defer_soon)
+
+    def add(self,
+            embed: "discord.Embed" = None,
+            file: "discord.File" = None,
+            view: "discord.ui.View" = None) -> None:
+
+        # FUNCTION: Add to the response
+
+        # PARAMS:
+        #   * embed: discord.Embed: Embed to send
+        #   * file: discord.File: Attachment, sent with the last message
+        #   * view: discord.ui.View: Components, sent with the last message
+
+        if embed is not None:
+            self.embeds.append(embed)
+        if file is not None:
+            self.file = file
+        if view is not None:
+            self.view = view
+
+    def defer_soon(self) -> None:
+
+        # FUNCTION: Timer callback, deferring without blocking the loop
+
+        self.timer = None
+        self.deferring = asyncio.get_running_loop().create_task(self.defer())
+
+    async def defer(self) -> None:
+
+        # FUNCTION: Defer the interaction if no response has been sent, e.g. before long work
+
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.deferring is not None and self.deferring is not asyncio.current_task():
+            await self.deferring
+        elif not self.ctx.interaction.response.is_done():
+            await self.ctx.defer()
+
+    async def flush(self) -> int:
+
+        # FUNCTION: Send everything collected
+
+        # RETURNS:
+        #   * messages: int: Number of messages sent
+
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if self.deferring is not None:
+            await self.deferring
+
+        messages = chunk_embeds(embeds=self.embeds)
+        if not messages and (self.file is not None or self.view is not None):
+            messages = [[]]
+        for index, embeds in enumerate(messages):
+            extra = {"embeds": embeds} if embeds else {}
+            if index == len(messages) - 1:
+                if self.file is not None:
+                    extra["file"] = self.file
+                if self.view is not None:
+                    extra["view"] = self.view
+            await self.ctx.respond(**extra)
+        self.embeds = []
+        self.file = None
+        self.view = None
+        return len(messages)
+
+    async def fail(self,
+                   embed: "discord.Embed") -> int:
+
+        # FUNCTION: Tell the user the command failed, sending anything still collected with it. Sent as a followup if
+        # the interaction was deferred or already answered, so a command that fails after deferring is not left
+        # "thinking".
+
+        # PARAMS:
+        #   * embed: discord.Embed: Error embed
+
+        # RETURNS:
+        #   * messages: int: Number of messages sent
+
+        self.add(embed=embed)
+        return await self.flush()
+
+
+# FUNCTIONS
+def chunk_embeds(embeds: list) -> list[list]:
+
+    # FUNCTION: Split embeds into messages within the embed count and total character limits
+
+    # PARAMS:
+    #   * embeds: list[discord.Embed]: Embeds, in order
+
+    # RETURNS:
+    #   * messages: list[list[discord.Embed]]: Embeds for each message
+
+    messages = []
+    current = []
+    characters = 0
+    for embed in embeds:
+        size = len(embed)
+        if current and (len(current) == MAX_EMBEDS or characters + size > MAX_EMBED_CHARACTERS):
+            messages.append(current)
+            current = []
+            characters = 0
+        current.append(embed)
+        characters += size
+    if current:
+        messages.append(current)
+    return messages
+
+
+async def respond(ctx: "discord.ApplicationContext",
+                  embed: "discord.Embed" = None,
+                  file: "discord.File" = None,
+                  view: "discord.ui.View" = None) -> None:
+
+    # FUNCTION: Add to the command's response, or send it straight away if the command has no collector
+
+    # PARAMS:
+    #   * ctx: discord.ApplicationContext: Command context
+    #   * embed: discord.Embed: Embed to send
+    #   * file: discord.File: Attachment
+    #   * view: discord.ui.View: Components
+
+    collector = getattr(ctx, "collector", None)
+    if collector is not None:
+        collector.add(embed=embed,
+                      file=file,
+                      view=view)
+        return
+    extra = {key: value for key, value in (("embed", embed), ("file", file), ("view", view)) if value is not None}
+    await ctx.respond(**extra)
+
+
+# TESTING
+if __name__ == "__main__":
+    import discord
+
+    class FakeResponse:
+        def __init__(self) -> None:
+            self.done = False
+
+        def is_done(self) -> bool:
+            return self.done
+
+    class FakeContext:
+        def __init__(self) -> None:
+            self.interaction = type("Interaction", (), {"response": FakeResponse()})()
+            self.calls = []
+
+        async def defer(self) -> None:
+            self.interaction.response.done = True
+            self.calls.append("defer")
+
+        async def respond(self, **kwargs) -> None:
+            self.interaction.response.done = True
+            self.calls.append(len(kwargs.get("embeds", [])))
+
+    async def main() -> None:
+
+        # Admin override plus result: one call instead of two
+        ctx = FakeContext()
+        collector = ResponseCollector(ctx=ctx)
+        collector.start()
+        collector.add(embed=discord.Embed(title="Admin override"))
+        collector.add(embed=discord.Embed(title="Stream created"))
+        print(f"fast command: {await collector.flush()} message(s), calls {ctx.calls}")
+
+        # Slow command with many embeds: deferred, then split at the limits
+        ctx = FakeContext()
+        collector = ResponseCollector(ctx=ctx,
+                                      defer_after=0.05)
+        collector.start()
+        for index in range(12):
+            collector.add(embed=discord.Embed(title=str(index), description="x" * 500))
+        await asyncio.sleep(0.1)
+        print(f"slow command: {await collector.flush()} message(s), calls {ctx.calls}")
+
+        # Command that defers, then raises with nothing collected: the error still reaches the user
+        ctx = FakeContext()
+        collector = ResponseCollector(ctx=ctx)
+        collector.start()
+        await collector.defer()
+        flushed = await collector.flush()
+        print(f"failed command: {flushed} + {await collector.fail(embed=discord.Embed(title='Error'))} message(s), "
+              f"calls {ctx.calls}")
+
+    asyncio.run(main())
@@ -0,0 +1,342 @@
+# FILE: Scheduled and recurring announcements
+
+
+# DEPENDENCIES
+import asyncio
+import heapq
+import itertools
+import os
+import secrets
+import time
+from typing import Awaitable, Callable
+
+import io_2
+import journal
+
+
+# CLASSES
+class ScheduleLog(journal.GroupCommitter):
+
+    # CLASS: Append-only log of schedule changes, fsynced in groups. Rewritten from the live schedules
+    # once it holds many more records than there are schedules.
+
+    def __init__(self,
+                 file_path: str,
+                 group_commit_interval: float = 0.005) -> None:
+
+        # PARAMS:
+        #   * file_path: str: Path to schedule log
+        #   * group_commit_interval: float: Seconds to gather records before each fsync
+
+        super().__init__(group_commit_interval=group_commit_interval)
+        self.file_path = file_path
+        self.file = None
+        self.records = 0
+        self.rewrite_lines = None  # Records to rewrite the log with before the next write
+
+    def open(self,
+             lines: list[bytes]) -> None:
+
+        # FUNCTION: Rewrite the log with the given records and open it for appending
+
+        # PARAMS:
+        #   * lines: list[bytes]: Encoded records
+
+        if self.file is not None:
+            self.file.close()
+        with open(f"{self.file_path}.tmp", "wb") as file:
+            file.write(b"".join(lines))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(f"{self.file_path}.tmp", self.file_path)
+        self.file = open(self.file_path, "ab")
+        self.records = len(lines)
+
+    def write(self,
+              lines: list[bytes]) -> None:
+
+        # FUNCTION: Append records and fsync, rewriting the log first if a rewrite is due
+
+        # PARAMS:
+        #   * lines: list[bytes]: Encoded records
+
+        if self.rewrite_lines is not None:
+            self.open(lines=self.rewrite_lines)
+            self.rewrite_lines = None
+        self.file.write(b"".join(lines))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.records += len(lines)
+
+
+class Scheduler:
+
+    # CLASS: Runs scheduled announcements from one sleeper task over a min-heap keyed by fire time.
+    # Cancelled and rescheduled entries are left in the heap and skipped when they reach the top.
+
+    def __init__(self,
+                 file_path: str,
+                 fire: Callable[[dict], Awaitable[None]],
+                 group_commit_interval: float = 0.005) -> None:
+
+        # PARAMS:
+        #   * file_path: str: Path to schedule log, next to data.json
+        #   * fire: Callable[[dict], Awaitable[None]]: Sends a due announcement
+        #   * group_commit_interval: float: Seconds to gather changes before each fsync
+
+        self.log = ScheduleLog(file_path=file_path,
+                               group_commit_interval=group_commit_interval)
+        self.fire = fire
+        self.entries = {}  # Id -> schedule
+        self.heap = []  # (fire time, sequence, id)
+        self.sequence = itertools.count()
+        self.wakeup = asyncio.Event()
+        self.sleeper = None
+        self.firing = set()  # Announcements being sent
+
+    def load(self) -> int:
+
+        # FUNCTION: Read schedules from the log and compact it. Overdue schedules fire once the sleeper starts.
+
+        # RETURNS:
+        #   * count: int: Number of pending schedules
+
+        for record in journal.read_records(file_path=self.log.file_path):
+            if record["op"] == "add":
+                self.entries[record["entry"]["id"]] = record["entry"]
+            elif record["op"] == "cancel":
+                self.entries.pop(record["id"], None)
+            elif record["op"] == "fired" and record["id"] in self.entries:
+                self.entries[record["id"]]["at"] = record["at"]
+        for entry in self.entries.values():
+            self.push(entry=entry)
+        self.log.open(lines=self.snapshot())
+
+        io_2.log(ticker="scheduler",
+                 message="Loaded {} scheduled announcements",
+                 args=(len(self.entries),))
+        return len(self.entries)
+
+    def snapshot(self) -> list[bytes]:
+
+        # FUNCTION: Encode the live schedules as log records
+
+        # RETURNS:
+        #   * lines: list[bytes]: One add record per schedule
+
+        return [journal.encode(record={"op": "add", "entry": entry}) for entry in self.entries.values()]
+
+    def start(self) -> None:
+
+        # FUNCTION: Start the sleeper task if it is not running. Must be called inside the running loop.
+
+        if self.sleeper is None or self.sleeper.done():
+            self.sleeper = asyncio.get_running_loop().create_task(self.run())
+
+    def push(self,
+             entry: dict) -> None:
+
+        # FUNCTION: Put a schedule on the heap, waking the sleeper if it is now the earliest
+
+        # PARAMS:
+        #   * entry: dict: Schedule
+
+        earliest = self.heap[0][0] if self.heap else None
+        heapq.heappush(self.heap, (entry["at"], next(self.sequence), entry["id"]))
+        if earliest is None or entry["at"] < earliest:
+            self.wakeup.set()
+
+    async def add(self,
+                  stream: str,
+                  title: str,
+                  message: str,
+                  at: float,
+                  interval: float = 0,
+                  author: str = "") -> dict:
+
+        # FUNCTION: Schedule an announcement
+
+        # PARAMS:
+        #   * stream: str: Stream to announce to
+        #   * title: str: Announcement title
+        #   * message: str: Announcement text
+        #   * at: float: Unix time to send at
+        #   * interval: float: Seconds between repeats, or 0 to send once
+        #   * author: str: ID of user who scheduled it
+
+        # RETURNS:
+        #   * entry: dict: The new schedule
+
+        entry = {
+            "id": secrets.token_hex(4),
+            "stream": stream,
+            "title": title,
+            "message": message,
+            "at": at,
+            "interval": interval,
+            "author": author
+        }
+        self.entries[entry["id"]] = entry
+        self.push(entry=entry)
+        await self.persist(record={"op": "add", "entry": entry})
+        return entry
+
+    async def cancel(self,
+                     entry_id: str) -> dict:
+
+        # FUNCTION: Cancel a schedule. Its heap item is skipped once it reaches the top.
+
+        # PARAMS:
+        #   * entry_id: str: Schedule ID
+
+        # RETURNS:
+        #   * entry: dict: The cancelled schedule, or None if there was none
+
+        entry = self.entries.pop(entry_id, None)
+        if entry is None:
+            return None
+        self.trim()
+        await self.persist(record={"op": "cancel", "id": entry_id})
+        return entry
+
+    async def cancel_stream(self,
+                            stream: str) -> list[dict]:
+
+        # FUNCTION: Cancel every schedule for a stream, e.g. once it is deleted
+
+        # PARAMS:
+        #   * stream: str: Stream name
+
+        # RETURNS:
+        #   * entries: list[dict]: The cancelled schedules
+
+        entries = [entry for entry in self.entries.values() if entry["stream"] == stream]
+        for entry in entries:
+            del self.entries[entry["id"]]
+        if entries:
+            self.trim()
+            await asyncio.gather(*(self.persist(record={"op": "cancel", "id": entry["id"]}) for entry in entries))
+        return entries
+
+    def upcoming(self,
+                 limit: int = 20) -> list[dict]:
+
+        # FUNCTION: Get the next schedules to fire
+
+        # PARAMS:
+        #   * limit: int: Maximum number of schedules
+
+        # RETURNS:
+        #   * entries: list[dict]: Schedules, soonest first
+
+        return heapq.nsmallest(limit, self.entries.values(), key=lambda entry: entry["at"])
+
+    async def persist(self,
+                      record: dict) -> None:
+
+        # FUNCTION: Log a change, rewriting the log first once it is mostly dead records
+
+        # PARAMS:
+        #   * record: dict: Schedule change
+
+        if self.log.records > 2 * len(self.entries) + 1000 and self.log.rewrite_lines is None:
+            self.log.rewrite_lines = self.snapshot()
+        await self.log.append(record=record)
+
+    def trim(self) -> None:
+
+        # FUNCTION: Rebuild the heap once it is mostly cancelled items
+
+        if len(self.heap) > 2 * len(self.entries) + 64:
+            self.heap = [(entry["at"], next(self.sequence), entry["id"]) for entry in self.entries.values()]
+            heapq.heapify(self.heap)
+
+    async def run(self) -> None:
+
+        # FUNCTION: Sleeper loop. Sleeps until the earliest schedule is due or a sooner one is added.
+
+        while True:
+
+            # Skip cancelled and rescheduled items
+            while self.heap and (self.heap[0][2] not in self.entries
+                                 or self.entries[self.heap[0][2]]["at"] != self.heap[0][0]):
+                heapq.heappop(self.heap)
+
+            # Sleep until due or woken
+            self.wakeup.clear()
+            delay = self.heap[0][0] - time.time() if self.heap else None
+            if delay is None or delay > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            # Fire
+            at, sequence, entry_id = heapq.heappop(self.heap)
+            entry = self.entries[entry_id]
+            task = asyncio.get_running_loop().create_task(self.send(entry=dict(entry)))
+            self.firing.add(task)
+            task.add_done_callback(self.firing.discard)
+
+            # Reschedule or finish
+            if entry["interval"] > 0:
+                now = time.time()
+                missed = max(0, int((now - entry["at"]) // entry["interval"]))
+                entry["at"] += (missed + 1) * entry["interval"]
+                self.push(entry=entry)
+                await self.persist(record={"op": "fired", "id": entry_id, "at": entry["at"]})
+            else:
+                del self.entries[entry_id]
+                await self.persist(record={"op": "cancel", "id": entry_id})
+
+    async def send(self,
+                   entry: dict) -> None:
+
+        # FUNCTION: Fire one announcement, logging failures instead of stopping the sleeper
+
+        # PARAMS:
+        #   * entry: dict: Due schedule
+
+        try:
+            await self.fire(entry)
+        except Exception as error:
+            io_2.log(ticker="scheduler",
+                     message="Scheduled announcement '{}' failed: {!r}",
+                     args=(entry["id"], error),
+                     level=io_2.ERROR)
+
+
+# TESTING
+if __name__ == "__main__":
+    import tempfile
+
+    async def main() -> None:
+        fired = []
+
+        async def fire(entry: dict) -> None:
+            fired.append(entry["id"])
+
+        directory = tempfile.mkdtemp()
+        schedule = Scheduler(file_path=os.path.join(directory, "schedules.jsonl"),
+                             fire=fire)
+        schedule.load()
+        schedule.start()
+
+        # Many pending schedules, a few due soon, one recurring and one cancelled
+        now = time.time()
+        await asyncio.gather(*(schedule.add(stream="s", title="t", message="m", at=now + 3600 + index)
+                               for index in range(20000)))
+        soon = [await schedule.add(stream="s", title="t", message="m", at=now + 0.05 * index) for index in range(5)]
+        recurring = await schedule.add(stream="s", title="t", message="m", at=now + 0.1, interval=0.1)
+        await schedule.cancel(entry_id=soon[-1]["id"])
+        await asyncio.sleep(0.5)
+        print(f"tasks: {len(asyncio.all_tasks())}, pending: {len(schedule.entries)}, "
+              f"fired: {len(fired)}, recurring fired: {fired.count(recurring['id'])}")
+
+        # Reload from the log
+        reloaded = Scheduler(file_path=schedule.log.file_path,
+                             fire=fire)
+        print(f"reloaded: {reloaded.load()}")
+
+    asyncio.run(main())
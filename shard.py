@@ -0,0 +1,375 @@
+# FILE: Sharded deployment. Runs shard ranges of the bot in several worker processes sharing the SQLite store.
+
+# Usage:
+#   python shard.py [--processes 4] [--shards 8]
+#   python shard.py --fake-gateway [--guilds 100000] [--events 400000] [--processes 1,2,4]
+# Workers are bot.py processes told their shards through RAINDROP_WORKER, RAINDROP_SHARD_IDS and
+# RAINDROP_SHARD_COUNT. Changes made in one worker reach the others through the store's changes table.
+# The fake gateway imports bot.py in each worker and replays synthetic interactions through its permission check and
+# the shared store, without Discord.
+
+
+# DEPENDENCIES
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import io_2
+import loader
+
+
+# CONSTANTS
+WORKER_VARIABLE = "RAINDROP_WORKER"
+SHARD_IDS_VARIABLE = "RAINDROP_SHARD_IDS"
+SHARD_COUNT_VARIABLE = "RAINDROP_SHARD_COUNT"
+
+
+# FUNCTIONS
+def shard_settings() -> (str, list[int], int):
+
+    # FUNCTION: Read this process's shards from the environment
+
+    # RETURNS:
+    #   * worker: str: Worker number, or None if not sharded
+    #   * shard_ids: list[int]: Shards to run, or None if not sharded
+    #   * shard_count: int: Total shards across all workers
+
+    if SHARD_IDS_VARIABLE not in os.environ:
+        return None, None, 1
+    return (os.environ.get(WORKER_VARIABLE, "0"),
+            [int(shard_id) for shard_id in os.environ[SHARD_IDS_VARIABLE].split(",")],
+            int(os.environ[SHARD_COUNT_VARIABLE]))
+
+
+def worker_path(file_path: str,
+                worker: str) -> str:
+
+    # FUNCTION: Give a per-process file its own name in each worker
+
+    # PARAMS:
+    #   * file_path: str: Path, e.g. data/schedules.jsonl
+    #   * worker: str: Worker number, or None if not sharded
+
+    # RETURNS:
+    #   * file_path: str: e.g. data/schedules.worker-1.jsonl, or the path unchanged if not sharded
+
+    if worker is None:
+        return file_path
+    root, extension = os.path.splitext(file_path)
+    return f"{root}.worker-{worker}{extension}"
+
+
+def split_shards(shard_count: int,
+                 processes: int) -> list[list[int]]:
+
+    # FUNCTION: Split shards into contiguous ranges, one per process
+
+    # PARAMS:
+    #   * shard_count: int: Total shards
+    #   * processes: int: Worker processes
+
+    # RETURNS:
+    #   * ranges: list[list[int]]: Shard ids for each process
+
+    processes = max(1, min(processes, shard_count))
+    return [list(range(shard_count * index // processes, shard_count * (index + 1) // processes))
+            for index in range(processes)]
+
+
+def shard_for(guild_id: int,
+              shard_count: int) -> int:
+
+    # FUNCTION: Find which shard the gateway sends a guild's events to
+
+    # PARAMS:
+    #   * guild_id: int: Guild snowflake
+    #   * shard_count: int: Total shards
+
+    # RETURNS:
+    #   * shard_id: int: Shard id
+
+    return (guild_id >> 22) % shard_count
+
+
+def load_settings() -> dict:
+
+    # FUNCTION: Read the sharding section of the config, without the bot's startup side effects
+
+    # RETURNS:
+    #   * settings: dict: Sharding settings
+
+    import common
+    defaults = io_2.read_json(file_path=loader.CONFIG_DEFAULTS_PATH)
+    try:
+        config = common.validate_config(config=io_2.read_json(file_path=loader.CONFIG_PATH),
+                                        defaults=defaults)
+    except (OSError, ValueError, KeyError, TypeError):
+        config = defaults
+    return config["sharding"]
+
+
+def launch(shard_count: int,
+           processes: int,
+           restart_delay: float) -> None:
+
+    # FUNCTION: Run bot.py once per shard range, restarting workers that exit, until interrupted
+
+    # PARAMS:
+    #   * shard_count: int: Total shards
+    #   * processes: int: Worker processes
+    #   * restart_delay: float: Seconds to wait before restarting a worker
+
+    ranges = split_shards(shard_count=shard_count,
+                          processes=processes)
+
+    def start(worker: int) -> subprocess.Popen:
+        io_2.log(ticker="shard",
+                 message="Starting worker {} with shards {}",
+                 args=(worker, ranges[worker]))
+        environment = dict(os.environ)
+        environment[WORKER_VARIABLE] = str(worker)
+        environment[SHARD_IDS_VARIABLE] = ",".join(str(shard_id) for shard_id in ranges[worker])
+        environment[SHARD_COUNT_VARIABLE] = str(shard_count)
+        return subprocess.Popen([sys.executable, "bot.py"], env=environment)
+
+    workers = [start(worker=worker) for worker in range(len(ranges))]
+    try:
+        while True:
+            time.sleep(1.0)
+            for worker, process in enumerate(workers):
+                if process.poll() is not None:
+                    io_2.log(ticker="shard",
+                             message="Worker {} exited with status {}. Restarting in {} seconds...",
+                             args=(worker, process.returncode, restart_delay),
+                             level=io_2.WARN)
+                    time.sleep(restart_delay)
+                    workers[worker] = start(worker=worker)
+    except KeyboardInterrupt:
+        io_2.log(ticker="shard",
+                 message="Stopping {} workers...",
+                 args=(len(workers),))
+        for process in workers:
+            process.terminate()
+        for process in workers:
+            process.wait()
+
+
+def fake_worker(worker: int,
+                shard_ids: list[int],
+                shard_count: int,
+                guild_ids: list[int],
+                workspace: str,
+                write_every: int,
+                results: multiprocessing.Queue,
+                start: multiprocessing.Event) -> None:
+
+    # FUNCTION: Fake gateway worker. Imports bot.py as a worker for its shards and runs each of its guilds'
+    # interactions through the bot's own permission check, without connecting to Discord.
+
+    # PARAMS:
+    #   * worker: int: Worker number
+    #   * shard_ids: list[int]: Shards this worker receives events for
+    #   * shard_count: int: Total shards
+    #   * guild_ids: list[int]: Guilds whose events to replay, in order
+    #   * workspace: str: Directory with the config, sharing one database (see fake_workspace)
+    #   * write_every: int: Interactions per whitelist change
+    #   * results: multiprocessing.Queue: Receives (worker, events, seconds, whitelist)
+    #   * start: multiprocessing.Event: Set once every worker is ready
+
+    # Start up like a worker's bot.py
+    os.chdir(workspace)
+    os.environ[WORKER_VARIABLE] = str(worker)
+    os.environ[SHARD_IDS_VARIABLE] = ",".join(str(shard_id) for shard_id in shard_ids)
+    os.environ[SHARD_COUNT_VARIABLE] = str(shard_count)
+    import bot
+    import common
+    import storage
+
+    class FakeRole:
+        def __init__(self, role_id: int) -> None:
+            self.id = role_id
+
+    class FakeUser:
+        def __init__(self, user_id: int, roles: list[FakeRole]) -> None:
+            self.id = user_id
+            self.roles = roles
+
+    class FakeContext:
+        def __init__(self, command, user: FakeUser, channel_id: int, guild_id: int) -> None:
+            self.command = command
+            self.user = user
+            self.channel_id = channel_id
+            self.guild_id = guild_id
+
+        async def respond(self, **kwargs) -> None:
+            pass
+
+    async def main() -> None:
+        follower = asyncio.get_running_loop().create_task(
+            storage.follow_changes(store=common.store,
+                                   interval=common.config["sharding"]["poll_interval"]))
+        command = next(command for command in bot.client.pending_application_commands if command.name == "about")
+        shards = set(shard_ids)
+        random_source = random.Random(worker)
+        roles = [FakeRole(role_id=random_source.getrandbits(60)) for _ in range(20)]
+        start.wait()
+
+        # Replay events
+        started = time.perf_counter()
+        events = 0
+        for guild_id in guild_ids:
+            if shard_for(guild_id=guild_id, shard_count=shard_count) not in shards:
+                continue  # The gateway would not send this guild's events here
+            await bot.check_allowed(ctx=FakeContext(command=command,
+                                                    user=FakeUser(user_id=random_source.getrandbits(60),
+                                                                  roles=roles),
+                                                    channel_id=guild_id + 1,
+                                                    guild_id=guild_id))
+            events += 1
+            if events % write_every == 0:
+                await common.list_writer.submit(list_name="whitelist",
+                                                snowflakes=[guild_id])
+        seconds = time.perf_counter() - started
+
+        # Wait for the other workers' changes
+        await asyncio.sleep(1.0)
+        follower.cancel()
+        results.put((worker, events, seconds, sorted(common.acl_index.whitelist)))
+        common.store.close()
+
+    asyncio.run(main())
+
+
+def fake_workspace() -> str:
+
+    # FUNCTION: Make a directory for fake gateway workers to run bot.py in, with a config for a shared database at
+    # data/data.sqlite3
+
+    # RETURNS:
+    #   * workspace: str: Directory
+
+    workspace = tempfile.mkdtemp(prefix="raindrop-shard-")
+    shutil.copytree(os.path.join(os.path.dirname(os.path.abspath(__file__)), "defaults"),
+                    os.path.join(workspace, "defaults"))
+    config = io_2.read_json(file_path=os.path.join(workspace, loader.CONFIG_DEFAULTS_PATH))
+    config["storage"].update(backend="sqlite",
+                             sqlite_path="data/data.sqlite3")
+    config["sharding"]["poll_interval"] = 0.05
+    config["logging"].update(level="WARN",
+                             tickers={})
+    config["reload"]["poll_interval"] = 0
+    config["rate_limits"]["user"]["rate"] = config["rate_limits"]["guild"]["rate"] = 0
+    for directory in ("config", "data", "logs", "secret"):
+        os.makedirs(os.path.join(workspace, directory))
+    for file_path, content in ((loader.CONFIG_PATH, config),
+                               ("secret/api_key.json", {"bot_token": ""})):
+        with open(os.path.join(workspace, file_path), "w") as file:
+            json.dump(content, file)
+    return workspace
+
+
+def fake_gateway(guilds: int,
+                 events: int,
+                 processes: int,
+                 shard_count: int,
+                 write_every: int) -> dict:
+
+    # FUNCTION: Replay synthetic interactions across worker processes through the shared store
+
+    # PARAMS:
+    #   * guilds: int: Number of guilds
+    #   * events: int: Total interactions across all shards
+    #   * processes: int: Worker processes
+    #   * shard_count: int: Total shards
+    #   * write_every: int: Interactions per whitelist change
+
+    # RETURNS:
+    #   * result: dict: events_per_sec, seconds and whether every worker ended with the same whitelist
+
+    import storage
+
+    # Shared database, in a directory the workers run bot.py in
+    workspace = fake_workspace()
+    database_path = os.path.join(workspace, "data/data.sqlite3")
+    storage.SQLiteStore(file_path=database_path).close()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    # Events, spread over guilds like gateway traffic
+    random_source = random.Random(0)
+    guild_pool = [random_source.randrange(10 ** 17, 2 ** 63) for _ in range(guilds)]
+    guild_ids = [random_source.choice(guild_pool) for _ in range(events)]
+
+    # Run workers
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    start = context.Event()
+    ranges = split_shards(shard_count=shard_count,
+                          processes=processes)
+    workers = [context.Process(target=fake_worker,
+                               args=(worker, shard_ids, shard_count, guild_ids, workspace, write_every,
+                                     results, start))
+               for worker, shard_ids in enumerate(ranges)]
+    for process in workers:
+        process.start()
+    time.sleep(0.5)
+    start.set()
+    reports = [results.get() for _ in workers]
+    for process in workers:
+        process.join()
+
+    # Summarize
+    handled = sum(report[1] for report in reports)
+    seconds = max(report[2] for report in reports)
+    whitelists = {tuple(report[3]) for report in reports}
+    stored = storage.SQLiteStore(file_path=database_path)
+    expected = tuple(sorted(int(snowflake) for snowflake in stored.load()["whitelist"]))
+    stored.close()
+    return {
+        "processes": len(workers),
+        "events": handled,
+        "seconds": seconds,
+        "events_per_sec": handled / seconds,
+        "consistent": whitelists == {expected},
+        "whitelist": len(expected)
+    }
+
+
+# MAIN
+if __name__ == "__main__":
+
+    # Parse arguments
+    settings = load_settings()
+    parser = argparse.ArgumentParser(description="Run the bot as several sharded worker processes.")
+    parser.add_argument("--processes", default=str(settings["processes"] or os.cpu_count()),
+                        help="Worker processes. With --fake-gateway, a comma separated list to compare")
+    parser.add_argument("--shards", type=int, default=settings["shard_count"], help="Total shards")
+    parser.add_argument("--fake-gateway", action="store_true", help="Replay synthetic interactions instead")
+    parser.add_argument("--guilds", type=int, default=100_000, help="Guilds for the fake gateway")
+    parser.add_argument("--events", type=int, default=400_000, help="Interactions for the fake gateway")
+    parser.add_argument("--write-every", type=int, default=2000, help="Interactions per change")
+    arguments = parser.parse_args()
+
+    # Run
+    if arguments.fake_gateway:
+        for processes in arguments.processes.split(","):
+            result = fake_gateway(guilds=arguments.guilds,
+                                  events=arguments.events,
+                                  processes=int(processes),
+                                  shard_count=max(arguments.shards, int(processes)),
+                                  write_every=arguments.write_every)
+            print(f"{result['processes']} processes: {result['events_per_sec']:.0f} events/sec "
+                  f"({result['events']} events in {result['seconds']:.2f} s), "
+                  f"{result['whitelist']} changes, consistent: {result['consistent']}")
+        io_2.update_log_file()
+    else:
+        launch(shard_count=arguments.shards,
+               processes=int(arguments.processes),
+               restart_delay=settings["restart_delay"])
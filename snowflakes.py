@@ -0,0 +1,186 @@
+# FILE: Integer snowflake ids. Data is held with ids as ints in memory, with id lists as plain sets so permission
+# checks stay a few hash lookups in C; records, data.json and the database keep them as decimal strings, so ids are
+# converted when data is loaded and when records are applied (see state).
+
+
+# DEPENDENCIES
+from typing import Iterable
+
+
+# CONSTANTS
+MAX_SNOWFLAKE = 2 ** 64 - 1
+
+
+# FUNCTIONS
+def parse(value) -> int:
+
+    # FUNCTION: Convert an id from Discord or json to an int
+
+    # PARAMS:
+    #   * value: int or str: Id
+
+    # RETURNS:
+    #   * snowflake: int: Id, or None if it is not a valid snowflake
+
+    if type(value) is int:
+        return value if 0 <= value <= MAX_SNOWFLAKE else None
+    if isinstance(value, str) and value.isascii() and value.isdigit() and int(value) <= MAX_SNOWFLAKE:
+        return int(value)
+    return None
+
+
+def parse_all(values: Iterable) -> list[int]:
+
+    # FUNCTION: Convert ids to ints, leaving out any that are not snowflakes (e.g. the defaults' placeholders)
+
+    # PARAMS:
+    #   * values: Iterable: Ids
+
+    # RETURNS:
+    #   * snowflakes: list[int]: Valid ids
+
+    snowflakes = []
+    for value in values:
+        snowflake = parse(value=value)
+        if snowflake is not None:
+            snowflakes.append(snowflake)
+    return snowflakes
+
+
+def unpack_stream(stream: dict) -> dict:
+
+    # FUNCTION: Convert a stream from the json layout to the in-memory layout
+
+    # PARAMS:
+    #   * stream: dict: Stream with string ids
+
+    # RETURNS:
+    #   * stream: dict: New stream with int ids, and sets for the id lists
+
+    origin_server = parse(value=stream["origin_server"])
+    return {
+        **stream,
+        "origin_server": stream["origin_server"] if origin_server is None else origin_server,
+        "channels": parse_all(values=stream["channels"]),
+        "whitelist": set(parse_all(values=stream.get("whitelist", []))),
+        "blacklist": set(parse_all(values=stream.get("blacklist", [])))
+    }
+
+
+def unpack_data(data: dict) -> dict:
+
+    # FUNCTION: Convert data from the json layout to the in-memory layout
+
+    # PARAMS:
+    #   * data: dict: Data with string ids, e.g. from data.json
+
+    # RETURNS:
+    #   * data: dict: New data with int ids, and sets for the id lists
+
+    unpacked = dict(data)
+    unpacked["streams"] = {name: unpack_stream(stream=stream) for name, stream in data["streams"].items()}
+    for list_name in ("whitelist", "blacklist", "admins"):
+        unpacked[list_name] = set(parse_all(values=data.get(list_name, [])))
+    return unpacked
+
+
+def pack_stream(stream: dict) -> dict:
+
+    # FUNCTION: Convert a stream to the json layout
+
+    # PARAMS:
+    #   * stream: dict: Stream with int or string ids
+
+    # RETURNS:
+    #   * stream: dict: New stream with string ids
+
+    return {
+        **stream,
+        "origin_server": str(stream["origin_server"]),
+        "channels": [str(channel) for channel in stream["channels"]],
+        "whitelist": [str(snowflake) for snowflake in stream.get("whitelist", [])],
+        "blacklist": [str(snowflake) for snowflake in stream.get("blacklist", [])]
+    }
+
+
+def pack_record(record: dict) -> dict:
+
+    # FUNCTION: Convert the ids in a change record to strings, for persisting
+
+    # PARAMS:
+    #   * record: dict: Record with int or string ids
+
+    # RETURNS:
+    #   * record: dict: New record with string ids
+
+    packed = dict(record)
+    if "snowflake" in record:
+        packed["snowflake"] = str(record["snowflake"])
+    if "channel" in record:
+        packed["channel"] = str(record["channel"])
+    if "snowflakes" in record:
+        packed["snowflakes"] = [str(snowflake) for snowflake in record["snowflakes"]]
+    if "stream" in record:
+        packed["stream"] = pack_stream(stream=record["stream"])
+    return packed
+
+
+def unpack_record(record: dict) -> dict:
+
+    # FUNCTION: Convert the ids in a change record to ints (see state.apply)
+
+    # PARAMS:
+    #   * record: dict: Record with string ids, as persisted
+
+    # RETURNS:
+    #   * record: dict: New record with int ids
+
+    # RAISES:
+    #   * ValueError: If an id is not a snowflake
+
+    unpacked = dict(record)
+    if "snowflake" in record:
+        unpacked["snowflake"] = int(record["snowflake"])
+    if "channel" in record:
+        unpacked["channel"] = int(record["channel"])
+    if "snowflakes" in record:
+        unpacked["snowflakes"] = [int(snowflake) for snowflake in record["snowflakes"]]
+    if "stream" in record:
+        unpacked["stream"] = unpack_stream(stream=record["stream"])
+    return unpacked
+
+
+# TESTING
+if __name__ == "__main__":
+    import random
+    import timeit
+    import tracemalloc
+
+    def measure_memory(build) -> int:
+        tracemalloc.start()
+        kept = build()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del kept
+        return size
+
+    for size in (10 ** 4, 10 ** 5, 10 ** 6):
+        random.seed(size)
+        ids = [random.randrange(10 ** 17, 2 ** 63) for _ in range(size)]
+        strings = [str(snowflake) for snowflake in ids]
+        queries = [random.randrange(10 ** 17, 2 ** 63) for _ in range(53)]  # 50 roles, user, channel, server
+        query_strings = [str(snowflake) for snowflake in queries]
+
+        # Before: the list in data plus its set in the ACL index, both of strings
+        before = measure_memory(lambda: (list(str(snowflake) for snowflake in ids),
+                                         set(str(snowflake) for snowflake in ids)))
+        after = measure_memory(lambda: set(ids))
+
+        string_set = set(strings)
+        snowflake_set = set(ids)
+        number = 20_000
+        string_time = min(timeit.repeat(lambda: string_set.isdisjoint(query_strings), number=number, repeat=5))
+        snowflake_time = min(timeit.repeat(lambda: snowflake_set.isdisjoint(queries), number=number, repeat=5))
+        print(f"{size} ids: {before / size:.1f} -> {after / size:.1f} bytes per id, "
+              f"53-id check {string_time / number * 1e6:.2f} -> {snowflake_time / number * 1e6:.2f} us")
+
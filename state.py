@@ -0,0 +1,195 @@
+# FILE: State mutations. Every change to common.data goes through a record applied here.
+# Records are persisted with string ids, as in data.json. common.data holds ids as ints, so records are
+# unpacked before they are applied to it (see snowflakes).
+
+
+# DEPENDENCIES
+import copy
+
+import common
+import snowflakes
+
+
+# VARIABLES
+listeners = []  # Called with each record after it is applied, to keep indexes in sync
+rebuilders = []  # Called with the data after it is replaced wholesale, to rebuild indexes
+
+
+# FUNCTIONS
+def apply(data: dict,
+          record: dict) -> None:
+
+    # FUNCTION: Apply a change record to data. Records are idempotent, so replaying one twice is harmless.
+    # Works on data in the json layout with a persisted record, or the in-memory layout with an unpacked record.
+
+    # PARAMS:
+    #   * data: dict: Bot data to change
+    #   * record: dict: Change record, with the change type in "op"
+
+    op = record["op"]
+    streams = data["streams"]
+
+    # Stream changes
+    if op == "stream_create":
+        streams[record["name"]] = copy.deepcopy(record["stream"])
+    elif op == "stream_delete":
+        streams.pop(record["name"], None)
+
+    # Subscription changes
+    elif op == "subscribe":
+        add_unique(items=streams[record["name"]]["channels"],
+                   item=record["channel"])
+    elif op == "unsubscribe":
+        remove_present(items=streams[record["name"]]["channels"],
+                       item=record["channel"])
+
+    # Stream whitelist changes
+    elif op == "authorize":
+        add_unique(items=streams[record["name"]].setdefault("whitelist", []),
+                   item=record["snowflake"])
+    elif op == "unauthorize":
+        remove_present(items=streams[record["name"]].setdefault("whitelist", []),
+                       item=record["snowflake"])
+
+    # Global list changes
+    elif op == "list_add":
+        add_unique(items=data[record["list"]],
+                   item=record["snowflake"])
+    elif op == "list_remove":
+        remove_present(items=data[record["list"]],
+                       item=record["snowflake"])
+    elif op == "list_add_many":
+        add_all(items=data[record["list"]],
+                new_items=record["snowflakes"])
+    elif op == "list_remove_many":
+        remove_all(items=data[record["list"]],
+                   removed_items=record["snowflakes"])
+
+    else:
+        raise ValueError(f"Unknown record op '{op}'")
+
+
+def add_unique(items,
+               item) -> None:
+
+    # FUNCTION: Append to a list unless already present, or add to a set
+
+    # PARAMS:
+    #   * items: list or set: Items to add to
+    #   * item: str or int: Item to add
+
+    if not isinstance(items, list):
+        items.add(item)
+    elif item not in items:
+        items.append(item)
+
+
+def remove_present(items,
+                   item) -> None:
+
+    # FUNCTION: Remove from a list or set if present
+
+    # PARAMS:
+    #   * items: list or set: Items to remove from
+    #   * item: str or int: Item to remove
+
+    if not isinstance(items, list):
+        items.discard(item)
+    elif item in items:
+        items.remove(item)
+
+
+def add_all(items,
+            new_items: list) -> None:
+
+    # FUNCTION: Add many items to a list or set, skipping those already present
+
+    # PARAMS:
+    #   * items: list or set: Items to add to
+    #   * new_items: list: Items to add
+
+    if not isinstance(items, list):
+        items.update(new_items)
+        return
+    present = set(items)
+    items.extend(item for item in new_items if item not in present)
+
+
+def remove_all(items,
+               removed_items: list) -> None:
+
+    # FUNCTION: Remove many items from a list or set
+
+    # PARAMS:
+    #   * items: list or set: Items to remove from
+    #   * removed_items: list: Items to remove
+
+    if not isinstance(items, list):
+        items.difference_update(removed_items)
+        return
+    removed = set(removed_items)
+    items[:] = [item for item in items if item not in removed]
+
+
+def receive(record: dict) -> None:
+
+    # FUNCTION: Apply a change already persisted by another process
+
+    # PARAMS:
+    #   * record: dict: Change record, as persisted
+
+    unpacked = snowflakes.unpack_record(record=record)
+    apply(data=common.data,
+          record=unpacked)
+    for listener in listeners:
+        listener(unpacked)
+
+
+def replace(data: dict) -> None:
+
+    # FUNCTION: Swap in freshly loaded data, keeping the common.data object so held references stay valid
+
+    # PARAMS:
+    #   * data: dict: Bot data, in the json layout
+
+    common.data.clear()
+    common.data.update(snowflakes.unpack_data(data=data))
+    for listener in rebuilders:
+        listener(common.data)
+
+
+def stage(record: dict) -> dict:
+
+    # FUNCTION: Apply a change to common.data in memory, without persisting it
+
+    # PARAMS:
+    #   * record: dict: Change record, with ids as ints or strings
+
+    # RETURNS:
+    #   * persisted: dict: The record as it is persisted, for common.store.append
+
+    persisted = snowflakes.pack_record(record=record)
+    unpacked = snowflakes.unpack_record(record=persisted)
+    apply(data=common.data,
+          record=unpacked)
+    for listener in listeners:
+        listener(unpacked)
+    return persisted
+
+
+async def commit(record: dict) -> None:
+
+    # FUNCTION: Apply a change to common.data and wait until it is durable. If persisting fails, the change stays
+    # applied in memory, the store is marked unhealthy (see journal.GroupCommitter) and the error is raised.
+
+    # PARAMS:
+    #   * record: dict: Change record, with ids as ints or strings
+
+    # RAISES:
+    #   * Exception: Whatever the store raised if the change could not be persisted
+
+    # Apply in memory, before any await so checks made by the caller still hold
+    persisted = stage(record=record)
+
+    # Persist
+    await common.store.append(record=persisted)
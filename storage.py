@@ -0,0 +1,443 @@
+# FILE: SQLite storage backend for streams, subscriptions and ACL lists
+
+
+# DEPENDENCIES
+import asyncio
+import json
+import sqlite3
+import sys
+import time
+
+import common
+import io_2
+import journal
+import state
+
+
+# CONSTANTS
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS streams (
+    name TEXT PRIMARY KEY,
+    locked TEXT NOT NULL,
+    origin_server TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS streams_origin_server ON streams (origin_server);
+
+CREATE TABLE IF NOT EXISTS stream_channels (
+    stream TEXT NOT NULL REFERENCES streams (name) ON DELETE CASCADE,
+    channel TEXT NOT NULL,
+    UNIQUE (stream, channel)
+);
+CREATE INDEX IF NOT EXISTS stream_channels_channel ON stream_channels (channel);
+
+CREATE TABLE IF NOT EXISTS stream_lists (
+    stream TEXT NOT NULL REFERENCES streams (name) ON DELETE CASCADE,
+    list TEXT NOT NULL CHECK (list IN ('whitelist', 'blacklist')),
+    snowflake TEXT NOT NULL,
+    UNIQUE (stream, list, snowflake)
+);
+CREATE INDEX IF NOT EXISTS stream_lists_snowflake ON stream_lists (snowflake);
+
+CREATE TABLE IF NOT EXISTS global_lists (
+    list TEXT NOT NULL CHECK (list IN ('whitelist', 'blacklist', 'admins')),
+    snowflake TEXT NOT NULL,
+    UNIQUE (list, snowflake)
+);
+
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    origin TEXT NOT NULL,
+    created REAL NOT NULL,
+    record TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS changes_created ON changes (created);
+"""
+
+GLOBAL_LISTS = ("whitelist", "blacklist", "admins")
+STREAM_LISTS = ("whitelist", "blacklist")
+
+
+# CLASSES
+class SQLiteStore(journal.GroupCommitter):
+
+    # CLASS: Stores data in SQLite (WAL mode). Records are applied as SQL in one transaction per group commit,
+    # so it takes the place of the journal behind state.commit.
+    # With an origin, each record is also published to the changes table, so other processes sharing the
+    # database (shard workers, see shard.py) can follow it.
+
+    def __init__(self,
+                 file_path: str,
+                 group_commit_interval: float = 0.005,
+                 synchronous: str = "FULL",
+                 origin: str = None,
+                 change_retention: float = 3600.0) -> None:
+
+        # PARAMS:
+        #   * file_path: str: Path to database
+        #   * group_commit_interval: float: Seconds to gather records before each transaction
+        #   * synchronous: str: SQLite synchronous pragma. FULL keeps acknowledged changes through power loss.
+        #   * origin: str: Name of this process in the changes table, or None to not publish changes
+        #   * change_retention: float: Seconds published changes are kept for followers
+
+        super().__init__(group_commit_interval=group_commit_interval)
+        self.file_path = file_path
+        self.origin = origin
+        self.change_retention = change_retention
+        self.last_change = 0  # Sequence number of the last change seen
+        self.last_prune = 0.0
+        self.connection = connect(file_path=file_path,
+                                  synchronous=synchronous)
+        self.connection.executescript(SCHEMA)
+        self.reader = None  # Separate connection for following changes, so reads never join a write
+
+    def load(self,
+             connection: sqlite3.Connection = None) -> dict:
+
+        # FUNCTION: Build the data dict from the database, in one read transaction
+
+        # PARAMS:
+        #   * connection: sqlite3.Connection: Connection to read with, or None for the main connection
+
+        # RETURNS:
+        #   * data: dict: Bot data in the data.json layout
+
+        io_2.log(ticker="storage",
+                 message="Loading data from '{}'...",
+                 args=(self.file_path,))
+
+        connection = connection or self.connection
+        data = {"configured": "True", "streams": {}}
+        for list_name in GLOBAL_LISTS:
+            data[list_name] = []
+        with connection:
+            connection.execute("BEGIN")
+            self.last_change = connection.execute("SELECT COALESCE(MAX(seq), 0) FROM changes").fetchone()[0]
+            for name, locked, origin_server in connection.execute(
+                    "SELECT name, locked, origin_server FROM streams ORDER BY rowid"):
+                data["streams"][name] = {
+                    "locked": locked,
+                    "origin_server": origin_server,
+                    "channels": [],
+                    "whitelist": [],
+                    "blacklist": []
+                }
+            for stream, channel in connection.execute(
+                    "SELECT stream, channel FROM stream_channels ORDER BY rowid"):
+                data["streams"][stream]["channels"].append(channel)
+            for stream, list_name, snowflake in connection.execute(
+                    "SELECT stream, list, snowflake FROM stream_lists ORDER BY rowid"):
+                data["streams"][stream][list_name].append(snowflake)
+            for list_name, snowflake in connection.execute(
+                    "SELECT list, snowflake FROM global_lists ORDER BY rowid"):
+                data[list_name].append(snowflake)
+
+        io_2.log(ticker="storage",
+                 message="Loaded {} streams from '{}'.",
+                 args=(len(data["streams"]), self.file_path))
+        return data
+
+    def write(self,
+              lines: list[bytes]) -> None:
+
+        # FUNCTION: Apply a batch of encoded records in one transaction, publishing them if this store has an origin.
+        # Each record gets its own savepoint, so one that no longer applies (e.g. a subscribe to a stream another
+        # process just deleted) is skipped, like journal.apply_records does, instead of failing the whole batch.
+
+        # PARAMS:
+        #   * lines: list[bytes]: Encoded records
+
+        now = time.time()
+        applied = []
+        with self.connection:
+            self.connection.execute("BEGIN IMMEDIATE")
+            for line in lines:
+                self.connection.execute("SAVEPOINT record")
+                try:
+                    self.apply(record=json.loads(line))
+                    applied.append(line)
+                except sqlite3.IntegrityError as error:
+                    self.connection.execute("ROLLBACK TO record")
+                    io_2.log(ticker="storage",
+                             message="Skipping record {} that does not apply: {!r}",
+                             args=(line.decode().rstrip(), error),
+                             level=io_2.WARN)
+                self.connection.execute("RELEASE record")
+            if self.origin is not None:
+                self.connection.executemany("INSERT INTO changes (origin, created, record) VALUES (?, ?, ?)",
+                                            ((self.origin, now, line.decode()) for line in applied))
+                if now - self.last_prune > self.change_retention / 10:
+                    self.connection.execute("DELETE FROM changes WHERE created < ?",
+                                            (now - self.change_retention,))
+                    self.last_prune = now
+
+    def changes_since(self) -> (list[dict], set):
+
+        # FUNCTION: Get changes published by other processes since the last call. Runs in a worker thread.
+
+        # RETURNS:
+        #   * records: list[dict]: Change records, in commit order
+        #   * later_keys: set: Keys (see record_keys) changed by this process after the first of those records was
+        #     committed, which memory already holds ahead of it
+
+        if self.reader is None:
+            self.reader = connect(file_path=self.file_path)
+        rows = self.reader.execute("SELECT seq, origin, record FROM changes WHERE seq > ? ORDER BY seq",
+                                   (self.last_change,)).fetchall()
+        if rows:
+            self.last_change = rows[-1][0]
+        records = []
+        later_keys = set()
+        for seq, origin, record in rows:
+            if origin != self.origin:
+                records.append(json.loads(record))
+            elif records:
+                later_keys |= record_keys(record=json.loads(record))
+        return records, later_keys
+
+    def apply(self,
+              record: dict) -> None:
+
+        # FUNCTION: Apply one change record as SQL (see state.apply). Must run inside a transaction.
+
+        # PARAMS:
+        #   * record: dict: Change record
+
+        op = record["op"]
+        execute = self.connection.execute
+
+        # Stream changes
+        if op == "stream_create":
+            self.insert_stream(name=record["name"],
+                               stream=record["stream"])
+        elif op == "stream_delete":
+            self.delete_stream(name=record["name"])
+
+        # Subscription changes
+        elif op == "subscribe":
+            execute("INSERT OR IGNORE INTO stream_channels (stream, channel) VALUES (?, ?)",
+                    (record["name"], record["channel"]))
+        elif op == "unsubscribe":
+            execute("DELETE FROM stream_channels WHERE stream = ? AND channel = ?",
+                    (record["name"], record["channel"]))
+
+        # Stream whitelist changes
+        elif op == "authorize":
+            execute("INSERT OR IGNORE INTO stream_lists (stream, list, snowflake) VALUES (?, 'whitelist', ?)",
+                    (record["name"], record["snowflake"]))
+        elif op == "unauthorize":
+            execute("DELETE FROM stream_lists WHERE stream = ? AND list = 'whitelist' AND snowflake = ?",
+                    (record["name"], record["snowflake"]))
+
+        # Global list changes
+        elif op == "list_add":
+            execute("INSERT OR IGNORE INTO global_lists (list, snowflake) VALUES (?, ?)",
+                    (record["list"], record["snowflake"]))
+        elif op == "list_remove":
+            execute("DELETE FROM global_lists WHERE list = ? AND snowflake = ?",
+                    (record["list"], record["snowflake"]))
+        elif op == "list_add_many":
+            self.connection.executemany("INSERT OR IGNORE INTO global_lists (list, snowflake) VALUES (?, ?)",
+                                        ((record["list"], snowflake) for snowflake in record["snowflakes"]))
+        elif op == "list_remove_many":
+            self.connection.executemany("DELETE FROM global_lists WHERE list = ? AND snowflake = ?",
+                                        ((record["list"], snowflake) for snowflake in record["snowflakes"]))
+
+        else:
+            raise ValueError(f"Unknown record op '{op}'")
+
+    def insert_stream(self,
+                      name: str,
+                      stream: dict) -> None:
+
+        # FUNCTION: Insert a stream with its channels and lists, replacing any stream of the same name
+
+        # PARAMS:
+        #   * name: str: Stream name
+        #   * stream: dict: Stream data
+
+        self.delete_stream(name=name)
+        self.connection.execute("INSERT INTO streams (name, locked, origin_server) VALUES (?, ?, ?)",
+                                (name, stream["locked"], stream["origin_server"]))
+        self.connection.executemany("INSERT OR IGNORE INTO stream_channels (stream, channel) VALUES (?, ?)",
+                                    ((name, channel) for channel in stream["channels"]))
+        for list_name in STREAM_LISTS:
+            self.connection.executemany("INSERT OR IGNORE INTO stream_lists (stream, list, snowflake) VALUES (?, ?, ?)",
+                                        ((name, list_name, snowflake) for snowflake in stream.get(list_name, [])))
+
+    def delete_stream(self,
+                      name: str) -> None:
+
+        # FUNCTION: Delete a stream with its channels and lists
+
+        # PARAMS:
+        #   * name: str: Stream name
+
+        self.connection.execute("DELETE FROM stream_channels WHERE stream = ?", (name,))
+        self.connection.execute("DELETE FROM stream_lists WHERE stream = ?", (name,))
+        self.connection.execute("DELETE FROM streams WHERE name = ?", (name,))
+
+    def close(self) -> None:
+
+        # FUNCTION: Close the database
+
+        self.connection.close()
+        if self.reader is not None:
+            self.reader.close()
+
+
+# FUNCTIONS
+def connect(file_path: str,
+            synchronous: str = "FULL") -> sqlite3.Connection:
+
+    # FUNCTION: Open the database in WAL mode, waiting on locks held by other processes instead of failing
+
+    # PARAMS:
+    #   * file_path: str: Path to database
+    #   * synchronous: str: SQLite synchronous pragma
+
+    # RETURNS:
+    #   * connection: sqlite3.Connection: Connection in autocommit mode, usable from any thread
+
+    connection = sqlite3.connect(file_path,
+                                 check_same_thread=False,
+                                 isolation_level=None,
+                                 timeout=30.0)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute(f"PRAGMA synchronous={synchronous}")
+    connection.execute("PRAGMA foreign_keys=ON")
+    return connection
+
+
+def record_keys(record: dict) -> set:
+
+    # FUNCTION: Get the parts of the data a change record touches, to tell whether two changes commute
+
+    # PARAMS:
+    #   * record: dict: Change record
+
+    # RETURNS:
+    #   * keys: set: ("stream", name) for stream changes, ("list", list name, id) for each global list id
+
+    if "name" in record:
+        return {("stream", record["name"])}
+    if "snowflakes" in record:
+        return {("list", record["list"], str(snowflake)) for snowflake in record["snowflakes"]}
+    return {("list", record["list"], str(record["snowflake"]))}
+
+
+async def follow_changes(store: SQLiteStore,
+                         interval: float) -> None:
+
+    # FUNCTION: Apply changes made by other processes to common.data, polling every interval.
+    # Changes made here are applied in memory as soon as they are made, so a change from another process that was
+    # committed before one made here would land on top of it, in the wrong order. When the two touch the same data,
+    # or a change no longer applies (e.g. it subscribes to a stream deleted here meanwhile), everything is reloaded
+    # from the database instead, which holds the order the changes were committed in. Writes are held off while
+    # following, and changes made here but not yet written are applied again on top of a reload.
+
+    # PARAMS:
+    #   * store: SQLiteStore: Store with an origin
+    #   * interval: float: Seconds between polls
+
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        async with store.writing:
+
+            # Fetch
+            try:
+                records, later_keys = await loop.run_in_executor(None, store.changes_since)
+            except sqlite3.Error as error:
+                io_2.log(ticker="storage",
+                         message="Could not read changes: {!r}",
+                         args=(error,),
+                         level=io_2.WARN)
+                continue
+
+            # Check the order against changes made here, committed after them or not yet written
+            local_keys = later_keys.union(*(record_keys(record=json.loads(line)) for line, future in store.pending))
+            remote_keys = set().union(*(record_keys(record=record) for record in records))
+            reason = "it conflicts with a later change made here" if local_keys & remote_keys else None
+
+            # Apply
+            if reason is None:
+                try:
+                    for record in records:
+                        state.receive(record=record)
+                except (KeyError, ValueError) as error:
+                    reason = f"{error!r}"
+
+            # Reload
+            if reason is not None:
+                io_2.log(ticker="storage",
+                         message="Change did not apply in order ({}). Reloading from '{}'...",
+                         args=(reason, store.file_path),
+                         level=io_2.WARN)
+                data = await loop.run_in_executor(None, store.load, store.reader)
+                state.replace(data=data)
+                for line, future in store.pending:
+                    state.receive(record=json.loads(line))
+
+
+def migrate(data_path: str,
+            database_path: str,
+            journal_path: str = None,
+            defaults_path: str = "defaults/data_defaults.json") -> int:
+
+    # FUNCTION: One-shot copy of data.json (plus any unfolded journal) into an empty SQLite database
+
+    # PARAMS:
+    #   * data_path: str: Path to data.json
+    #   * database_path: str: Path to database to create
+    #   * journal_path: str: Path to the journal to replay on top of data.json, if any
+    #   * defaults_path: str: Data used when data.json is missing or not configured
+
+    # RETURNS:
+    #   * streams: int: Number of streams migrated
+
+    # Read data.json, falling back to defaults like the bot does
+    try:
+        data = io_2.read_json(file_path=data_path)
+        if data["configured"] != "True":
+            raise ValueError("data not configured")
+    except (OSError, ValueError, KeyError):
+        io_2.log(ticker="storage",
+                 message="'{}' could not be used. Migrating '{}' instead...",
+                 args=(data_path, defaults_path),
+                 level=io_2.WARN)
+        data = io_2.read_json(file_path=defaults_path)
+
+    # Replay unfolded journal
+    if journal_path is not None:
+        for path in (f"{journal_path}.old", journal_path):
+            journal.apply_records(data=data,
+                                  file_path=path)
+
+    # Write everything in one transaction
+    store = SQLiteStore(file_path=database_path)
+    if store.connection.execute("SELECT EXISTS (SELECT 1 FROM streams)").fetchone()[0]:
+        store.close()
+        raise ValueError(f"'{database_path}' already has data")
+    with store.connection:
+        store.connection.execute("BEGIN")
+        for name, stream in data["streams"].items():
+            store.insert_stream(name=name,
+                                stream=stream)
+        for list_name in GLOBAL_LISTS:
+            store.connection.executemany("INSERT OR IGNORE INTO global_lists (list, snowflake) VALUES (?, ?)",
+                                         ((list_name, snowflake) for snowflake in data.get(list_name, [])))
+    store.close()
+
+    io_2.log(ticker="storage",
+             message="Migrated {} streams into '{}'.",
+             args=(len(data["streams"]), database_path))
+    return len(data["streams"])
+
+
+# MAIN
+if __name__ == "__main__":
+
+    # Usage: python storage.py [data.json] [database] [journal]
+    migrate(data_path=sys.argv[1] if len(sys.argv) > 1 else "data/data.json",
+            database_path=sys.argv[2] if len(sys.argv) > 2 else "data/data.sqlite3",
+            journal_path=sys.argv[3] if len(sys.argv) > 3 else "data/journal.jsonl")
@@ -0,0 +1,375 @@
+# FILE: Stream indexes
+
+
+# DEPENDENCIES
+import bisect
+
+
+# CLASSES
+class SubscriptionIndex:
+
+    # CLASS: Reverse indexes from channel and origin server to stream names, kept in sync through state records.
+
+    def __init__(self,
+                 data: dict) -> None:
+
+        # PARAMS:
+        #   * data: dict: Bot data to index
+
+        self.channels = {}  # Channel id -> names of streams it is subscribed to
+        self.servers = {}  # Server id -> names of streams created there
+        self.stream_channels = {}  # Stream name -> subscribed channel ids
+        self.stream_servers = {}  # Stream name -> origin server id
+        self.build(data=data)
+
+    def build(self,
+              data: dict) -> None:
+
+        # FUNCTION: (Re)build the indexes from data
+
+        # PARAMS:
+        #   * data: dict: Bot data to index
+
+        self.channels.clear()
+        self.servers.clear()
+        self.stream_channels.clear()
+        self.stream_servers.clear()
+        for name, stream in data["streams"].items():
+            self.create_stream(name=name,
+                               stream=stream)
+
+    def create_stream(self,
+                      name: str,
+                      stream: dict) -> None:
+
+        # FUNCTION: Index a stream and its subscriptions
+
+        # PARAMS:
+        #   * name: str: Stream name
+        #   * stream: dict: Stream data
+
+        self.delete_stream(name=name)
+        self.stream_servers[name] = stream["origin_server"]
+        self.servers.setdefault(stream["origin_server"], set()).add(name)
+        self.stream_channels[name] = set()
+        for channel_id in stream["channels"]:
+            self.subscribe(name=name,
+                           channel_id=channel_id)
+
+    def delete_stream(self,
+                      name: str) -> None:
+
+        # FUNCTION: Drop a stream and its subscriptions
+
+        # PARAMS:
+        #   * name: str: Stream name
+
+        for channel_id in self.stream_channels.pop(name, ()):
+            discard(index=self.channels,
+                    key=channel_id,
+                    name=name)
+        server_id = self.stream_servers.pop(name, None)
+        if server_id is not None:
+            discard(index=self.servers,
+                    key=server_id,
+                    name=name)
+
+    def subscribe(self,
+                  name: str,
+                  channel_id: int) -> None:
+
+        # FUNCTION: Index a subscription
+
+        # PARAMS:
+        #   * name: str: Stream name
+        #   * channel_id: int: Subscribed channel
+
+        self.stream_channels[name].add(channel_id)
+        self.channels.setdefault(channel_id, set()).add(name)
+
+    def unsubscribe(self,
+                    name: str,
+                    channel_id: int) -> None:
+
+        # FUNCTION: Drop a subscription
+
+        # PARAMS:
+        #   * name: str: Stream name
+        #   * channel_id: int: Unsubscribed channel
+
+        self.stream_channels[name].discard(channel_id)
+        discard(index=self.channels,
+                key=channel_id,
+                name=name)
+
+    def apply(self,
+              record: dict) -> None:
+
+        # FUNCTION: Update the indexes for a change record (see state.apply)
+
+        # PARAMS:
+        #   * record: dict: Change record
+
+        op = record["op"]
+        if op == "stream_create":
+            self.create_stream(name=record["name"],
+                               stream=record["stream"])
+        elif op == "stream_delete":
+            self.delete_stream(name=record["name"])
+        elif op == "subscribe":
+            self.subscribe(name=record["name"],
+                           channel_id=record["channel"])
+        elif op == "unsubscribe":
+            self.unsubscribe(name=record["name"],
+                             channel_id=record["channel"])
+
+    def streams_for_channel(self,
+                            channel_id: int) -> set[str]:
+
+        # FUNCTION: Get the streams a channel is subscribed to
+
+        # PARAMS:
+        #   * channel_id: int: Channel id
+
+        # RETURNS:
+        #   * names: set[str]: Stream names
+
+        return self.channels.get(channel_id, set())
+
+    def streams_for_server(self,
+                           server_id: int) -> set[str]:
+
+        # FUNCTION: Get the streams created in a server
+
+        # PARAMS:
+        #   * server_id: int: Server id
+
+        # RETURNS:
+        #   * names: set[str]: Stream names
+
+        return self.servers.get(server_id, set())
+
+
+class StreamNameIndex:
+
+    # CLASS: Sorted stream names for prefix search, plus which streams each id is whitelisted to, kept in sync
+    # through state records. Used for autocomplete, so it answers without scanning every stream.
+
+    def __init__(self,
+                 data: dict) -> None:
+
+        # PARAMS:
+        #   * data: dict: Bot data to index
+
+        self.names = []  # Sorted stream names
+        self.grants = {}  # Id -> names of streams whitelisting it
+        self.stream_grants = {}  # Stream name -> whitelisted ids
+        self.build(data=data)
+
+    def build(self,
+              data: dict) -> None:
+
+        # FUNCTION: (Re)build the index from data
+
+        # PARAMS:
+        #   * data: dict: Bot data to index
+
+        self.names = sorted(data["streams"])
+        self.grants.clear()
+        self.stream_grants.clear()
+        for name, stream in data["streams"].items():
+            self.grant_stream(name=name,
+                              stream=stream)
+
+    def grant_stream(self,
+                     name: str,
+                     stream: dict) -> None:
+
+        # FUNCTION: Index a stream's whitelist
+
+        # PARAMS:
+        #   * name: str: Stream name
+        #   * stream: dict: Stream data
+
+        self.stream_grants[name] = set()
+        for snowflake in stream.get("whitelist", ()):
+            self.authorize(name=name,
+                           snowflake=snowflake)
+
+    def create_stream(self,
+                      name: str,
+                      stream: dict) -> None:
+
+        # FUNCTION: Index a new stream
+
+        # PARAMS:
+        #   * name: str: Stream name
+        #   * stream: dict: Stream data
+
+        self.delete_stream(name=name)
+        bisect.insort(self.names, name)
+        self.grant_stream(name=name,
+                          stream=stream)
+
+    def delete_stream(self,
+                      name: str) -> None:
+
+        # FUNCTION: Drop a stream
+
+        # PARAMS:
+        #   * name: str: Stream name
+
+        position = bisect.bisect_left(self.names, name)
+        if position < len(self.names) and self.names[position] == name:
+            del self.names[position]
+        for snowflake in self.stream_grants.pop(name, ()):
+            discard(index=self.grants,
+                    key=snowflake,
+                    name=name)
+
+    def authorize(self,
+                  name: str,
+                  snowflake: int) -> None:
+
+        # FUNCTION: Index an id whitelisted to a stream
+
+        # PARAMS:
+        #   * name: str: Stream name
+        #   * snowflake: int: Whitelisted id
+
+        self.stream_grants[name].add(snowflake)
+        self.grants.setdefault(snowflake, set()).add(name)
+
+    def unauthorize(self,
+                    name: str,
+                    snowflake: int) -> None:
+
+        # FUNCTION: Drop an id no longer whitelisted to a stream
+
+        # PARAMS:
+        #   * name: str: Stream name
+        #   * snowflake: int: De-whitelisted id
+
+        self.stream_grants[name].discard(snowflake)
+        discard(index=self.grants,
+                key=snowflake,
+                name=name)
+
+    def apply(self,
+              record: dict) -> None:
+
+        # FUNCTION: Update the index for a change record (see state.apply)
+
+        # PARAMS:
+        #   * record: dict: Change record
+
+        op = record["op"]
+        if op == "stream_create":
+            self.create_stream(name=record["name"],
+                               stream=record["stream"])
+        elif op == "stream_delete":
+            self.delete_stream(name=record["name"])
+        elif op == "authorize":
+            self.authorize(name=record["name"],
+                           snowflake=record["snowflake"])
+        elif op == "unauthorize":
+            self.unauthorize(name=record["name"],
+                             snowflake=record["snowflake"])
+
+    def complete(self,
+                 prefix: str,
+                 limit: int = 25) -> list[str]:
+
+        # FUNCTION: Get the first stream names starting with a prefix
+
+        # PARAMS:
+        #   * prefix: str: Typed prefix
+        #   * limit: int: Maximum names, 25 for Discord autocomplete
+
+        # RETURNS:
+        #   * names: list[str]: Names, sorted
+
+        position = bisect.bisect_left(self.names, prefix)
+        names = []
+        for name in self.names[position:position + limit]:
+            if not name.startswith(prefix):
+                break
+            names.append(name)
+        return names
+
+    def granted(self,
+                snowflakes: list[int],
+                prefix: str = "") -> set[str]:
+
+        # FUNCTION: Get the streams whitelisting any of the given ids, starting with a prefix
+
+        # PARAMS:
+        #   * snowflakes: list[int]: Ids, e.g. a user's roles, user, channel and server
+        #   * prefix: str: Typed prefix
+
+        # RETURNS:
+        #   * names: set[str]: Stream names
+
+        names = set()
+        for snowflake in snowflakes:
+            names.update(name for name in self.grants.get(snowflake, ()) if name.startswith(prefix))
+        return names
+
+
+# FUNCTIONS
+def discard(index: dict,
+            key: int,
+            name: str) -> None:
+
+    # FUNCTION: Remove a stream name from a reverse index entry, dropping the entry once empty
+
+    # PARAMS:
+    #   * index: dict: Reverse index
+    #   * key: int: Channel, server or whitelisted id
+    #   * name: str: Stream name
+
+    names = index.get(key)
+    if names is not None:
+        names.discard(name)
+        if not names:
+            del index[key]
+
+
+# TESTING
+if __name__ == "__main__":
+    import random
+    import string
+    import timeit
+
+    # 50k streams, each whitelisting its origin server
+    random.seed(0)
+    servers = [random.getrandbits(60) for _ in range(5000)]
+    data = {"streams": {}}
+    for _ in range(50_000):
+        name = "".join(random.choices(string.ascii_lowercase + "-", k=random.randint(4, 16)))
+        data["streams"][name] = {"origin_server": random.choice(servers), "channels": [],
+                                 "whitelist": [random.choice(servers)], "blacklist": []}
+    index = StreamNameIndex(data=data)
+    scan = list(data["streams"])
+
+    for prefix in ("", "r", "ra", "rai"):
+        number = 10_000
+        indexed = min(timeit.repeat(lambda: index.complete(prefix=prefix), number=number, repeat=5)) / number
+        scanned = min(timeit.repeat(lambda: sorted(name for name in scan if name.startswith(prefix))[:25],
+                                    number=10, repeat=3)) / 10
+        granted = min(timeit.repeat(lambda: index.granted(snowflakes=[servers[0]] + servers[-50:], prefix=prefix),
+                                    number=number, repeat=5)) / number
+        print(f"prefix '{prefix}': index {indexed * 1e6:.2f} us, scan {scanned * 1e6:.0f} us, "
+              f"granted {granted * 1e6:.2f} us")
+
+    # Incremental changes match a rebuild
+    for name in scan[:1000]:
+        index.apply(record={"op": "stream_delete", "name": name})
+    index.apply(record={"op": "stream_create", "name": "raindrop",
+                        "stream": {"origin_server": 1, "channels": [], "whitelist": [1], "blacklist": []}})
+    index.apply(record={"op": "authorize", "name": "raindrop", "snowflake": 2})
+    for name in scan[:1000]:
+        del data["streams"][name]
+    data["streams"]["raindrop"] = {"origin_server": 1, "channels": [], "whitelist": [1, 2], "blacklist": []}
+    rebuilt = StreamNameIndex(data=data)
+    print(f"consistent: {index.names == rebuilt.names and index.grants == rebuilt.grants}")